@@ -103,6 +103,32 @@ try:
 except Exception as e:
     print(f"[AVISO] Erro ao registrar blueprints: {e}")
 
+# ============================================================================
+# INICIALIZAÇÃO DOS SERVIÇOS
+# ============================================================================
+
+try:
+    from backend.services.matching import MatchingService
+    db = get_session(engine)
+    try:
+        # Banco sem estatísticas populacionais: reconstrói uma vez aqui, nunca numa requisição
+        rebuilt = MatchingService(db).ensure_population_stats()
+        if rebuilt:
+            print(f"[OK] Estatísticas populacionais reconstruídas: {rebuilt}")
+    finally:
+        db.close()
+except Exception as e:
+    print(f"[AVISO] Erro ao inicializar estatísticas populacionais: {e}")
+
+try:
+    from backend.api.routes import get_db
+    from backend.services.jobs import get_job_manager
+    # Retoma jobs de lote pendentes/abandonados agora e, depois, periodicamente
+    get_job_manager(get_db)
+    print("[OK] Jobs de lote: retomada automática ativa")
+except Exception as e:
+    print(f"[AVISO] Erro ao iniciar jobs de lote: {e}")
+
 # ============================================================================
 # ROTAS PRINCIPAIS
 # ============================================================================
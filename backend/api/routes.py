@@ -3,17 +3,27 @@ API REST - Rotas Principais
 Sistema de Acasalamento de Gado Leiteiro
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 from werkzeug.utils import secure_filename
 from sqlalchemy import or_, create_engine
 from sqlalchemy.orm import sessionmaker
 import os
+import json
+import numpy as np
 from datetime import datetime
 
-from backend.models.database import Female, Bull, Mating, BatchMating, Base
+from backend.models.database import Female, Bull, Mating, BatchMating, BatchJob, SelectionIndex, Base
 from backend.services.importer import DataImporter
 from backend.services.matching import MatchingService
-from backend.services.genetics import genetic_calculator, genetic_calculator_complete
+from backend.services.jobs import get_job_manager, job_status, job_results
+from backend.services.parallel import CHUNK_SIZE
+from backend.services.genetics import genetic_calculator, detail_level
+from backend.services.panels import get_bull_panel, NUMERIC_COLUMNS
+from backend.services.pedigree import get_pedigree, animal_key
+from backend.services.population import POPULATIONS, load_moments
+from backend.services.formulas import compile_formula, stored_formula
+from backend.services.diversity import DIVERSITY_OPTIONS, DiversityRule
+from backend.services.traits import TRAITS
 
 
 # Criar blueprint
@@ -63,6 +73,45 @@ def get_db():
     return _SessionLocal()
 
 
+def get_workers(data) -> int:
+    """
+    Processos para lotes paralelos: só quando o pedido traz `workers` (limitado aos núcleos).
+    O padrão é 1 (scoring no próprio processo): um pool novo por requisição faria fork do
+    worker do servidor, com threads e conexões do banco abertas, a cada lote grande.
+    """
+    cores = os.cpu_count() or 1
+    return max(1, min(int(data.get('workers', 1)), cores))
+
+
+def get_detail(data, default: str):
+    """
+    Projeção pedida (corpo JSON ou query string): `detail` = summary|categories|full e
+    `fields` = lista (ou 'a,b') das chaves a manter em cada item
+    """
+    fields = data.get('fields', request.args.get('fields'))
+    if isinstance(fields, str):
+        fields = [name.strip() for name in fields.split(',') if name.strip()]
+    return detail_level(data.get('detail', request.args.get('detail')), default), fields or None
+
+
+def get_formula(db, data):
+    """
+    Índice personalizado pedido (corpo JSON ou query string): expressão em `formula`
+    ou nome de um índice salvo em `index`; None = ordenar pelo IEP
+    """
+    name = data.get('index', request.args.get('index'))
+    if name:
+        return stored_formula(db, name)
+    return data.get('formula', request.args.get('formula')) or None
+
+
+def project(item: dict, fields) -> dict:
+    """Mantém só as chaves de `fields` (None = todas)"""
+    if not fields:
+        return item
+    return {key: value for key, value in item.items() if key in fields}
+
+
 # ============================================================================
 # FÊMEAS (FEMALES)
 # ============================================================================
@@ -133,6 +182,39 @@ def get_female(female_id):
         db.close()
 
 
+@api.route('/females/<int:female_id>/recommendations', methods=['GET'])
+def get_female_recommendations(female_id):
+    """Melhores touros para uma fêmea (lidos da matriz materializada de scores)"""
+    db = get_db()
+    
+    try:
+        formula = get_formula(db, request.args)
+        if formula:
+            compile_formula(formula)
+        # Diversidade por query string: max_per_sire, max_per_mgs, coancestry_penalty
+        diversity = {name: request.args[name] for name in DIVERSITY_OPTIONS if request.args.get(name)}
+        DiversityRule.parse(diversity)
+    except ValueError as e:
+        db.close()
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        matching_service = MatchingService(db)
+        result = matching_service.recommend_for_female(
+            female_id,
+            top_n=request.args.get('top_n', 10, type=int),
+            max_inbreeding=request.args.get('max_inbreeding', 8.0, type=float),
+            available_only=request.args.get('available_only', 'true').lower() == 'true',
+            formula=formula,
+            diversity=diversity
+        )
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    finally:
+        db.close()
+
+
 @api.route('/females/import', methods=['POST'])
 def import_females():
     """Importa fêmeas de arquivo Excel"""
@@ -155,7 +237,7 @@ def import_females():
     
     try:
         db = get_db()
-        importer = DataImporter(db)
+        importer = DataImporter(db, refresh_matrix=get_job_manager(get_db).refresh_score_matrix)
         stats = importer.import_females_from_excel(filepath, user)
         os.remove(filepath)
         
@@ -186,6 +268,48 @@ def get_bulls():
         search = request.args.get('search', '')
         sort_by = request.args.get('sort_by', 'net_merit')
         sort_order = request.args.get('sort_order', 'desc')
+        formula = get_formula(db, request.args)
+        
+        # Índice personalizado: avaliado no catálogo inteiro do painel numa passada e usado na ordenação
+        if formula:
+            panel, index, values = MatchingService(db).bull_index_values(formula)
+            filters = {name: request.args.get(name) for name in ['min_milk', 'min_net_merit', 'min_productive_life', 'beta_casein', 'max_gfi']}
+            mask = panel.filter_mask(filters, available_only=available_only)
+            if search:
+                term = search.lower()
+                mask &= np.array([term in (code or '').lower() or term in (name or '').lower()
+                                  for code, name in zip(panel.codes, panel.names)], dtype=bool)
+            rows = np.flatnonzero(mask)
+            rows = panel.order_values(rows, values[rows], descending=sort_order == 'desc')
+            total = len(rows)
+            page_rows = rows[(page - 1) * per_page:page * per_page]
+            
+            return jsonify({
+                'total': total,
+                'page': page,
+                'per_page': per_page,
+                'total_pages': (total + per_page - 1) // per_page,
+                'index_formula': index.expression,
+                'bulls': [{**panel.summaries[i], 'index_value': None if np.isnan(values[i]) else round(float(values[i]), 3)}
+                          for i in page_rows]
+            })
+        
+        # Sem busca textual: filtra, ordena e pagina direto do painel em cache
+        if not search and sort_by in NUMERIC_COLUMNS:
+            panel = get_bull_panel(db)
+            filters = {name: request.args.get(name) for name in ['min_milk', 'min_net_merit', 'min_productive_life', 'beta_casein', 'max_gfi']}
+            rows = np.flatnonzero(panel.filter_mask(filters, available_only=available_only))
+            rows = panel.order_by(rows, sort_by, descending=sort_order == 'desc')
+            total = len(rows)
+            page_rows = rows[(page - 1) * per_page:page * per_page]
+            
+            return jsonify({
+                'total': total,
+                'page': page,
+                'per_page': per_page,
+                'total_pages': (total + per_page - 1) // per_page,
+                'bulls': [panel.summaries[i] for i in page_rows]
+            })
         
         query = db.query(Bull)
         
@@ -232,6 +356,8 @@ def get_bulls():
             'total_pages': (total + per_page - 1) // per_page,
             'bulls': [b.to_dict() for b in bulls]
         })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     finally:
         db.close()
 
@@ -266,6 +392,60 @@ def get_bull(bull_code):
         db.close()
 
 
+@api.route('/bulls/<bull_code>/best-females', methods=['GET'])
+def get_bull_best_females(bull_code):
+    """Melhores fêmeas ativas do rebanho para um touro (ranking reverso, paginado)"""
+    db = get_db()
+    
+    try:
+        if not db.query(Bull.id).filter(Bull.code == bull_code).first():
+            return jsonify({'error': 'Touro não encontrado'}), 404
+        
+        priorities = request.args.get('priorities')
+        result = MatchingService(db).best_females_for_bull(
+            bull_code,
+            page=request.args.get('page', 1, type=int),
+            per_page=request.args.get('per_page', 20, type=int),
+            top_n=request.args.get('top_n', 100, type=int),
+            max_inbreeding=request.args.get('max_inbreeding', 6.0, type=float),
+            priorities=json.loads(priorities) if priorities else None,
+            formula=get_formula(db, request.args)
+        )
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
+
+@api.route('/bulls/<bull_code>/similar', methods=['GET'])
+def get_similar_bulls(bull_code):
+    """Touros parecidos com este (substitutos quando o sêmen acaba)"""
+    db = get_db()
+    
+    try:
+        if not db.query(Bull.id).filter(Bull.code == bull_code).first():
+            return jsonify({'error': 'Touro não encontrado'}), 404
+        
+        filters = {name: request.args.get(name) for name in ['beta_casein', 'source', 'max_gfi', 'min_milk', 'min_net_merit', 'min_productive_life']}
+        result = MatchingService(db).similar_bulls(
+            bull_code,
+            k=request.args.get('k', 10, type=int),
+            filters=filters,
+            available_only=request.args.get('available_only', 'true').lower() == 'true',
+            in_stock=request.args.get('in_stock', 'false').lower() == 'true'
+        )
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
+
 @api.route('/bulls/import', methods=['POST'])
 def import_bulls():
     """Importa touros de arquivo PDF"""
@@ -285,7 +465,7 @@ def import_bulls():
     
     try:
         db = get_db()
-        importer = DataImporter(db)
+        importer = DataImporter(db, refresh_matrix=get_job_manager(get_db).refresh_score_matrix)
         stats = importer.import_bulls_from_pdf(filepath, user)
         os.remove(filepath)
         
@@ -300,6 +480,163 @@ def import_bulls():
         return jsonify({'error': str(e)}), 500
 
 
+# ============================================================================
+# PEDIGREE
+# ============================================================================
+
+@api.route('/pedigree/coancestry', methods=['GET'])
+def get_pedigree_coancestry():
+    """Consanguinidade (F) de uma fêmea e de um touro e a coancestria do par pelo pedigree"""
+    female_id = request.args.get('female_id', type=int)
+    bull_code = request.args.get('bull_code')
+    
+    if not female_id or not bull_code:
+        return jsonify({'error': 'female_id e bull_code são obrigatórios'}), 400
+    
+    db = get_db()
+    
+    try:
+        female = db.query(Female).get(female_id)
+        bull = db.query(Bull).filter(Bull.code == bull_code).first()
+        
+        if not female:
+            return jsonify({'error': 'Fêmea não encontrada'}), 404
+        if not bull:
+            return jsonify({'error': 'Touro não encontrado'}), 404
+        
+        pedigree = get_pedigree(db)
+        female_key = animal_key({'reg_id': female.reg_id, 'internal_id': female.internal_id})
+        bull_key = animal_key({'code': bull.code, 'naab_code': bull.naab_code, 'reg_id': bull.reg_id}, is_bull=True)
+        female_f = pedigree.inbreeding_of(female_key)
+        bull_f = pedigree.inbreeding_of(bull_key)
+        coancestry = pedigree.coancestry(female_key, bull_key)
+        
+        return jsonify({
+            'female': {'id': female.id, 'reg_id': female.reg_id, 'inbreeding': round(female_f * 100, 3) if female_f is not None else None},
+            'bull': {'id': bull.id, 'code': bull.code, 'inbreeding': round(bull_f * 100, 3) if bull_f is not None else None},
+            'coancestry': round(coancestry, 5) if coancestry is not None else None,
+            'expected_progeny_inbreeding': round(coancestry * 100, 3) if coancestry is not None else None,
+            'pedigree_size': len(pedigree)
+        })
+    finally:
+        db.close()
+
+
+@api.route('/population-stats', methods=['GET'])
+def get_population_statistics():
+    """Momentos (n, média, desvio) de cada população na versão ativa e as estatísticas em uso"""
+    db = get_db()
+    
+    try:
+        matching_service = MatchingService(db)
+        populations = {}
+        for population in POPULATIONS:
+            version, moments = load_moments(db, population)
+            if moments is None:
+                continue
+            std = moments.std()
+            populations[population] = {
+                'version': version,
+                'traits': {trait: {'n': int(moments.n[t]), 'mean': round(float(moments.mean[t]), 4), 'std': round(float(std[t]), 4)}
+                           for t, trait in enumerate(TRAITS) if moments.n[t] > 0}
+            }
+        
+        return jsonify({
+            'active_versions': matching_service.calculator.population_version,
+            'stats_populations': list(matching_service.calculator.params.stats_populations),
+            'populations': populations,
+            'population_stats': matching_service.calculator.population_stats
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
+
+@api.route('/population-stats/rebuild', methods=['POST'])
+def rebuild_population_statistics():
+    """Recalcula as estatísticas populacionais do zero (nova versão de cada população)"""
+    db = get_db()
+    
+    try:
+        versions = MatchingService(db).rebuild_population_stats()
+        return jsonify({'versions': versions})
+    except Exception as e:
+        db.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
+
+# ============================================================================
+# ÍNDICES PERSONALIZADOS
+# ============================================================================
+
+@api.route('/indexes', methods=['GET'])
+def get_selection_indexes():
+    """Índices de seleção salvos (fórmulas sobre as características)"""
+    db = get_db()
+    
+    try:
+        indexes = db.query(SelectionIndex).order_by(SelectionIndex.name).all()
+        return jsonify({'indexes': [index.to_dict() for index in indexes]})
+    finally:
+        db.close()
+
+
+@api.route('/indexes', methods=['POST'])
+def save_selection_index():
+    """Salva (cria ou substitui pelo nome) um índice; a fórmula é validada antes de gravar"""
+    data = request.json
+    name = (data.get('name') or '').strip()
+    
+    if not name:
+        return jsonify({'error': 'name é obrigatório'}), 400
+    
+    db = get_db()
+    
+    try:
+        formula = compile_formula(data.get('expression'))
+        
+        index = db.query(SelectionIndex).filter(SelectionIndex.name == name).first()
+        created = index is None
+        if created:
+            index = SelectionIndex(name=name, created_by=data.get('user', 'Sistema'))
+            db.add(index)
+        index.expression = formula.expression
+        index.formula_hash = formula.digest
+        index.description = data.get('description', index.description)
+        db.commit()
+        
+        return jsonify(index.to_dict()), 201 if created else 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
+
+@api.route('/indexes/<name>', methods=['DELETE'])
+def delete_selection_index(name):
+    """Remove um índice salvo"""
+    db = get_db()
+    
+    try:
+        index = db.query(SelectionIndex).filter(SelectionIndex.name == name).first()
+        
+        if not index:
+            return jsonify({'error': 'Índice não encontrado'}), 404
+        
+        db.delete(index)
+        db.commit()
+        
+        return jsonify({'deleted': name})
+    finally:
+        db.close()
+
+
 # ============================================================================
 # ACASALAMENTOS (MATINGS)
 # ============================================================================
@@ -316,18 +653,25 @@ def create_manual_mating():
     if not female_id or not bull_id:
         return jsonify({'error': 'female_id e bull_id são obrigatórios'}), 400
     
+    try:
+        detail, fields = get_detail(data, 'full')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     db = get_db()
     
     try:
         matching_service = MatchingService(db)
-        result = matching_service.match_single(female_id, bull_id)
+        # `fields` escolhe as partes da análise; o PPPV por índice só é calculado se pedido
+        result = matching_service.match_single(female_id, bull_id, detail,
+                                               include_pppv=not fields or 'pppv' in fields)
         
         if save:
             mating = Mating(
                 female_id=female_id,
                 bull_id=bull_id,
                 mating_type='manual',
-                predicted_pppv=result['analysis']['pppv'],
+                predicted_pppv=result['analysis'].get('pppv'),
                 predicted_inbreeding=result['analysis']['inbreeding']['expected_inbreeding'],
                 compatibility_score=result['analysis']['compatibility']['score'],
                 status='planned',
@@ -338,6 +682,7 @@ def create_manual_mating():
             result['mating_id'] = mating.id
             result['saved'] = True
         
+        result['analysis'] = project(result['analysis'], fields)
         return jsonify(result)
     except ValueError as e:
         return jsonify({'error': str(e)}), 404
@@ -358,6 +703,11 @@ def analyze_mating_complete():
     if not female_id or not bull_id:
         return jsonify({'error': 'female_id e bull_id são obrigatórios'}), 400
     
+    try:
+        detail, fields = get_detail(data, 'full')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     db = get_db()
     
     try:
@@ -369,24 +719,28 @@ def analyze_mating_complete():
         if not bull:
             return jsonify({'error': 'Touro não encontrado'}), 404
         
-        female_data = female.to_dict(complete=True)
-        bull_data = bull.to_dict()
+        calc = MatchingService(db).calculator
+        include_pppv = detail == 'full' and (not fields or 'pppv' in fields)
         
-        calc = genetic_calculator_complete
+        # Cálculos (memoizados por par + parâmetros + prioridades + detalhe)
+        def analyze():
+            female_data = female.to_dict(complete=True)
+            bull_data = bull.to_dict()
+            analysis = {}
+            if include_pppv:
+                analysis['pppv'] = calc.calculate_pppv(female_data, bull_data)
+            analysis['inbreeding'] = calc.calculate_inbreeding(female_data, bull_data, detail)
+            analysis['compatibility'] = calc.calculate_compatibility_score(female_data, bull_data, data.get('priorities'), detail)
+            return analysis
         
-        # Cálculos
-        pppv = calc.calculate_pppv(female_data, bull_data)
-        inbreeding = calc.calculate_inbreeding(female_data, bull_data)
-        compatibility = calc.calculate_compatibility_score(female_data, bull_data, data.get('priorities'))
+        analysis = calc.memoize_pair('analyze_complete', female, bull, analyze,
+                                     options=(data.get('priorities'), detail, include_pppv))
+        inbreeding, compatibility = analysis['inbreeding'], analysis['compatibility']
         
         result = {
             'female': {'id': female.id, 'reg_id': female.reg_id, 'internal_id': female.internal_id},
             'bull': {'id': bull.id, 'code': bull.code, 'name': bull.name},
-            'analysis': {
-                'pppv': pppv,
-                'inbreeding': inbreeding,
-                'compatibility': compatibility
-            },
+            'analysis': project(analysis, fields),
             'recommendation': {
                 'acceptable': inbreeding['acceptable'] and compatibility['score'] >= 60,
                 'score': compatibility['score'],
@@ -422,22 +776,36 @@ def create_batch_mating():
     if not female_ids:
         return jsonify({'error': 'female_ids é obrigatório'}), 400
     
-    if len(female_ids) > 100:
-        return jsonify({'error': 'Máximo de 100 fêmeas por lote'}), 400
+    try:
+        detail, fields = get_detail(data, 'categories')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if data.get('stream', False):
+        return _stream_batch_mating(data, female_ids, detail, fields)
     
     db = get_db()
     
     try:
         matching_service = MatchingService(db)
         
+        # Lotes grandes (rebanho inteiro) são pontuados em paralelo, um processo por núcleo
         result = matching_service.match_batch(
             female_ids=female_ids,
             priorities=data.get('priorities'),
             max_inbreeding=data.get('max_inbreeding', 6.0),
             top_n=data.get('top_n', 5),
-            filters=data.get('filters')
+            filters=data.get('filters'),
+            workers=get_workers(data),
+            detail=detail,
+            formula=get_formula(db, data),
+            diversity=data.get('diversity')
         )
         
+        if fields:
+            for item in result['results']:
+                item['top_bulls'] = [project(bull, fields) for bull in item['top_bulls']]
+        
         if data.get('save', False):
             batch = BatchMating(
                 batch_name=data.get('batch_name', f'Lote {datetime.now().strftime("%Y-%m-%d %H:%M")}'),
@@ -454,12 +822,331 @@ def create_batch_mating():
             result['saved'] = True
         
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
+
+def _stream_batch_mating(data, female_ids, detail: str, fields):
+    """
+    Lote em NDJSON: uma linha por fêmea assim que o bloco dela é pontuado e uma linha
+    final {"summary": ...}. A sessão fica aberta até o fim da resposta.
+    """
+    if data.get('save', False):
+        return jsonify({'error': 'save não é suportado com stream; use /matings/jobs'}), 400
+    
+    db = get_db()
+    
+    try:
+        DiversityRule.parse(data.get('diversity'))
+        items = MatchingService(db).iter_batch(
+            female_ids=female_ids,
+            priorities=data.get('priorities'),
+            max_inbreeding=data.get('max_inbreeding', 6.0),
+            top_n=data.get('top_n', 5),
+            filters=data.get('filters'),
+            chunk_size=CHUNK_SIZE,
+            detail=detail,
+            formula=get_formula(db, data),
+            diversity=data.get('diversity')
+        )
+    except ValueError as e:
+        db.close()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.close()
+        return jsonify({'error': str(e)}), 500
+    
+    def generate():
+        try:
+            for item in items:
+                if fields and 'top_bulls' in item:
+                    item['top_bulls'] = [project(bull, fields) for bull in item['top_bulls']]
+                yield json.dumps(item, ensure_ascii=False) + '\n'
+        except Exception as e:
+            # O status 200 já foi enviado: o erro vira a última linha
+            yield json.dumps({'error': str(e)}, ensure_ascii=False) + '\n'
+        finally:
+            db.close()
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@api.route('/matings/profiles', methods=['POST'])
+def compare_weight_profiles():
+    """Lote ranqueado sob vários perfis de pesos de categoria numa só passada, com a sobreposição entre eles"""
+    data = request.json
+    female_ids = data.get('female_ids', [])
+    profiles = data.get('profiles')
+    
+    if not female_ids:
+        return jsonify({'error': 'female_ids é obrigatório'}), 400
+    
+    # Perfis: {"nome": {categoria: peso}} ou [{"name": ..., "weights": {...}}]
+    if isinstance(profiles, list):
+        profiles = {str(profile.get('name', f'perfil_{k + 1}')): profile.get('weights')
+                    for k, profile in enumerate(profiles) if isinstance(profile, dict)}
+    if not isinstance(profiles, dict) or not profiles:
+        return jsonify({'error': 'profiles é obrigatório'}), 400
+    
+    db = get_db()
+    
+    try:
+        matching_service = MatchingService(db)
+        
+        result = matching_service.match_profiles(
+            female_ids=female_ids,
+            profiles=profiles,
+            max_inbreeding=data.get('max_inbreeding', 6.0),
+            top_n=data.get('top_n', 5),
+            filters=data.get('filters'),
+            workers=get_workers(data)
+        )
+        
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
+
+@api.route('/matings/pareto', methods=['POST'])
+def get_pareto_bulls():
+    """Fronteira de Pareto (touros não dominados) de cada fêmea nos objetivos escolhidos"""
+    data = request.json
+    female_ids = data.get('female_ids') or ([data['female_id']] if data.get('female_id') else [])
+    
+    if not female_ids:
+        return jsonify({'error': 'female_id ou female_ids é obrigatório'}), 400
+    
+    db = get_db()
+    
+    try:
+        result = MatchingService(db).pareto_bulls(
+            female_ids=female_ids,
+            objectives=data.get('objectives'),
+            max_inbreeding=data.get('max_inbreeding', 6.0),
+            bull_codes=data.get('bull_codes'),
+            filters=data.get('filters'),
+            priorities=data.get('priorities')
+        )
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
+
+@api.route('/matings/jobs', methods=['POST'])
+def create_batch_job():
+    """Acasalamento em lote em segundo plano: retorna o id do job para acompanhar o progresso"""
+    data = request.json
+    female_ids = data.get('female_ids', [])
+    
+    if not female_ids:
+        return jsonify({'error': 'female_ids é obrigatório'}), 400
+    
+    db = get_db()
+    
+    try:
+        # O job guarda a expressão (índices salvos são resolvidos agora) já validada
+        formula = get_formula(db, data)
+        if formula:
+            formula = compile_formula(formula).expression
+        diversity = DiversityRule.parse(data.get('diversity'))
+        
+        job = get_job_manager(get_db).submit(db, female_ids, {
+            'priorities': data.get('priorities'),
+            'max_inbreeding': data.get('max_inbreeding', 6.0),
+            'top_n': data.get('top_n', 5),
+            'filters': data.get('filters'),
+            'formula': formula,
+            'diversity': diversity and diversity.as_dict(),
+            'batch_name': data.get('batch_name'),
+            'description': data.get('description')
+        }, created_by=data.get('user', 'Sistema'))
+        
+        return jsonify(job_status(job)), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
+
+@api.route('/matings/jobs/<int:job_id>', methods=['GET'])
+def get_batch_job(job_id):
+    """Status do job: fêmeas concluídas/total, ETA e id do lote salvo ao terminar"""
+    db = get_db()
+    
+    try:
+        # Jobs abandonados por um processo que reiniciou são retomados aqui
+        get_job_manager(get_db).resume_pending()
+        
+        job = db.query(BatchJob).get(job_id)
+        if not job:
+            return jsonify({'error': 'Job não encontrado'}), 404
+        
+        return jsonify(job_status(job))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
+
+@api.route('/matings/jobs/<int:job_id>/results', methods=['GET'])
+def get_batch_job_results(job_id):
+    """Resultados parciais (ou finais) do job, paginados na ordem do lote"""
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 50, type=int)
+    
+    db = get_db()
+    
+    try:
+        job = db.query(BatchJob).get(job_id)
+        if not job:
+            return jsonify({'error': 'Job não encontrado'}), 404
+        
+        return jsonify(job_results(db, job, max(page, 1), min(max(per_page, 1), 500)))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
+
+@api.route('/matings/allocate', methods=['POST'])
+def allocate_batch():
+    """Plano do lote: um touro por fêmea, maximizando o IEP total com estoque de doses e limite por touro"""
+    data = request.json
+    female_ids = data.get('female_ids', [])
+    
+    if not female_ids:
+        return jsonify({'error': 'female_ids é obrigatório'}), 400
+    
+    db = get_db()
+    
+    try:
+        matching_service = MatchingService(db)
+        
+        result = matching_service.allocate_batch(
+            female_ids=female_ids,
+            priorities=data.get('priorities'),
+            max_inbreeding=data.get('max_inbreeding', 6.0),
+            max_uses_per_bull=data.get('max_uses_per_bull'),
+            filters=data.get('filters')
+        )
+        
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
+
+@api.route('/matings/plan', methods=['POST'])
+def plan_matings():
+    """Plano do lote com controle da coancestria média da próxima safra (busca local em paralelo)"""
+    data = request.json
+    female_ids = data.get('female_ids', [])
+    
+    if not female_ids:
+        return jsonify({'error': 'female_ids é obrigatório'}), 400
+    
+    db = get_db()
+    
+    try:
+        matching_service = MatchingService(db)
+        
+        result = matching_service.plan_matings(
+            female_ids=female_ids,
+            priorities=data.get('priorities'),
+            max_inbreeding=data.get('max_inbreeding', 6.0),
+            coancestry_weight=float(data.get('coancestry_weight', 1.0)),
+            max_uses_per_bull=data.get('max_uses_per_bull'),
+            filters=data.get('filters'),
+            restarts=int(data.get('restarts', 4)),
+            workers=get_workers(data),
+            seed=int(data.get('seed', 0))
+        )
+        
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
+
+@api.route('/matings/simulate', methods=['POST'])
+def simulate_offspring():
+    """Simulação Monte Carlo da progênie (probabilidades de excedência e quantis por acasalamento)"""
+    data = request.json
+    female_ids = data.get('female_ids', [])
+    bull_codes = data.get('bull_codes', [])
+    
+    if not female_ids or not bull_codes:
+        return jsonify({'error': 'female_ids e bull_codes são obrigatórios'}), 400
+    
+    try:
+        draws = int(data.get('draws', 10000))
+    except (TypeError, ValueError):
+        return jsonify({'error': f"draws deve ser um inteiro: {data.get('draws')!r}"}), 400
+    
+    db = get_db()
+    
+    try:
+        matching_service = MatchingService(db)
+        
+        result = matching_service.simulate_offspring(
+            female_ids=female_ids,
+            bull_codes=bull_codes,
+            traits=data.get('traits'),
+            conditions=data.get('conditions'),
+            quantiles=data.get('quantiles'),
+            draws=draws,
+            seed=data.get('seed')
+        )
+        
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
         db.close()
 
 
+@api.route('/matings/score-matrix/refresh', methods=['POST'])
+def refresh_score_matrix():
+    """Atualiza (incrementalmente) a matriz materializada fêmea × touro"""
+    db = get_db()
+    
+    try:
+        return jsonify(MatchingService(db).score_matrix().refresh())
+    except Exception as e:
+        db.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
+
+@api.route('/matings/cache', methods=['GET'])
+def get_matings_cache_stats():
+    """Acertos/erros do cache de análises por par"""
+    return jsonify(genetic_calculator.pairs.stats())
+
+
 @api.route('/matings', methods=['GET'])
 def get_matings():
     """Lista acasalamentos com filtros"""
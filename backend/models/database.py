@@ -3,9 +3,10 @@ Modelos do Banco de Dados - Sistema de Acasalamento
 SQLAlchemy ORM Models
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, JSON, ForeignKey, Text
+from sqlalchemy import create_engine, event, insert, update, Column, Integer, String, Float, DateTime, Boolean, JSON, ForeignKey, Text, LargeBinary, UniqueConstraint
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import relationship, sessionmaker, Session
 from datetime import datetime
 import json
 
@@ -72,6 +73,30 @@ class Female(Base):
     # Genômico
     genomic_inbreeding = Column(Float)  # gINB
     
+    # Pedigree
+    sire_reg = Column(String(50))
+    sire_naab = Column(String(50))
+    sire_name = Column(String(200))
+    dam_reg = Column(String(50))
+    dam_id = Column(String(50))
+    mgs_reg = Column(String(50))
+    mgs_naab = Column(String(50))
+    mgs_name = Column(String(200))
+    
+    # Haplótipos letais
+    hh1 = Column(String(20))
+    hh2 = Column(String(20))
+    hh3 = Column(String(20))
+    hh4 = Column(String(20))
+    hh5 = Column(String(20))
+    hh6 = Column(String(20))
+    ah1 = Column(String(20))
+    ah2 = Column(String(20))
+    jh1 = Column(String(20))
+    jh2 = Column(String(20))
+    bh1 = Column(String(20))
+    bh2 = Column(String(20))
+    
     # Metadata
     last_updated = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     is_active = Column(Boolean, default=True)
@@ -308,6 +333,37 @@ class Bull(Base):
     gfi = Column(Float)  # Genomic Future Inbreeding
     haplotypes = Column(JSON)  # Lista de haplótipos (HH1-HH6)
     
+    # Reliabilities (colunas criadas pelo importador de PDFs)
+    milk_rel = Column(Float)
+    protein_rel = Column(Float)
+    fat_rel = Column(Float)
+    productive_life_rel = Column(Float)
+    scs_rel = Column(Float)
+    dpr_rel = Column(Float)
+    hcr_rel = Column(Float)
+    ccr_rel = Column(Float)
+    fertility_index_rel = Column(Float)
+    ptat_rel = Column(Float)
+    udc_rel = Column(Float)
+    flc_rel = Column(Float)
+    feed_saved_rel = Column(Float)
+    rfi_rel = Column(Float)
+    milking_speed_rel = Column(Float)
+    sire_calving_ease_rel = Column(Float)
+    daughter_calving_ease_rel = Column(Float)
+    sire_stillbirth_rel = Column(Float)
+    daughter_stillbirth_rel = Column(Float)
+    heifer_livability_rel = Column(Float)
+    mastitis_rel = Column(Float)
+    metritis_rel = Column(Float)
+    ketosis_rel = Column(Float)
+    milk_fever_rel = Column(Float)
+    displaced_abomasum_rel = Column(Float)
+    retained_placenta_rel = Column(Float)
+    gestation_length_rel = Column(Float)
+    reliabilities = Column(Text)  # JSON {"milk_rel": 99, ...}
+    num_daughters = Column(Integer)
+    
     # Disponibilidade
     is_available = Column(Boolean, default=True)
     price_per_dose = Column(Float)
@@ -443,6 +499,52 @@ class BatchMating(Base):
         return f"<BatchMating {self.id}: {self.batch_name}>"
 
 
+class BatchJob(Base):
+    """Lote de acasalamento processado em segundo plano (com progresso e retomada)"""
+    __tablename__ = 'batch_jobs'
+    
+    id = Column(Integer, primary_key=True)
+    status = Column(String(20), default='queued')  # queued, running, completed, failed
+    
+    # Pedido: IDs das fêmeas (na ordem do lote) e opções do match_batch
+    female_ids = Column(JSON)
+    params = Column(JSON)
+    
+    # Progresso: as primeiras `completed` fêmeas da lista já têm resultado salvo
+    total = Column(Integer, default=0)
+    completed = Column(Integer, default=0)
+    error = Column(Text)
+    
+    # Execução atual (para ETA e para retomar jobs de processos que morreram)
+    worker = Column(String(100))
+    heartbeat_at = Column(DateTime)
+    resumed_at = Column(DateTime)
+    resumed_from = Column(Integer, default=0)
+    
+    batch_mating_id = Column(Integer, ForeignKey('batch_matings.id'))
+    
+    created_at = Column(DateTime, default=datetime.now)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    created_by = Column(String(100))
+    
+    def __repr__(self):
+        return f"<BatchJob {self.id}: {self.status} {self.completed}/{self.total}>"
+
+
+class BatchJobResult(Base):
+    """Resultado de uma fêmea de um BatchJob (posição = ordem no lote)"""
+    __tablename__ = 'batch_job_results'
+    
+    job_id = Column(Integer, ForeignKey('batch_jobs.id'), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    female_id = Column(Integer)
+    result = Column(JSON)  # {'female': ..., 'top_bulls': [...]} como em match_batch
+    
+    def __repr__(self):
+        return f"<BatchJobResult job={self.job_id} pos={self.position}>"
+
+
 class UserPreference(Base):
     """Preferências do Usuário"""
     __tablename__ = 'user_preferences'
@@ -464,6 +566,35 @@ class UserPreference(Base):
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 
+class SelectionIndex(Base):
+    """Índice de seleção personalizado (fórmula sobre as características)"""
+    __tablename__ = 'selection_indexes'
+    
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), unique=True, nullable=False, index=True)
+    expression = Column(Text, nullable=False)
+    formula_hash = Column(String(64))  # sha256 da expressão normalizada
+    description = Column(Text)
+    created_by = Column(String(100))
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    def __repr__(self):
+        return f"<SelectionIndex {self.name}>"
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'expression': self.expression,
+            'formula_hash': self.formula_hash,
+            'description': self.description,
+            'created_by': self.created_by,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
 class ImportHistory(Base):
     """Histórico de Importações de Dados"""
     __tablename__ = 'import_history'
@@ -489,6 +620,123 @@ class ImportHistory(Base):
         return f"<Import {self.id}: {self.import_type} - {self.status}>"
 
 
+class CatalogVersion(Base):
+    """Versão de cada catálogo (incrementada a cada escrita) para invalidar caches"""
+    __tablename__ = 'catalog_versions'
+    
+    name = Column(String(50), primary_key=True)  # bulls, females
+    version = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    def __repr__(self):
+        return f"<CatalogVersion {self.name}: {self.version}>"
+
+
+class PopulationStatistics(Base):
+    """Momentos das características (Welford) por população; uma linha por versão"""
+    __tablename__ = 'population_statistics'
+    __table_args__ = (UniqueConstraint('population', 'version', name='uq_population_version'),)
+    
+    id = Column(Integer, primary_key=True)
+    population = Column(String(20), nullable=False)  # bulls, herd
+    version = Column(Integer, nullable=False)
+    moments = Column(JSON)  # {característica: [n, média, M2]}
+    source = Column(String(20))  # rebuild, import
+    created_at = Column(DateTime, default=datetime.now)
+    
+    def __repr__(self):
+        return f"<PopulationStatistics {self.population} v{self.version}>"
+
+
+class MatingScoreColumn(Base):
+    """Posição de cada touro na matriz materializada de scores (fêmea × touro)"""
+    __tablename__ = 'mating_score_columns'
+    
+    bull_id = Column(Integer, ForeignKey('bulls.id'), primary_key=True)
+    position = Column(Integer, unique=True, nullable=False)
+    bull_stamp = Column(DateTime)  # last_updated do touro quando a coluna foi calculada
+    lineage_hash = Column(String(32))  # hash da ascendência do touro no pedigree (Pedigree.lineage_hashes)
+    
+    def __repr__(self):
+        return f"<MatingScoreColumn bull={self.bull_id} pos={self.position}>"
+
+
+class MatingScoreBlock(Base):
+    """
+    Bloco de uma linha da matriz materializada: scores de uma fêmea contra um bloco
+    de posições de touros, em blobs compactos (float32 / bits)
+    """
+    __tablename__ = 'mating_score_blocks'
+    
+    female_id = Column(Integer, ForeignKey('females.id'), primary_key=True)
+    block = Column(Integer, primary_key=True)
+    female_stamp = Column(DateTime)  # last_updated da fêmea quando a linha foi calculada
+    params_hash = Column(String(32))  # hash dos GeneticParameters usados
+    lineage_hash = Column(String(32))  # hash da ascendência da fêmea no pedigree (Pedigree.lineage_hashes)
+    iep = Column(LargeBinary)  # float32 - IEP normalizado (NaN = sem touro na posição)
+    inbreeding = Column(LargeBinary)  # float32 - consanguinidade esperada (%)
+    lethal = Column(LargeBinary)  # bits - portador × portador do mesmo haplótipo letal
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    def __repr__(self):
+        return f"<MatingScoreBlock female={self.female_id} block={self.block}>"
+
+
+# ============================================================================
+# VERSIONAMENTO DE CATÁLOGOS
+# ============================================================================
+
+# Modelos cujas escritas incrementam a versão do catálogo correspondente
+VERSIONED_MODELS = {Bull: 'bulls', Female: 'females'}
+
+
+def get_catalog_version(session, name):
+    """Versão atual de um catálogo (0 se nunca escrito)"""
+    version = session.query(CatalogVersion.version).filter(CatalogVersion.name == name).scalar()
+    return version or 0
+
+
+# INSERT ... ON CONFLICT DO UPDATE por dialeto (os demais usam UPDATE e, sem linha, INSERT)
+_UPSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def bump_catalog_version(session, name):
+    """
+    Incrementa a versão de um catálogo na transação corrente, no próprio banco
+    (version = version + 1): escritas concorrentes nunca perdem um incremento e a
+    primeira escrita de dois processos não colide ao criar a linha
+    """
+    table = CatalogVersion.__table__
+    now = datetime.now()
+    with session.no_autoflush:
+        upsert = _UPSERTS.get(session.get_bind().dialect.name)
+        if upsert is not None:
+            session.execute(upsert(table).values(name=name, version=1, updated_at=now).on_conflict_do_update(
+                index_elements=[table.c.name], set_={'version': table.c.version + 1, 'updated_at': now}))
+        else:
+            bumped = session.execute(update(table).where(table.c.name == name)
+                                     .values(version=table.c.version + 1, updated_at=now))
+            if not bumped.rowcount:
+                session.execute(insert(table).values(name=name, version=1, updated_at=now))
+
+
+@event.listens_for(Session, 'before_flush')
+def _bump_versions_on_flush(session, flush_context, instances):
+    """Toda inserção/alteração/remoção de um modelo versionado incrementa seu catálogo"""
+    touched = set()
+    
+    for obj in list(session.new) + list(session.deleted):
+        if type(obj) in VERSIONED_MODELS:
+            touched.add(VERSIONED_MODELS[type(obj)])
+    
+    for obj in session.dirty:
+        if type(obj) in VERSIONED_MODELS and session.is_modified(obj):
+            touched.add(VERSIONED_MODELS[type(obj)])
+    
+    for name in touched:
+        bump_catalog_version(session, name)
+
+
 # ============================================================================
 # INICIALIZAÇÃO DO BANCO
 # ============================================================================
@@ -0,0 +1,117 @@
+"""
+Alocação de Touros no Rebanho
+
+Atribui no máximo um touro por fêmea maximizando o IEP total do lote:
+- cada touro tem uma capacidade (doses em estoque e/ou limite de uso por touro)
+- pares proibidos (consanguinidade acima do limite, haplótipos letais em comum)
+  simplesmente não têm aresta (valor -inf)
+- ficar sem touro vale 0: a fêmea só recebe touro se o par tiver IEP positivo
+
+É um fluxo de custo mínimo (problema de transporte) resolvido por caminhos
+mínimos sucessivos: cada fêmea entra por vez e, se o touro preferido estiver
+cheio, um caminho de Dijkstra desloca outras fêmeas entre touros até uma vaga
+livre. Os nós do grafo são os touros (centenas), não as fêmeas: a aresta a → b
+é a fêmea de `a` que menos perde indo para `b`. Os preços duais dos touros são
+os potenciais do Dijkstra; com valores inteiros (IEP × 10) a alocação é ótima.
+"""
+
+from typing import Tuple
+import numpy as np
+
+
+# Valor de um par = IEP arredondado × VALUE_SCALE (inteiro)
+VALUE_SCALE = 10
+
+
+class AllocationSolver:
+    """Caminhos mínimos sucessivos sobre o grafo de touros (+ nó 'sem touro')"""
+
+    def __init__(self, values: np.ndarray, capacities: np.ndarray):
+        n_females, n_bulls = values.shape
+        capacity = np.minimum(np.maximum(np.asarray(capacities, dtype=np.int64), 0), n_females)
+
+        # Coluna extra = sem touro (valor 0, capacidade ilimitada)
+        self.null = n_bulls
+        self.values = np.full((n_females, n_bulls + 1), -np.inf)
+        self.values[:, :n_bulls] = np.where(np.isnan(values) | (capacity == 0), -np.inf, values)
+        self.values[:, n_bulls] = 0.0
+        self.capacity = np.append(capacity, n_females)
+
+        self.assignment = np.full(n_females, -1, dtype=np.int64)
+        self.counts = np.zeros(n_bulls + 1, dtype=np.int64)
+        self.prices = np.zeros(n_bulls + 1)
+        # loss[a, b] = menor perda (valor em a - valor em b) de uma fêmea de `a`; mover[a, b] = essa fêmea
+        self.loss = np.full((n_bulls + 1, n_bulls + 1), np.inf)
+        self.mover = np.full((n_bulls + 1, n_bulls + 1), -1, dtype=np.int64)
+        self.paths = 0
+
+    def solve(self) -> np.ndarray:
+        """Touro (coluna) de cada fêmea, -1 sem touro"""
+        for female in range(len(self.assignment)):
+            self._insert(female)
+        return np.where(self.assignment == self.null, -1, self.assignment)
+
+    def _insert(self, female: int):
+        profit = self.values[female] - self.prices
+        dist = profit.max() - profit  # custo reduzido fêmea → touro (>= 0)
+        free = self.counts < self.capacity
+        pred = np.full(len(dist), -1, dtype=np.int64)
+        visited = np.zeros(len(dist), dtype=bool)
+
+        # Dijkstra até o primeiro touro com vaga; empates são fechados juntos (e vagas têm preferência)
+        while True:
+            pending = np.where(visited, np.inf, dist)
+            nearest = pending.min()
+            ties = np.flatnonzero(pending == nearest)
+            open_ties = ties[free[ties]]
+            if len(open_ties):
+                target = open_ties[0]
+                break
+            self.paths += 1
+            visited[ties] = True
+            reduced = nearest + self.loss[ties] - self.prices[ties, None] + self.prices[None, :]
+            via = reduced.argmin(axis=0)
+            best = reduced[via, np.arange(len(dist))]
+            improve = (best < dist) & ~visited
+            dist[improve] = best[improve]
+            pred[improve] = ties[via[improve]]
+
+        # Potenciais: touros fechados sobem de preço (mantém custos reduzidos >= 0)
+        self.prices[visited] += dist[target] - dist[visited]
+
+        # Desloca as fêmeas ao longo do caminho e coloca a nova no primeiro touro
+        changed = [target]
+        node = target
+        while pred[node] >= 0:
+            previous = pred[node]
+            self.assignment[self.mover[previous, node]] = node
+            changed.append(previous)
+            node = previous
+        self.assignment[female] = node
+        changed.append(node)
+        self.counts[target] += 1
+
+        for bull in set(changed):
+            self._refresh_losses(bull)
+
+    def _refresh_losses(self, bull: int):
+        if bull == self.null:
+            return  # o nó 'sem touro' sempre tem vaga: nunca é atravessado
+        members = np.flatnonzero(self.assignment == bull)
+        if not len(members):
+            self.loss[bull] = np.inf
+            self.mover[bull] = -1
+            return
+        losses = self.values[members, bull][:, None] - self.values[members]
+        best = losses.argmin(axis=0)
+        self.loss[bull] = losses[best, np.arange(losses.shape[1])]
+        self.mover[bull] = members[best]
+
+
+def solve_allocation(values: np.ndarray, capacities: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    (touro de cada fêmea ou -1, etapas de Dijkstra) da alocação de valor total máximo.
+    `values` (F, B): valor de cada par, NaN = par proibido.
+    """
+    solver = AllocationSolver(values, capacities)
+    return solver.solve(), solver.paths
@@ -10,6 +10,7 @@ from datetime import datetime, timedelta
 from collections import Counter
 
 from backend.models.database import Female, Bull, Mating, BatchMating, ImportHistory
+from backend.services.panels import get_bull_panel, NUMERIC_COLUMNS
 
 
 class AnalyticsService:
@@ -125,14 +126,17 @@ class AnalyticsService:
         """
         Model = Female if entity == 'female' else Bull
         
-        # Buscar valores
-        values = self.session.query(
-            getattr(Model, index)
-        ).filter(
-            getattr(Model, index).isnot(None)
-        ).all()
-        
-        values = [v[0] for v in values if v[0] is not None]
+        # Buscar valores (touros: colunas do painel em cache)
+        if Model is Bull and index in NUMERIC_COLUMNS:
+            values = get_bull_panel(self.session).column_values(index)
+        else:
+            values = self.session.query(
+                getattr(Model, index)
+            ).filter(
+                getattr(Model, index).isnot(None)
+            ).all()
+            
+            values = [v[0] for v in values if v[0] is not None]
         
         if not values:
             return {'error': 'Sem dados disponíveis'}
@@ -0,0 +1,118 @@
+"""
+Memoização de Análises por Par
+
+Guarda resultados de PPPV/IEP/consanguinidade por (fêmea, touro):
+- a chave inclui id + last_updated de cada animal, o hash dos parâmetros
+  genéticos e o hash dos pesos/opções da requisição
+- LRU limitado, com contadores de acertos/erros
+- índice por animal para invalidar tudo o que envolve um animal importado
+
+Os valores são guardados serializados (pickle): cada leitura devolve uma cópia
+independente, bem mais barata que deepcopy.
+"""
+
+from typing import Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+from collections import OrderedDict
+import hashlib
+import pickle
+import threading
+
+
+def _canonical(value):
+    """Forma estável (ordenada) de dicts/listas/dataclasses para hashing"""
+    if hasattr(value, '__dataclass_fields__'):
+        value = {name: getattr(value, name) for name in value.__dataclass_fields__}
+    if isinstance(value, dict):
+        return sorted((repr(key), _canonical(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [_canonical(item) for item in value]
+        return sorted(items, key=repr) if isinstance(value, (set, frozenset)) else items
+    return value
+
+
+def fingerprint(value) -> str:
+    """Hash estável de parâmetros/pesos (None e dict vazio têm o mesmo hash)"""
+    if not value:
+        return ''
+    return hashlib.md5(repr(_canonical(value)).encode()).hexdigest()
+
+
+# Animal de uma entrada: ('female' | 'bull', id); id None = depende de todos os animais do tipo
+AnimalRef = Tuple[str, Optional[int]]
+
+
+class PairCache:
+    """Cache LRU de resultados por par fêmea × touro"""
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Hashable, Tuple[Tuple[AnimalRef, ...], bytes]]' = OrderedDict()
+        self._by_animal: Dict[AnimalRef, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, key: Hashable):
+        """Resultado em cache (cópia) ou None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return pickle.loads(entry[1])
+
+    def store(self, key: Hashable, animals: Iterable[AnimalRef], value):
+        animals = tuple(animals)
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (animals, value)
+            for animal in animals:
+                self._by_animal.setdefault(animal, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def get(self, key: Hashable, animals: Iterable[AnimalRef], compute: Callable):
+        """Resultado em cache ou calculado (e guardado) por `compute()`"""
+        value = self.lookup(key)
+        if value is None:
+            value = compute()
+            self.store(key, animals, value)
+        return value
+
+    def invalidate(self, kind: Optional[str] = None, ids: Optional[Iterable[int]] = None):
+        """Remove as entradas de animais de `kind` (todas se `ids` for None); sem argumentos limpa o cache"""
+        with self._lock:
+            if kind is None:
+                self._entries.clear()
+                self._by_animal.clear()
+                return
+            refs = [ref for ref in self._by_animal if ref[0] == kind] if ids is None else \
+                [(kind, animal_id) for animal_id in ids] + [(kind, None)]
+            for ref in refs:
+                for key in list(self._by_animal.get(ref, ())):
+                    self._discard(key)
+
+    def _discard(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for animal in entry[0]:
+            keys = self._by_animal.get(animal)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_animal[animal]
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries), 'maxsize': self.maxsize,
+            'hits': self.hits, 'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,184 @@
+"""
+Recomendações com Diversidade de Linhagem
+
+Top N em que poucos touros compartilham o mesmo pai ou avô materno (MGS):
+- índice de linhagem pré-calculado por painel: cada touro recebe o número do
+  grupo do seu pai e do seu MGS (códigos NAAB/registro codificados uma vez)
+- seleção gulosa sobre a ordem do ranking (já ordenada, O(B log B)): percorre os
+  touros do melhor para o pior e aceita cada um enquanto o grupo do pai e o do
+  MGS estiverem abaixo do limite; para ao completar N
+- opcionalmente, penalidade de coancestria: entre os PENALTY_POOL × N melhores,
+  escolhe a cada passo o touro de maior IEP − λ · coancestria média (%) com os
+  já escolhidos (respeitando os limites de grupo); se os limites esgotam o pool
+  antes de N, ele é ampliado com os próximos do ranking
+"""
+
+from typing import Callable, Dict, Optional
+from dataclasses import dataclass
+import numpy as np
+
+from backend.services.scoring import TraitMatrix, bull_coancestry
+
+
+# Candidatos considerados na seleção com penalidade de coancestria (× top N)
+PENALTY_POOL = 4
+
+DIVERSITY_OPTIONS = ('max_per_sire', 'max_per_mgs', 'coancestry_penalty')
+
+
+@dataclass(frozen=True)
+class DiversityRule:
+    """Limites de touros por pai/MGS e penalidade de coancestria entre os recomendados"""
+
+    max_per_sire: Optional[int] = None
+    max_per_mgs: Optional[int] = None
+    coancestry_penalty: float = 0.0  # pontos de IEP por ponto percentual de coancestria média
+
+    @classmethod
+    def parse(cls, options: Optional[Dict]) -> Optional['DiversityRule']:
+        """Regra a partir do dict do pedido (None/vazio = sem restrição de diversidade)"""
+        if not options:
+            return None
+        if not isinstance(options, dict):
+            raise ValueError("diversity deve ser um dicionário")
+        unknown = set(options) - set(DIVERSITY_OPTIONS)
+        if unknown:
+            raise ValueError(f"Opções de diversidade desconhecidas: {', '.join(sorted(unknown))}")
+
+        caps = {}
+        for name in ('max_per_sire', 'max_per_mgs'):
+            value = options.get(name)
+            if value is not None:
+                value = int(value)
+                if value < 1:
+                    raise ValueError(f"{name} deve ser pelo menos 1")
+            caps[name] = value
+        penalty = float(options.get('coancestry_penalty') or 0.0)
+        if penalty < 0:
+            raise ValueError("coancestry_penalty não pode ser negativa")
+
+        rule = cls(caps['max_per_sire'], caps['max_per_mgs'], penalty)
+        return rule if rule.active else None
+
+    @property
+    def active(self) -> bool:
+        return self.max_per_sire is not None or self.max_per_mgs is not None or self.coancestry_penalty > 0
+
+    def as_dict(self) -> Dict:
+        return {'max_per_sire': self.max_per_sire, 'max_per_mgs': self.max_per_mgs,
+                'coancestry_penalty': self.coancestry_penalty}
+
+
+@dataclass
+class LineageIndex:
+    """Grupo do pai e do MGS de cada touro (-1 = desconhecido, não conta para os limites)"""
+
+    sire: np.ndarray  # (B,) int
+    mgs: np.ndarray  # (B,) int
+    sire_code: np.ndarray  # (B,) object
+    mgs_code: np.ndarray  # (B,) object
+
+    @classmethod
+    def build(cls, bulls: TraitMatrix) -> 'LineageIndex':
+        def encode(column: np.ndarray) -> np.ndarray:
+            codes = {}
+            return np.array([codes.setdefault(code, len(codes)) if code else -1 for code in column], dtype=np.int64)
+
+        return cls(sire=encode(bulls.sire_code), mgs=encode(bulls.mgs_code),
+                   sire_code=bulls.sire_code, mgs_code=bulls.mgs_code)
+
+    def take(self, cols: np.ndarray) -> 'LineageIndex':
+        return LineageIndex(sire=self.sire[cols], mgs=self.mgs[cols],
+                            sire_code=self.sire_code[cols], mgs_code=self.mgs_code[cols])
+
+    def lineage(self, col: int) -> Dict:
+        return {'sire': self.sire_code[col], 'mgs': self.mgs_code[col]}
+
+
+def diverse_top(order: np.ndarray, values: np.ndarray, lineage: LineageIndex, rule: DiversityRule, top_n: int,
+                coancestry: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> np.ndarray:
+    """
+    Top N diverso a partir de `order` (colunas elegíveis, da melhor para a pior, como em rank_row).
+    `values` (B,) = critério do ranking; `coancestry(colunas)` = matriz de coancestria (fração)
+    entre essas colunas, só usada com penalidade.
+    """
+    top_n = max(top_n, 0)
+    sire_count: Dict[int, int] = {}
+    mgs_count: Dict[int, int] = {}
+
+    def fits(col: int) -> bool:
+        sire, mgs = lineage.sire[col], lineage.mgs[col]
+        if rule.max_per_sire is not None and sire >= 0 and sire_count.get(sire, 0) >= rule.max_per_sire:
+            return False
+        if rule.max_per_mgs is not None and mgs >= 0 and mgs_count.get(mgs, 0) >= rule.max_per_mgs:
+            return False
+        return True
+
+    def take(col: int):
+        sire, mgs = lineage.sire[col], lineage.mgs[col]
+        sire_count[sire] = sire_count.get(sire, 0) + 1
+        mgs_count[mgs] = mgs_count.get(mgs, 0) + 1
+
+    chosen = []
+    if rule.coancestry_penalty <= 0 or coancestry is None:
+        for col in order:
+            if len(chosen) >= top_n:
+                break
+            if fits(col):
+                take(col)
+                chosen.append(col)
+        return np.array(chosen, dtype=np.int64)
+
+    pool = order[:0]
+    picked = []  # posições dos escolhidos no pool
+    remaining = np.zeros(0, dtype=bool)
+    while len(chosen) < top_n:
+        if not remaining.any():
+            if len(pool) >= len(order):
+                break
+            # Pool inicial (penalty_pool) ou esgotado pelos limites: amplia com os próximos do ranking
+            pool = order[:len(pool) + (top_n - len(chosen)) * PENALTY_POOL]
+            relation = coancestry(pool) * 100  # %
+            base = values[pool].astype(float)
+            related = relation[:, picked].sum(axis=1)  # soma da coancestria com os escolhidos
+            remaining = np.ones(len(pool), dtype=bool)
+            remaining[picked] = False
+        for k in np.flatnonzero(remaining):
+            if not fits(pool[k]):
+                remaining[k] = False
+        if not remaining.any():
+            continue
+        step = len(chosen)
+        adjusted = base - rule.coancestry_penalty * (related / step if step else 0.0)
+        # Maior valor ajustado; empate pela ordem do ranking (posição no pool)
+        k = int(np.flatnonzero(remaining)[np.argmax(adjusted[remaining])])
+        remaining[k] = False
+        take(pool[k])
+        chosen.append(pool[k])
+        picked.append(k)
+        related += relation[:, k]
+    return np.array(chosen, dtype=np.int64)
+
+
+def penalty_pool(order: np.ndarray, top_n: int) -> np.ndarray:
+    """Candidatos da seleção com penalidade: os PENALTY_POOL × N primeiros do ranking"""
+    return order[:max(top_n, 0) * PENALTY_POOL]
+
+
+def pool_coancestry(bulls: TraitMatrix, pools, pedigree=None) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    `coancestry` de diverse_top: matriz calculada uma vez para a união dos `pools` (colunas de
+    `bulls`; os melhores touros se repetem entre fêmeas). Um pool ampliado além deles é
+    calculado na hora.
+    """
+    union = np.unique(np.concatenate(pools)) if pools else np.empty(0, dtype=np.int64)
+    matrix = bull_coancestry(bulls.take(union), pedigree)
+    position = np.full(len(bulls), -1, dtype=np.int64)
+    position[union] = np.arange(len(union))
+
+    def lookup(cols: np.ndarray) -> np.ndarray:
+        if np.all(position[cols] >= 0):
+            return matrix[np.ix_(position[cols], position[cols])]
+        return bull_coancestry(bulls.take(cols), pedigree)
+
+    return lookup
@@ -0,0 +1,247 @@
+"""
+Índices de Seleção Personalizados (fórmulas)
+
+O usuário define um índice como expressão sobre as características, por exemplo
+
+    0.4*net_merit_z + 0.3*productive_life_z - 2*max(0, inbreeding-6)
+
+- a expressão só passa por uma lista branca de nós da AST: números, variáveis
+  conhecidas, + - * / **, uma comparação por vez e as funções de FORMULA_FUNCTIONS
+- é compilada uma vez em código que opera sobre arrays NumPy inteiros: avaliar no
+  catálogo ou num lote custa uma passada de array por operação, não um laço por touro
+- as compilações ficam em cache pelo hash da expressão (espaços normalizados)
+
+Variáveis:
+- `<característica>` (TRAITS): PTA do touro no catálogo, PPPV do par no acasalamento (NaN = ausente)
+- `<característica>_z`: z-score pelas estatísticas populacionais do calculador; ausente = 0, como
+  no IEP, e sem inverter o sinal dos índices negativos (a fórmula escolhe o sinal)
+- `inbreeding`: consanguinidade esperada do par (%); no catálogo, o GFI do touro
+- `iep`: IEP normalizado do par (só em acasalamentos)
+"""
+
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import reduce
+import ast
+import hashlib
+import threading
+import numpy as np
+from sqlalchemy.orm import Session
+
+from backend.models.database import SelectionIndex
+from backend.services.scoring import TraitMatrix, pair_pppv
+from backend.services.traits import TRAITS
+
+
+# Tamanho máximo da expressão (caracteres)
+MAX_FORMULA_LENGTH = 500
+
+# Fórmulas compiladas mantidas em cache por processo
+FORMULA_CACHE_SIZE = 256
+
+# Funções permitidas: nome -> (função vetorizada, mínimo de argumentos, máximo de argumentos)
+FORMULA_FUNCTIONS = {
+    'max': (lambda *args: reduce(np.maximum, args), 2, 8),
+    'min': (lambda *args: reduce(np.minimum, args), 2, 8),
+    'abs': (np.abs, 1, 1),
+    'sqrt': (np.sqrt, 1, 1),
+    'log': (np.log, 1, 1),
+    'exp': (np.exp, 1, 1),
+    'clip': (np.clip, 3, 3),
+}
+
+# Variáveis do par (além das características)
+MATING_VARIABLES = ('inbreeding', 'iep')
+
+_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd,
+              ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+def _as_float(value):
+    return np.asarray(value, dtype=float)
+
+
+@dataclass(frozen=True)
+class IndexFormula:
+    """Fórmula validada e compilada"""
+
+    expression: str  # espaços normalizados
+    digest: str  # sha256 da expressão
+    traits: Tuple[str, ...]  # características lidas (valor e/ou z-score)
+    variables: Tuple[str, ...]  # nomes usados na expressão
+    code: object  # código compilado (avaliado sobre arrays)
+
+    def evaluate(self, values: Dict[str, np.ndarray], stats: Dict, shape: Tuple[int, ...],
+                 inbreeding: Optional[np.ndarray] = None, iep: Optional[np.ndarray] = None) -> np.ndarray:
+        """Valor do índice para todos os animais/pares de uma vez (`values`: característica -> array)"""
+        namespace = {name: function for name, (function, _, _) in FORMULA_FUNCTIONS.items()}
+        namespace['_as_float'] = _as_float
+        namespace['_float64'] = np.float64
+        for variable in self.variables:
+            if variable in TRAITS:
+                namespace[variable] = values[variable]
+            elif variable.endswith('_z'):
+                trait = variable[:-2]
+                trait_stats = stats.get(trait, {'mean': 0, 'std': 1})
+                std = trait_stats['std'] or np.inf
+                namespace[variable] = np.nan_to_num((values[trait] - trait_stats['mean']) / std, nan=0.0)
+            elif variable in MATING_VARIABLES:
+                value = inbreeding if variable == 'inbreeding' else iep
+                if value is None:
+                    raise ValueError(f"Variável '{variable}' só existe em acasalamentos")
+                namespace[variable] = value
+
+        try:
+            with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+                result = eval(self.code, {'__builtins__': {}}, namespace)
+                # Resultado complexo (não deveria ocorrer com constantes em np.float64) vira TypeError
+                result = np.asarray(result, dtype=float)
+        except (ArithmeticError, TypeError) as e:
+            raise ValueError(f"Erro ao avaliar a fórmula: {e}")
+        return np.broadcast_to(result, shape).copy()
+
+
+class _AsFloat(ast.NodeTransformer):
+    """
+    Comparações viram 0.0/1.0 (arrays booleanos não aceitam - nem subtração) e constantes viram
+    np.float64: só com constantes, (-8) ** 0.5 dá NaN como nos arrays, e não um número complexo
+    """
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        return ast.Call(func=ast.Name(id='_as_float', ctx=ast.Load()), args=[node], keywords=[])
+
+    def visit_Constant(self, node):
+        return ast.Call(func=ast.Name(id='_float64', ctx=ast.Load()), args=[node], keywords=[])
+
+
+class _Validator(ast.NodeVisitor):
+    """Percorre a AST aceitando só os nós da lista branca"""
+
+    def __init__(self):
+        self.names = []
+
+    def generic_visit(self, node):
+        raise ValueError(f"Construção não permitida na fórmula: {type(node).__name__}")
+
+    def visit_Expression(self, node):
+        self.visit(node.body)
+
+    def visit_BinOp(self, node):
+        self._operator(node.op)
+        self.visit(node.left)
+        self.visit(node.right)
+
+    def visit_UnaryOp(self, node):
+        self._operator(node.op)
+        self.visit(node.operand)
+
+    def visit_Compare(self, node):
+        if len(node.ops) != 1:
+            raise ValueError("Use uma comparação por vez (ex.: (tpi > 2800) * 10)")
+        self._operator(node.ops[0])
+        self.visit(node.left)
+        self.visit(node.comparators[0])
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FORMULA_FUNCTIONS:
+            raise ValueError(f"Função não permitida; use: {', '.join(FORMULA_FUNCTIONS)}")
+        if node.keywords:
+            raise ValueError("Funções da fórmula não aceitam argumentos nomeados")
+        _, minimum, maximum = FORMULA_FUNCTIONS[node.func.id]
+        if not minimum <= len(node.args) <= maximum:
+            raise ValueError(f"'{node.func.id}' recebe de {minimum} a {maximum} argumentos")
+        for arg in node.args:
+            self.visit(arg)
+
+    def visit_Name(self, node):
+        name = node.id
+        if not (name in TRAITS or name in MATING_VARIABLES or (name.endswith('_z') and name[:-2] in TRAITS)):
+            raise ValueError(f"Variável desconhecida na fórmula: '{name}'")
+        self.names.append(name)
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ValueError("A fórmula só aceita constantes numéricas")
+        node.value = float(node.value)  # aritmética em ponto flutuante (sem inteiros gigantes)
+
+    @staticmethod
+    def _operator(op):
+        if not isinstance(op, _OPERATORS):
+            raise ValueError(f"Operador não permitido na fórmula: {type(op).__name__}")
+
+
+def _compile(expression: str, digest: str) -> IndexFormula:
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Fórmula inválida: {e.msg}")
+    validator = _Validator()
+    validator.visit(tree)
+    tree = ast.fix_missing_locations(_AsFloat().visit(tree))
+
+    variables = tuple(dict.fromkeys(validator.names))
+    traits = tuple(dict.fromkeys(name[:-2] if name.endswith('_z') and name not in TRAITS else name
+                                 for name in variables if name not in MATING_VARIABLES))
+    return IndexFormula(expression=expression, digest=digest, traits=traits, variables=variables,
+                        code=compile(tree, '<índice>', 'eval'))
+
+
+# ============================================================================
+# CACHE POR PROCESSO
+# ============================================================================
+
+_lock = threading.Lock()
+_formulas: 'OrderedDict[str, IndexFormula]' = OrderedDict()
+
+
+def compile_formula(expression: str) -> IndexFormula:
+    """Fórmula compilada (reaproveitada pelo hash da expressão); ValueError se inválida"""
+    if not isinstance(expression, str) or not expression.strip():
+        raise ValueError("Informe a fórmula do índice")
+    expression = ' '.join(expression.split())
+    if len(expression) > MAX_FORMULA_LENGTH:
+        raise ValueError(f"Fórmula com mais de {MAX_FORMULA_LENGTH} caracteres")
+    digest = hashlib.sha256(expression.encode('utf-8')).hexdigest()
+
+    with _lock:
+        formula = _formulas.get(digest)
+        if formula is not None:
+            _formulas.move_to_end(digest)
+            return formula
+
+    formula = _compile(expression, digest)
+    with _lock:
+        _formulas[digest] = formula
+        while len(_formulas) > FORMULA_CACHE_SIZE:
+            _formulas.popitem(last=False)
+    return formula
+
+
+def stored_formula(session: Session, name: str) -> str:
+    """Expressão de um índice salvo (SelectionIndex)"""
+    index = session.query(SelectionIndex).filter(SelectionIndex.name == name).first()
+    if index is None:
+        raise ValueError(f"Índice '{name}' não encontrado")
+    return index.expression
+
+
+# ============================================================================
+# AVALIAÇÃO
+# ============================================================================
+
+def catalog_index(formula: IndexFormula, catalog: TraitMatrix, stats: Dict) -> np.ndarray:
+    """(N,) índice de cada animal pelos próprios valores (`inbreeding` = GFI/gINB)"""
+    values = {trait: catalog.values[:, catalog.traits.index(trait)] for trait in formula.traits}
+    return formula.evaluate(values, stats, (len(catalog),), inbreeding=catalog.genomic_inbreeding)
+
+
+def pair_index(formula: IndexFormula, females: TraitMatrix, bulls: TraitMatrix, stats: Dict,
+               inbreeding: np.ndarray, iep: np.ndarray) -> np.ndarray:
+    """(F, B) índice de cada par pelo PPPV das características da fórmula"""
+    values = {}
+    if formula.traits:
+        pppv, present = pair_pppv(females.select_traits(formula.traits), bulls.select_traits(formula.traits))
+        values = {trait: np.where(present[:, :, t], pppv[:, :, t], np.nan) for t, trait in enumerate(formula.traits)}
+    return formula.evaluate(values, stats, (len(females), len(bulls)), inbreeding=inbreeding, iep=iep)
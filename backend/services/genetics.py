@@ -12,7 +12,51 @@ Inclui:
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass, field
 import math
-import json
+import heapq
+import numpy as np
+
+from backend.services.traits import (
+    TraitRecord, RecordCache, TRAIT_POSITIONS, LETHAL_HAPLOTYPES, HAPLOTYPE_BITS,
+    as_record, resolve_trait_value, resolve_reliability, resolve_haplotype_status
+)
+from backend.services.scoring import build_trait_matrix, eligible_pairs, expected_inbreeding
+from backend.services.diversity import DiversityRule, LineageIndex, diverse_top, penalty_pool, pool_coancestry
+from backend.services.pedigree import animal_key
+from backend.services.cache import PairCache, fingerprint
+
+
+# Níveis de detalhe das análises: 'summary' (só escalares), 'categories' (+ contribuições por
+# categoria) e 'full' (+ contribuições por índice, intervalos, textos de interpretação)
+DETAIL_LEVELS = ('summary', 'categories', 'full')
+
+
+def detail_level(detail: Optional[str], default: str = 'full') -> str:
+    """Valida o nível de detalhe pedido (None = `default`)"""
+    if detail is None:
+        return default
+    if detail not in DETAIL_LEVELS:
+        raise ValueError(f"detail inválido: {detail} (use {', '.join(DETAIL_LEVELS)})")
+    return detail
+
+
+# Médias e desvios de referência (usados quando o banco não tem amostras suficientes)
+DEFAULT_POPULATION_STATS = {
+    'milk': {'mean': 500, 'std': 700}, 'protein': {'mean': 20, 'std': 25},
+    'fat': {'mean': 25, 'std': 35}, 'fat_percent': {'mean': 0.0, 'std': 0.15},
+    'protein_percent': {'mean': 0.0, 'std': 0.08}, 'net_merit': {'mean': 400, 'std': 350},
+    'cheese_merit': {'mean': 450, 'std': 380}, 'fluid_merit': {'mean': 350, 'std': 320},
+    'grazing_merit': {'mean': 300, 'std': 280}, 'productive_life': {'mean': 3.0, 'std': 2.5},
+    'scs': {'mean': 2.85, 'std': 0.15}, 'dpr': {'mean': 0.5, 'std': 2.0},
+    'hcr': {'mean': 0.5, 'std': 2.5}, 'ccr': {'mean': 0.5, 'std': 2.5},
+    'fertility_index': {'mean': 0.5, 'std': 1.5}, 'ptat': {'mean': 0.5, 'std': 1.5},
+    'udc': {'mean': 0.5, 'std': 1.2}, 'flc': {'mean': 0.3, 'std': 1.0},
+    'bwc': {'mean': 0.0, 'std': 1.5}, 'feed_saved': {'mean': 100, 'std': 80},
+    'rfi': {'mean': 0, 'std': 50}, 'sire_calving_ease': {'mean': 2.5, 'std': 0.8},
+    'daughter_calving_ease': {'mean': 2.5, 'std': 0.6}, 'sire_stillbirth': {'mean': 7.0, 'std': 2.0},
+    'daughter_stillbirth': {'mean': 6.0, 'std': 1.5}, 'mastitis': {'mean': 100, 'std': 5},
+    'metritis': {'mean': 100, 'std': 3}, 'cow_livability': {'mean': 2.0, 'std': 2.5},
+    'heifer_livability': {'mean': 1.0, 'std': 1.5},
+}
 
 
 @dataclass
@@ -33,6 +77,20 @@ class GeneticParameters:
         'feed_saved': 0.15, 'rfi': 0.20, 'milking_speed': 0.15,
     })
     
+    # Correlações genéticas entre características (pares ausentes = 0), usadas na simulação de progênie
+    genetic_correlations: Dict[Tuple[str, str], float] = field(default_factory=lambda: {
+        ('milk', 'protein'): 0.85, ('milk', 'fat'): 0.55, ('fat', 'protein'): 0.75,
+        ('milk', 'fat_percent'): -0.45, ('milk', 'protein_percent'): -0.45, ('fat_percent', 'protein_percent'): 0.55,
+        ('net_merit', 'milk'): 0.35, ('net_merit', 'protein'): 0.65, ('net_merit', 'fat'): 0.70,
+        ('net_merit', 'productive_life'): 0.55, ('net_merit', 'dpr'): 0.25, ('net_merit', 'scs'): -0.30,
+        ('net_merit', 'cheese_merit'): 0.95, ('net_merit', 'fluid_merit'): 0.85, ('net_merit', 'grazing_merit'): 0.90,
+        ('net_merit', 'tpi'): 0.85, ('productive_life', 'scs'): -0.35, ('productive_life', 'dpr'): 0.60,
+        ('productive_life', 'cow_livability'): 0.70, ('milk', 'dpr'): -0.30, ('milk', 'scs'): 0.10,
+        ('dpr', 'ccr'): 0.85, ('dpr', 'hcr'): 0.30, ('dpr', 'fertility_index'): 0.95,
+        ('ccr', 'fertility_index'): 0.90, ('hcr', 'fertility_index'): 0.45,
+        ('udc', 'ptat'): 0.75, ('flc', 'ptat'): 0.60, ('feed_saved', 'rfi'): -0.70,
+    })
+    
     category_weights: Dict[str, float] = field(default_factory=lambda: {
         'production': 0.30, 'health': 0.20, 'fertility': 0.18,
         'type': 0.12, 'efficiency': 0.12, 'calving': 0.08,
@@ -59,6 +117,9 @@ class GeneticParameters:
     inbreeding_penalty_lambda: float = 3.0
     default_bull_reliability: float = 75.0
     default_cow_reliability: float = 55.0
+    
+    # Populações (backend.services.population) combinadas nas médias/desvios dos z-scores
+    stats_populations: Tuple[str, ...] = ('bulls', 'herd')
 
 
 class GeneticCalculator:
@@ -66,35 +127,109 @@ class GeneticCalculator:
     
     def __init__(self, params: Optional[GeneticParameters] = None):
         self.params = params or GeneticParameters()
-        self.population_stats = {
-            'milk': {'mean': 500, 'std': 700}, 'protein': {'mean': 20, 'std': 25},
-            'fat': {'mean': 25, 'std': 35}, 'fat_percent': {'mean': 0.0, 'std': 0.15},
-            'protein_percent': {'mean': 0.0, 'std': 0.08}, 'net_merit': {'mean': 400, 'std': 350},
-            'cheese_merit': {'mean': 450, 'std': 380}, 'fluid_merit': {'mean': 350, 'std': 320},
-            'grazing_merit': {'mean': 300, 'std': 280}, 'productive_life': {'mean': 3.0, 'std': 2.5},
-            'scs': {'mean': 2.85, 'std': 0.15}, 'dpr': {'mean': 0.5, 'std': 2.0},
-            'hcr': {'mean': 0.5, 'std': 2.5}, 'ccr': {'mean': 0.5, 'std': 2.5},
-            'fertility_index': {'mean': 0.5, 'std': 1.5}, 'ptat': {'mean': 0.5, 'std': 1.5},
-            'udc': {'mean': 0.5, 'std': 1.2}, 'flc': {'mean': 0.3, 'std': 1.0},
-            'bwc': {'mean': 0.0, 'std': 1.5}, 'feed_saved': {'mean': 100, 'std': 80},
-            'rfi': {'mean': 0, 'std': 50}, 'sire_calving_ease': {'mean': 2.5, 'std': 0.8},
-            'daughter_calving_ease': {'mean': 2.5, 'std': 0.6}, 'sire_stillbirth': {'mean': 7.0, 'std': 2.0},
-            'daughter_stillbirth': {'mean': 6.0, 'std': 1.5}, 'mastitis': {'mean': 100, 'std': 5},
-            'metritis': {'mean': 100, 'std': 3}, 'cow_livability': {'mean': 2.0, 'std': 2.5},
-            'heifer_livability': {'mean': 1.0, 'std': 1.5},
-        }
+        # Média/desvio por característica: padrão até as estatísticas do banco serem carregadas
+        # (set_population_stats); características sem amostras suficientes mantêm o padrão
+        self.population_stats = dict(DEFAULT_POPULATION_STATS)
+        self.population_version: Dict[str, int] = {}
+        self.pppv_indices = ['milk', 'protein', 'fat', 'fat_percent', 'protein_percent',
+                             'productive_life', 'scs', 'dpr', 'fertility_index', 'udc', 'flc',
+                             'ptat', 'net_merit', 'tpi', 'hcr', 'ccr', 'feed_saved', 'rfi']
+        self.iep_indices = list(dict.fromkeys(idx for weights in self.params.index_weights.values() for idx in weights))
+    
+        self.records = RecordCache()
+        self.pairs = PairCache()  # análises memoizadas por par (fêmea × touro)
+        self.pedigree = None  # Pedigree do rebanho + catálogo (backend.services.pedigree), definido em snapshot()
+    
+    def as_record(self, data, is_bull: bool = False) -> TraitRecord:
+        """Normaliza um animal uma única vez (valores por posição fixa)"""
+        return as_record(data, is_bull=is_bull)
     
-    def calculate_pppv(self, female_data: Dict, bull_data: Dict, indices: Optional[List[str]] = None) -> Dict:
-        """Calcula PPPV ponderado por reliability"""
+    def __getstate__(self):
+        """Cópia para processos de trabalho: sem os caches (recriados vazios)"""
+        state = self.__dict__.copy()
+        state.pop('records', None)
+        state.pop('pairs', None)
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.records = RecordCache()
+        self.pairs = PairCache()
+    
+    def cached_record(self, animal, prepare, is_bull: bool = False) -> TraitRecord:
+        """TraitRecord de um modelo ORM, reaproveitado até o animal mudar (last_updated)"""
+        key = ('bull' if is_bull else 'female', animal.id)
+        return self.records.get(key, getattr(animal, 'last_updated', None),
+                                lambda: as_record(prepare(animal), is_bull=is_bull))
+    
+    def set_population_stats(self, stats: Dict[str, Dict[str, float]], versions: Dict[str, int]):
+        """Usa as estatísticas do banco (versões `versions`) sobre os valores padrão"""
+        if versions != self.population_version:
+            self.population_stats = {**DEFAULT_POPULATION_STATS, **stats}
+            self.population_version = dict(versions)
+    
+    def snapshot(self, pedigree=None, stats: Optional[Dict[str, Dict[str, float]]] = None,
+                 versions: Optional[Dict[str, int]] = None) -> 'GeneticCalculator':
+        """
+        Cópia com pedigree e estatísticas populacionais próprios, que ninguém mais altera;
+        parâmetros e caches (registros e análises por par) são os mesmos deste calculador
+        """
+        clone = GeneticCalculator.__new__(GeneticCalculator)
+        clone.__dict__.update(self.__dict__)
+        clone.pedigree = pedigree
+        if stats is not None:
+            clone.set_population_stats(stats, versions or {})
+        return clone
+    
+    def params_fingerprint(self) -> str:
+        """Hash dos parâmetros genéticos e estatísticas populacionais em uso"""
+        return fingerprint((self.params, self.population_stats, self.pppv_indices))
+    
+    def pair_key(self, view: str, female, bull=None, options=None, params_hash: Optional[str] = None) -> Tuple:
+        """
+        Chave de memoização de um par: (id, last_updated) de cada animal + hash dos
+        parâmetros + hash das opções (pesos, filtros...) + revisão do pedigree.
+        Em lotes, `params_hash` (params_fingerprint()) é calculado uma vez e repassado.
+        """
+        bull_stamp = (bull.id, getattr(bull, 'last_updated', None)) if bull is not None else None
+        return (view, (female.id, getattr(female, 'last_updated', None)), bull_stamp,
+                params_hash or self.params_fingerprint(), fingerprint(options),
+                getattr(self.pedigree, 'revision', None))
+    
+    def memoize_pair(self, view: str, female, bull, compute, options=None):
+        """Resultado de `compute()` para o par, servido do cache enquanto nada mudar"""
+        key = self.pair_key(view, female, bull, options)
+        return self.pairs.get(key, (('female', female.id), ('bull', bull.id)), compute)
+    
+    def invalidate_animals(self, kind: str, ids=None):
+        """Descarta registros e análises em cache de animais importados/alterados ('female' ou 'bull')"""
+        self.pairs.invalidate(kind, ids)
+        if ids is None:
+            self.records.invalidate()
+        else:
+            for animal_id in ids:
+                self.records.invalidate((kind, animal_id))
+    
+    def calculate_pppv(self, female_data: Dict, bull_data: Dict, indices: Optional[List[str]] = None,
+                       detail: str = 'full') -> Dict:
+        """Calcula PPPV ponderado por reliability (abaixo de 'full': só pppv e reliability combinada)"""
         if not indices:
-            indices = ['milk', 'protein', 'fat', 'fat_percent', 'protein_percent',
-                      'productive_life', 'scs', 'dpr', 'fertility_index', 'udc', 'flc', 
-                      'ptat', 'net_merit', 'tpi', 'hcr', 'ccr', 'feed_saved', 'rfi']
+            indices = self.pppv_indices
+        
+        female_data = self.as_record(female_data, is_bull=False)
+        bull_data = self.as_record(bull_data, is_bull=True)
+        cow_values, bull_values = female_data.values, bull_data.values
         
         results = {}
         for index in indices:
-            cow_value = self._get_index_value(female_data, index)
-            bull_value = self._get_index_value(bull_data, index)
+            pos = TRAIT_POSITIONS.get(index)
+            if pos is not None:
+                cow_value, bull_value = cow_values[pos], bull_values[pos]
+                if cow_value != cow_value or bull_value != bull_value:  # NaN = ausente
+                    continue
+            else:
+                cow_value = self._get_index_value(female_data, index)
+                bull_value = self._get_index_value(bull_data, index)
             
             if cow_value is None or bull_value is None:
                 continue
@@ -107,11 +242,15 @@ class GeneticCalculator:
             else:
                 pppv = (bull_value + cow_value) / 2
             
+            combined_rel = (cow_rel + bull_rel) / 4 + 25
+            if detail != 'full':
+                results[index] = {'pppv': round(pppv, 2), 'combined_reliability': round(combined_rel, 1)}
+                continue
+            
             h2 = self.params.heritabilities.get(index, 0.25)
             avg_parent_rel = (cow_rel + bull_rel) / 200
             msv = 0.5 * (1 - 0.5 * avg_parent_rel) * h2 * self._get_variance(index)
             std_dev = math.sqrt(msv) if msv > 0 else 0
-            combined_rel = (cow_rel + bull_rel) / 4 + 25
             
             results[index] = {
                 'cow_value': round(cow_value, 2), 'bull_value': round(bull_value, 2),
@@ -128,15 +267,17 @@ class GeneticCalculator:
         stats = self.population_stats.get(index, {'std': 1.0})
         return stats['std'] ** 2
     
-    def calculate_economic_index(self, female_data: Dict, bull_data: Dict, custom_weights: Optional[Dict] = None) -> Dict:
-        """Calcula IEP (Índice Econômico Ponderado)"""
+    def calculate_economic_index(self, female_data: Dict, bull_data: Dict, custom_weights: Optional[Dict] = None,
+                                 detail: str = 'full') -> Dict:
+        """
+        Calcula IEP (Índice Econômico Ponderado). `detail` controla o que é montado:
+        'summary' omite as categorias, 'categories' omite as contribuições por índice
+        """
         category_weights = custom_weights or self.params.category_weights
         
-        all_indices = []
-        for indices in self.params.index_weights.values():
-            all_indices.extend(indices.keys())
-        
-        pppv_data = self.calculate_pppv(female_data, bull_data, list(set(all_indices)))
+        female_data = self.as_record(female_data, is_bull=False)
+        bull_data = self.as_record(bull_data, is_bull=True)
+        pppv_data = self.calculate_pppv(female_data, bull_data, self.iep_indices, detail='summary')
         
         category_scores = {}
         total_score = 0
@@ -161,12 +302,16 @@ class GeneticCalculator:
                 
                 contribution = idx_weight * z_score
                 category_score += contribution
-                indices_used.append({'index': index, 'pppv': pppv_value, 'z_score': round(z_score, 2), 'weight': idx_weight, 'contribution': round(contribution, 3)})
+                if detail == 'full':
+                    indices_used.append({'index': index, 'pppv': pppv_value, 'z_score': round(z_score, 2), 'weight': idx_weight, 'contribution': round(contribution, 3)})
             
-            category_scores[category] = {'score': round(category_score, 3), 'weight': cat_weight, 'contribution': round(category_score * cat_weight, 3), 'indices': indices_used}
+            if detail == 'full':
+                category_scores[category] = {'score': round(category_score, 3), 'weight': cat_weight, 'contribution': round(category_score * cat_weight, 3), 'indices': indices_used}
+            elif detail == 'categories':
+                category_scores[category] = {'score': round(category_score, 3), 'weight': cat_weight, 'contribution': round(category_score * cat_weight, 3)}
             total_score += category_score * cat_weight
         
-        inbreeding_data = self.calculate_inbreeding(female_data, bull_data)
+        inbreeding_data = self.calculate_inbreeding(female_data, bull_data, detail)
         inbreeding = inbreeding_data['expected_inbreeding']
         
         inbreeding_penalty = 0
@@ -180,12 +325,15 @@ class GeneticCalculator:
         reliabilities = [pppv_data[idx]['combined_reliability'] for idx in pppv_data if 'combined_reliability' in pppv_data[idx]]
         avg_reliability = sum(reliabilities) / len(reliabilities) if reliabilities else 50
         
-        return {
+        result = {
             'iep_raw': round(raw_score, 3), 'iep_normalized': round(normalized_score, 1),
             'base_score': round(total_score, 3), 'inbreeding_penalty': round(inbreeding_penalty, 3),
             'grade': self._grade_iep(normalized_score), 'categories': category_scores,
             'inbreeding': inbreeding_data, 'reliability': round(avg_reliability, 1)
         }
+        if detail == 'summary':
+            del result['categories']
+        return result
     
     def _normalize_to_z(self, index: str, value: float) -> float:
         stats = self.population_stats.get(index, {'mean': 0, 'std': 1})
@@ -202,11 +350,39 @@ class GeneticCalculator:
         elif score >= 35: return 'D Abaixo da Média'
         else: return 'F Inadequado'
     
-    def calculate_inbreeding(self, female_data: Dict, bull_data: Dict) -> Dict:
-        """Calcula consanguinidade esperada"""
+    def calculate_inbreeding(self, female_data: Dict, bull_data: Dict, detail: str = 'full') -> Dict:
+        """Calcula consanguinidade esperada (abaixo de 'full': sem detalhes, haplótipos e recomendação)"""
         cow_ginb = self._get_index_value(female_data, 'genomic_inbreeding')
         bull_gfi = self._get_index_value(bull_data, 'gfi')
+        expected_inbreeding, method = self._expected_inbreeding(female_data, bull_data, cow_ginb, bull_gfi)
+        risk_level = self._classify_inbreeding_risk(expected_inbreeding)
         
+        if detail != 'full':
+            critical = self._has_critical_haplotype(female_data, bull_data)
+            result = {
+                'expected_inbreeding': round(expected_inbreeding, 2), 'method': method, 'risk_level': risk_level,
+                'acceptable': expected_inbreeding <= self.params.inbreeding_acceptable and not critical,
+                'critical_haplotype': critical
+            }
+            if not result['acceptable']:
+                # Só pares recusados levam o texto (e os haplótipos, quando letais)
+                haplotype_risks = self._analyze_haplotypes(female_data, bull_data) if critical else []
+                result['recommendation'] = self._inbreeding_recommendation(expected_inbreeding, haplotype_risks)
+            return result
+        
+        haplotype_risks = self._analyze_haplotypes(female_data, bull_data)
+        acceptable = (expected_inbreeding <= self.params.inbreeding_acceptable and not any(r['severity'] == 'critical' for r in haplotype_risks))
+        
+        return {
+            'expected_inbreeding': round(expected_inbreeding, 2), 'method': method,
+            'risk_level': risk_level, 'acceptable': acceptable,
+            'details': {'cow_ginb': round(cow_ginb, 2) if cow_ginb else None, 'bull_gfi': round(bull_gfi, 2) if bull_gfi else None},
+            'haplotype_risks': haplotype_risks,
+            'recommendation': self._inbreeding_recommendation(expected_inbreeding, haplotype_risks)
+        }
+    
+    def _expected_inbreeding(self, female_data: Dict, bull_data: Dict, cow_ginb: Optional[float], bull_gfi: Optional[float]) -> Tuple[float, str]:
+        """(consanguinidade esperada sem arredondamento, método)"""
         if cow_ginb is not None and bull_gfi is not None:
             expected_inbreeding = (cow_ginb / 4) + (bull_gfi / 2)
             method = 'genomic'
@@ -225,19 +401,15 @@ class GeneticCalculator:
                 expected_inbreeding = 8.5
                 method = 'estimated'
         
-        haplotype_risks = self._analyze_haplotypes(female_data, bull_data)
-        risk_level = self._classify_inbreeding_risk(expected_inbreeding)
-        acceptable = (expected_inbreeding <= self.params.inbreeding_acceptable and not any(r['severity'] == 'critical' for r in haplotype_risks))
-        
-        return {
-            'expected_inbreeding': round(expected_inbreeding, 2), 'method': method,
-            'risk_level': risk_level, 'acceptable': acceptable,
-            'details': {'cow_ginb': round(cow_ginb, 2) if cow_ginb else None, 'bull_gfi': round(bull_gfi, 2) if bull_gfi else None},
-            'haplotype_risks': haplotype_risks,
-            'recommendation': self._inbreeding_recommendation(expected_inbreeding, haplotype_risks)
-        }
+        return expected_inbreeding, method
     
     def _calculate_pedigree_inbreeding(self, female_data: Dict, bull_data: Dict) -> Optional[float]:
+        if self.pedigree is not None:
+            # Vale a coancestria calculada (inclusive 0) se o par tem ascendência conhecida no pedigree
+            coancestry = self.pedigree.coancestry(animal_key(female_data), animal_key(bull_data, is_bull=True))
+            if coancestry is not None:
+                return coancestry * 100
+        
         cow_sire = female_data.get('sire_naab') or female_data.get('sire_reg')
         cow_mgs = female_data.get('mgs_naab') or female_data.get('mgs_reg')
         bull_sire = bull_data.get('sire_naab') or bull_data.get('sire_reg')
@@ -258,56 +430,36 @@ class GeneticCalculator:
         return coancestry * 100 if coancestry > 0 else None
     
     def _analyze_haplotypes(self, female_data: Dict, bull_data: Dict) -> List[Dict]:
+        female_data = self.as_record(female_data, is_bull=False)
+        bull_data = self.as_record(bull_data, is_bull=True)
+        cow_carriers, bull_carriers = female_data.carriers, bull_data.carriers
+        if not (cow_carriers | bull_carriers):
+            return []
+        
         risks = []
-        for hap in ['hh1', 'hh2', 'hh3', 'hh4', 'hh5', 'hh6']:
-            cow_status = self._get_haplotype_status(female_data, hap)
-            bull_status = self._get_haplotype_status(bull_data, hap)
+        for hap in LETHAL_HAPLOTYPES:
+            bit = HAPLOTYPE_BITS[hap]
+            cow_carrier, bull_carrier = cow_carriers & bit, bull_carriers & bit
+            if not (cow_carrier or bull_carrier):
+                continue
+            cow_status = female_data.haplotype_status(hap)
+            bull_status = bull_data.haplotype_status(hap)
             
-            if cow_status == 'Carrier' and bull_status == 'Carrier':
+            if cow_carrier and bull_carrier:
                 risks.append({'haplotype': hap.upper(), 'cow_status': cow_status, 'bull_status': bull_status, 'severity': 'critical', 'probability': '25% letal', 'recommendation': f'EVITAR - 25% chance de bezerro afetado por {hap.upper()}'})
-            elif cow_status == 'Carrier' or bull_status == 'Carrier':
-                carrier = 'vaca' if cow_status == 'Carrier' else 'touro'
+            else:
+                carrier = 'vaca' if cow_carrier else 'touro'
                 risks.append({'haplotype': hap.upper(), 'cow_status': cow_status, 'bull_status': bull_status, 'severity': 'low', 'probability': '50% portador', 'recommendation': f'Aceitável - {carrier} é portador de {hap.upper()}'})
         return risks
     
+    def _has_critical_haplotype(self, female_data: Dict, bull_data: Dict) -> bool:
+        """True se vaca e touro são portadores do mesmo haplótipo letal (um único AND)"""
+        return bool(self.as_record(female_data, is_bull=False).carriers & self.as_record(bull_data, is_bull=True).carriers)
+    
     def _get_haplotype_status(self, data: Dict, haplotype: str) -> str:
-        for key in [haplotype, haplotype.upper(), haplotype.lower()]:
-            value = data.get(key)
-            if value is not None:
-                if isinstance(value, str):
-                    if value.upper() in ['T', 'F', 'FREE', 'TESTED FREE']:
-                        return 'Free'
-                    elif value.upper() in ['C', 'CARRIER']:
-                        return 'Carrier'
-                elif isinstance(value, (int, float)):
-                    return 'Free' if value == 0 else 'Carrier'
-        
-        genetic = data.get('genetic_data', {})
-        if isinstance(genetic, dict):
-            for key in [haplotype, haplotype.upper()]:
-                value = genetic.get(key)
-                if value is not None:
-                    if str(value).upper() in ['T', 'F', 'FREE']:
-                        return 'Free'
-                    elif str(value).upper() in ['C', 'CARRIER']:
-                        return 'Carrier'
-        
-        # Tentar no campo haplotypes
-        haplotypes = data.get('haplotypes', {})
-        if isinstance(haplotypes, str):
-            try:
-                haplotypes = json.loads(haplotypes)
-            except:
-                haplotypes = {}
-        if isinstance(haplotypes, dict):
-            value = haplotypes.get(haplotype) or haplotypes.get(haplotype.upper())
-            if value:
-                if str(value).upper() in ['T', 'F', 'FREE', 'TESTED FREE']:
-                    return 'Free'
-                elif str(value).upper() in ['C', 'CARRIER']:
-                    return 'Carrier'
-        
-        return 'Unknown'
+        if isinstance(data, TraitRecord) and haplotype.lower() in HAPLOTYPE_BITS:
+            return data.haplotype_status(haplotype)
+        return resolve_haplotype_status(data.data if isinstance(data, TraitRecord) else data, haplotype)
     
     def _classify_inbreeding_risk(self, inbreeding: float) -> str:
         if inbreeding < self.params.inbreeding_ideal: return 'Baixo'
@@ -330,39 +482,133 @@ class GeneticCalculator:
         else:
             return '❌ Acasalamento não recomendado - Consanguinidade elevada'
     
-    def rank_bulls_for_female(self, female_data: Dict, bulls: List[Dict], top_n: int = 10, max_inbreeding: float = 8.0, custom_weights: Optional[Dict] = None) -> List[Dict]:
-        """Rankeia touros para uma fêmea"""
-        rankings = []
-        
-        for bull_data in bulls:
-            iep_result = self.calculate_economic_index(female_data, bull_data, custom_weights)
-            inbreeding = iep_result['inbreeding']['expected_inbreeding']
-            
-            if inbreeding > max_inbreeding:
-                continue
+    def score_economic_index(self, female_data: Dict, bull_data: Dict, custom_weights: Optional[Dict] = None,
+                             expected_inbreeding: Optional[float] = None) -> float:
+        """
+        Apenas o IEP normalizado (mesmo valor de calculate_economic_index()['iep_normalized']),
+        sem montar PPPV detalhado, categorias nem análise de haplótipos
+        """
+        category_weights = custom_weights or self.params.category_weights
+        female_data = self.as_record(female_data, is_bull=False)
+        bull_data = self.as_record(bull_data, is_bull=True)
+        
+        pppv_values = {}
+        for index in self.iep_indices:
+            pos = TRAIT_POSITIONS.get(index)
+            if pos is not None:
+                cow_value, bull_value = female_data.values[pos], bull_data.values[pos]
+                if cow_value != cow_value or bull_value != bull_value:
+                    continue
+            else:
+                cow_value = self._get_index_value(female_data, index)
+                bull_value = self._get_index_value(bull_data, index)
+                if cow_value is None or bull_value is None:
+                    continue
             
-            critical_haplotypes = [r for r in iep_result['inbreeding']['haplotype_risks'] if r['severity'] == 'critical']
-            if critical_haplotypes:
+            cow_rel = self._get_reliability(female_data, index, is_bull=False)
+            bull_rel = self._get_reliability(bull_data, index, is_bull=True)
+            if (bull_rel + cow_rel) > 0:
+                pppv = (bull_rel * bull_value + cow_rel * cow_value) / (bull_rel + cow_rel)
+            else:
+                pppv = (bull_value + cow_value) / 2
+            pppv_values[index] = round(pppv, 2)
+        
+        total_score = 0
+        for category, cat_weight in category_weights.items():
+            if category not in self.params.index_weights:
                 continue
-            
-            rankings.append({
-                'bull': {'id': bull_data.get('id'), 'code': bull_data.get('code'), 'name': bull_data.get('name'), 'source': bull_data.get('source')},
-                'iep': iep_result['iep_normalized'], 'grade': iep_result['grade'],
-                'inbreeding': inbreeding, 'inbreeding_risk': iep_result['inbreeding']['risk_level'],
-                'categories': {cat: data['score'] for cat, data in iep_result['categories'].items()},
-                'reliability': iep_result['reliability'], 'full_analysis': iep_result
-            })
+            category_score = 0
+            for index, idx_weight in self.params.index_weights[category].items():
+                if index not in pppv_values:
+                    continue
+                z_score = self._normalize_to_z(index, pppv_values[index])
+                if index in self.params.negative_indices:
+                    z_score = -z_score
+                category_score += idx_weight * z_score
+            total_score += category_score * cat_weight
+        
+        if expected_inbreeding is None:
+            expected_inbreeding = round(self._expected_inbreeding(
+                female_data, bull_data,
+                self._get_index_value(female_data, 'genomic_inbreeding'), self._get_index_value(bull_data, 'gfi'))[0], 2)
         
-        rankings.sort(key=lambda x: x['iep'], reverse=True)
+        inbreeding_penalty = 0
+        if expected_inbreeding > self.params.inbreeding_ideal:
+            inbreeding_penalty = self.params.inbreeding_penalty_lambda * (expected_inbreeding - self.params.inbreeding_ideal)
         
-        for i, item in enumerate(rankings[:top_n], 1):
-            item['rank'] = i
+        normalized_score = 50 + (total_score - inbreeding_penalty) * 15
+        return round(max(0, min(100, normalized_score)), 1)
+    
+    def rank_bulls_for_female(self, female_data: Dict, bulls: List[Dict], top_n: int = 10, max_inbreeding: float = 8.0,
+                              custom_weights: Optional[Dict] = None, include_analysis: bool = True,
+                              diversity: Optional[Dict] = None) -> List[Dict]:
+        """
+        Rankeia touros para uma fêmea.
+        
+        Calcula só o IEP escalar de cada candidato, seleciona o top N com heap
+        (heapq.nlargest é estável: empates mantêm a ordem de entrada, como o sort)
+        e monta a análise completa apenas para os sobreviventes.
+        Com `diversity` (ver diversity.py), o top N limita touros por pai/MGS e pode
+        penalizar a coancestria entre os escolhidos.
+        """
+        rule = DiversityRule.parse(diversity)
+        female_data = self.as_record(female_data, is_bull=False)
+        bull_records = [self.as_record(bull_data, is_bull=True) for bull_data in bulls]
+        if not bull_records:
+            return []
+        
+        # Pré-filtro em arrays: consanguinidade esperada e haplótipos letais de todos os touros
+        female_matrix = build_trait_matrix(self, [female_data], ())
+        bull_matrix = build_trait_matrix(self, bull_records, (), is_bull=True)
+        expected, _ = expected_inbreeding(female_matrix, bull_matrix, self.pedigree)
+        eligible = np.flatnonzero(eligible_pairs(female_matrix, bull_matrix, max_inbreeding, self.pedigree)[0])
+        
+        candidates = []
+        for col in eligible:
+            bull_data = bull_records[col]
+            inbreeding = round(float(expected[0, col]), 2)
+            candidates.append((self.score_economic_index(female_data, bull_data, custom_weights, inbreeding), bull_data))
+        
+        lineage = None
+        if rule is None:
+            selected = heapq.nlargest(max(top_n, 0), range(len(candidates)), key=lambda k: candidates[k][0])
+        else:
+            # Ordem completa (estável, como o heap) percorrida pela seleção gulosa
+            scores = np.array([score for score, _ in candidates], dtype=float)
+            order = np.argsort(-scores, kind='stable')
+            lineage = LineageIndex.build(bull_matrix).take(eligible)
+            coancestry = None
+            if rule.coancestry_penalty > 0:
+                coancestry = pool_coancestry(bull_matrix.take(eligible), [penalty_pool(order, top_n)], self.pedigree)
+            selected = diverse_top(order, scores, lineage, rule, top_n, coancestry)
         
-        return rankings[:top_n]
+        rankings = []
+        for rank, k in enumerate(selected, 1):
+            bull_data = candidates[k][1]
+            iep_result = self.calculate_economic_index(female_data, bull_data, custom_weights)
+            item = {
+                'bull': {'id': bull_data.get('id'), 'code': bull_data.get('code'), 'name': bull_data.get('name'), 'source': bull_data.get('source')},
+                'iep': iep_result['iep_normalized'], 'grade': iep_result['grade'],
+                'inbreeding': iep_result['inbreeding']['expected_inbreeding'], 'inbreeding_risk': iep_result['inbreeding']['risk_level'],
+                'categories': {cat: data['score'] for cat, data in iep_result['categories'].items()},
+                'reliability': iep_result['reliability']
+            }
+            if include_analysis:
+                item['full_analysis'] = iep_result
+            if lineage is not None:
+                item['lineage'] = lineage.lineage(k)
+            item['rank'] = rank
+            rankings.append(item)
+        
+        return rankings
     
-    def calculate_compatibility_score(self, female_data: Dict, bull_data: Dict, priorities: Optional[Dict] = None) -> Dict:
-        """Wrapper de compatibilidade"""
-        iep_result = self.calculate_economic_index(female_data, bull_data, priorities)
+    def calculate_compatibility_score(self, female_data: Dict, bull_data: Dict, priorities: Optional[Dict] = None,
+                                      detail: str = 'full') -> Dict:
+        """Wrapper de compatibilidade ('summary': só score, grade e reliability)"""
+        iep_result = self.calculate_economic_index(female_data, bull_data, priorities, detail)
+        
+        if detail == 'summary':
+            return {'score': iep_result['iep_normalized'], 'grade': iep_result['grade'], 'reliability': iep_result['reliability']}
         
         return {
             'score': iep_result['iep_normalized'],
@@ -375,97 +621,22 @@ class GeneticCalculator:
         }
     
     def _get_index_value(self, data: Dict, index: str) -> Optional[float]:
-        name_mapping = {
-            'genomic_inbreeding': ['genomic_inbreeding', 'gINB', 'ginb', 'gInb'],
-            'gfi': ['gfi', 'GFI', 'genomic_future_inbreeding'],
-            'productive_life': ['productive_life', 'PRODUCTIVE LIFE', 'PL'],
-            'fertility_index': ['fertility_index', 'FERTILITY INDEX', 'FI'],
-            'scs': ['scs', 'SCS', 'SOMATIC CELL SCORE'],
-            'dpr': ['dpr', 'DPR', 'DAUGHTER PREGNANCY RATE'],
-            'hcr': ['hcr', 'HCR', 'HEIFER CONCEPTION RATE'],
-            'ccr': ['ccr', 'CCR', 'COW CONCEPTION RATE'],
-        }
-        
-        keys_to_try = name_mapping.get(index, [index, index.upper(), index.lower()])
-        
-        for key in keys_to_try:
-            value = data.get(key)
-            if value is not None:
-                try:
-                    return float(value)
-                except (ValueError, TypeError):
-                    pass
-        
-        for source in ['main_indices', 'genetic_data']:
-            source_data = data.get(source, {})
-            if isinstance(source_data, dict):
-                for key in keys_to_try:
-                    value = source_data.get(key)
-                    if value is not None:
-                        try:
-                            return float(value)
-                        except (ValueError, TypeError):
-                            pass
-        
-        return None
+        if isinstance(data, TraitRecord):
+            pos = TRAIT_POSITIONS.get(index)
+            if pos is not None:
+                return data.value(pos)
+            return resolve_trait_value(data.data, index)
+        return resolve_trait_value(data, index)
     
     def _get_reliability(self, data: Dict, index: str, is_bull: bool = False) -> float:
-        rel_key = f'{index}_rel'
-        
-        # 1. Campo específico
-        rel_value = data.get(rel_key)
-        if rel_value is not None:
-            try:
-                val = float(rel_value)
-                if 0 <= val <= 100:
-                    return val
-            except (ValueError, TypeError):
-                pass
-        
-        # 2. Campo reliabilities JSON
-        reliabilities = data.get('reliabilities', {})
-        if isinstance(reliabilities, str):
-            try:
-                reliabilities = json.loads(reliabilities)
-            except:
-                reliabilities = {}
-        if isinstance(reliabilities, dict):
-            rel_value = reliabilities.get(rel_key) or reliabilities.get(index)
-            if rel_value is not None:
-                try:
-                    val = float(rel_value)
-                    if 0 <= val <= 100:
-                        return val
-                except (ValueError, TypeError):
-                    pass
-        
-        # 3. genetic_data
-        genetic = data.get('genetic_data', {})
-        if isinstance(genetic, dict):
-            for key in [rel_key, f'{index.upper()}_REL', f'{index} REL']:
-                rel_value = genetic.get(key)
-                if rel_value is not None:
-                    try:
-                        val = float(rel_value)
-                        if 0 <= val <= 100:
-                            return val
-                    except (ValueError, TypeError):
-                        pass
-        
-        # 4. Inferir por filhas
-        if is_bull:
-            daughters = data.get('daughters') or data.get('num_daughters')
-            if daughters:
-                try:
-                    d = int(daughters)
-                    if d >= 1000: return 99.0
-                    elif d >= 500: return 95.0
-                    elif d >= 100: return 85.0
-                    elif d >= 50: return 80.0
-                    elif d > 0: return 75.0
-                except (ValueError, TypeError):
-                    pass
+        if isinstance(data, TraitRecord):
+            pos = TRAIT_POSITIONS.get(index)
+            rel = data.reliability(pos) if pos is not None else resolve_reliability(data.data, index, is_bull)
+        else:
+            rel = resolve_reliability(data, index, is_bull)
         
+        if rel is not None:
+            return rel
         return self.params.default_bull_reliability if is_bull else self.params.default_cow_reliability
     
     def _interpret_pppv(self, index: str, value: float) -> str:
@@ -15,12 +15,15 @@ import re
 import json
 import hashlib
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 import pandas as pd
 import PyPDF2
 from sqlalchemy.orm import Session
 
 from backend.models.database import Female, Bull, ImportHistory
+from backend.services.genetics import genetic_calculator
+from backend.services.matching import MatchingService
+from backend.services.population import record_changes
 
 
 class UniversalBullParser:
@@ -561,9 +564,15 @@ class UniversalBullParser:
 class DataImporter:
     """Importador inteligente de dados"""
     
-    def __init__(self, db_session: Session):
+    def __init__(self, db_session: Session, refresh_matrix: Optional[Callable[[], None]] = None):
+        """
+        `refresh_matrix`: agenda a atualização da matriz de scores fora da importação
+        (na API, BatchJobManager.refresh_score_matrix); sem ele, a atualização é feita
+        aqui mesmo, ao fim da importação (scripts de linha de comando)
+        """
         self.session = db_session
         self.bull_parser = UniversalBullParser()
+        self.refresh_matrix = refresh_matrix
     
     # ========================================================================
     # IMPORTAÇÃO DE FÊMEAS (EXCEL) - SEM MODIFICAÇÕES
@@ -574,8 +583,11 @@ class DataImporter:
         print(f"Importando fêmeas de: {excel_path}")
         
         stats = {'added': 0, 'updated': 0, 'unchanged': 0, 'errors': []}
+        updated_ids = []
+        population_changes = []  # (valores antigos, novos) para as estatísticas do rebanho
         
         try:
+            matching_service = MatchingService(self.session)
             df = pd.read_excel(excel_path, engine='openpyxl')
             print(f"  Lidas {len(df)} fêmeas do Excel")
             
@@ -609,11 +621,14 @@ class DataImporter:
                         existing_hash = self._hash_dict(existing.genetic_data or {})
                         
                         if data_hash != existing_hash:
+                            old_values = matching_service.trait_values(existing)
                             existing.genetic_data = genetic_data
                             existing.name = str(row.get('ID', ''))
                             for key, value in main_indices.items():
                                 setattr(existing, key, value)
                             existing.last_updated = datetime.now()
+                            population_changes.append((old_values, matching_service.trait_values(existing)))
+                            updated_ids.append(existing.id)
                             stats['updated'] += 1
                         else:
                             stats['unchanged'] += 1
@@ -627,12 +642,16 @@ class DataImporter:
                             **main_indices
                         )
                         self.session.add(new_female)
+                        population_changes.append((None, matching_service.trait_values(new_female)))
                         stats['added'] += 1
                 
                 except Exception as e:
                     stats['errors'].append(f"Linha {idx}: {str(e)}")
             
+            record_changes(self.session, 'herd', population_changes)
             self.session.commit()
+            genetic_calculator.invalidate_animals('female', updated_ids)
+            self._refresh_score_matrix()
             self._log_import('females_excel', excel_path, stats, user)
             
             print(f"\n[OK] Importacao concluida: +{stats['added']}, ~{stats['updated']}, ={stats['unchanged']}")
@@ -671,8 +690,11 @@ class DataImporter:
         print('='*60)
         
         stats = {'added': 0, 'updated': 0, 'unchanged': 0, 'errors': []}
+        updated_ids = []
+        population_changes = []  # (valores antigos, novos) para as estatísticas do catálogo
         
         try:
+            matching_service = MatchingService(self.session)
             # Usar parser universal
             bulls_data = self.bull_parser.parse_pdf(pdf_path)
             print(f"  Extraídos {len(bulls_data)} touros do PDF")
@@ -695,6 +717,7 @@ class DataImporter:
                     
                     if existing:
                         # ATUALIZAR
+                        old_values = matching_service.trait_values(existing)
                         for key, value in main_indices.items():
                             if value is not None:
                                 setattr(existing, key, value)
@@ -710,6 +733,8 @@ class DataImporter:
                         
                         existing.is_available = True
                         existing.last_updated = datetime.now()
+                        population_changes.append((old_values, matching_service.trait_values(existing)))
+                        updated_ids.append(existing.id)
                         stats['updated'] += 1
                     else:
                         # ADICIONAR NOVO
@@ -727,12 +752,16 @@ class DataImporter:
                             **{k: v for k, v in main_indices.items() if v is not None}
                         )
                         self.session.add(new_bull)
+                        population_changes.append((None, matching_service.trait_values(new_bull)))
                         stats['added'] += 1
                 
                 except Exception as e:
                     stats['errors'].append(f"Touro {idx}: {str(e)}")
             
+            record_changes(self.session, 'bulls', population_changes)
             self.session.commit()
+            genetic_calculator.invalidate_animals('bull', updated_ids)
+            self._refresh_score_matrix()
             self._log_import('bulls_pdf', pdf_path, stats, user)
             
             print(f"\n{'='*60}")
@@ -792,6 +821,20 @@ class DataImporter:
         except (ValueError, TypeError):
             return None
     
+    def _refresh_score_matrix(self):
+        """Recalcula só as linhas/colunas da matriz de scores afetadas pela importação"""
+        if self.refresh_matrix is not None:
+            # Até lá as linhas desatualizadas não são lidas (stamps/parâmetros/ascendência diferem)
+            self.refresh_matrix()
+            print("  Matriz de scores: atualização agendada em segundo plano")
+            return
+        try:
+            stats = MatchingService(self.session).score_matrix().refresh()
+            print(f"  Matriz de scores: {stats['rows_refreshed']} linhas, {stats['columns_refreshed']} colunas recalculadas")
+        except Exception as e:
+            self.session.rollback()
+            print(f"[AVISO] Matriz de scores não atualizada: {e}")
+    
     def _log_import(self, import_type: str, filename: str, stats: Dict, user: str):
         log = ImportHistory(
             import_type=import_type,
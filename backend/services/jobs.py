@@ -0,0 +1,317 @@
+"""
+Jobs de Acasalamento em Lote
+
+Lotes grandes (rebanho inteiro) rodam em segundo plano num pool de threads local:
+- o pedido vira um BatchJob com a lista ordenada de fêmeas; a resposta é só o id
+- o worker processa as fêmeas em blocos com match_batch e grava, na mesma
+  transação, os resultados do bloco (BatchJobResult) e o progresso (`completed`)
+- o status expõe fêmeas concluídas/total e o ETA pela taxa da execução atual
+- resultados parciais podem ser lidos por página enquanto o job roda
+- ao terminar, o resultado completo é salvo em BatchMating
+- o scoring roda na própria thread (sem pool de processos): fork a partir de uma
+  thread que segura conexões do banco não é seguro
+
+O mesmo pool atualiza a matriz materializada de scores depois das importações
+(refresh_score_matrix), para que a requisição de importação não espere por ela.
+
+Retomada: o job pertence ao processo que o reivindicou (`worker`) e renova o
+heartbeat a cada bloco. Se o processo morrer, o job fica 'running' sem heartbeat
+recente e é reivindicado de novo, continuando da primeira fêmea sem resultado
+gravado. O gerenciador é criado na inicialização do app e uma thread de
+monitoramento reexecuta resume_pending a cada STALE_AFTER segundos; a consulta de
+status também dispara a retomada.
+"""
+
+from typing import Callable, Dict, List, Optional, Set
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import os
+import socket
+import threading
+import numpy as np
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from backend.models.database import BatchJob, BatchJobResult, BatchMating
+from backend.services.matching import MatchingService, batch_summary
+from backend.services.panels import get_bull_panel
+
+
+# Fêmeas por bloco (cada bloco é uma transação: resultados + progresso)
+JOB_CHUNK = 64
+
+# Jobs simultâneos por processo
+JOB_WORKERS = 2
+
+# Segundos sem heartbeat até um job 'running' ser considerado abandonado
+STALE_AFTER = 120
+
+
+class BatchJobManager:
+    """Fila de jobs de lote com pool de threads local"""
+
+    def __init__(self, session_factory: Callable[[], Session], max_workers: int = JOB_WORKERS):
+        self.session_factory = session_factory
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch-job')
+        self._active: Set[int] = set()
+        self._lock = threading.Lock()
+        self._monitor: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._matrix_running = False
+        self._matrix_again = False
+
+    def submit(self, session: Session, female_ids: List[int], params: Dict,
+               created_by: Optional[str] = None) -> BatchJob:
+        """Cria o job (fêmeas sem repetição, na ordem pedida) e agenda a execução"""
+        female_ids = list(dict.fromkeys(int(female_id) for female_id in female_ids))
+        job = BatchJob(status='queued', female_ids=female_ids, params=params,
+                       total=len(female_ids), completed=0, created_by=created_by)
+        session.add(job)
+        session.commit()
+        self._schedule(job.id)
+        return job
+
+    def resume_pending(self) -> List[int]:
+        """Agenda jobs na fila ou abandonados (sem heartbeat recente); retorna os ids"""
+        stale = datetime.now() - timedelta(seconds=STALE_AFTER)
+        session = self.session_factory()
+        try:
+            job_ids = [job_id for (job_id,) in session.query(BatchJob.id).filter(or_(
+                BatchJob.status == 'queued',
+                and_(BatchJob.status == 'running',
+                     or_(BatchJob.heartbeat_at.is_(None), BatchJob.heartbeat_at < stale))
+            )).order_by(BatchJob.id)]
+        finally:
+            session.close()
+        for job_id in job_ids:
+            self._schedule(job_id)
+        return job_ids
+
+    def refresh_score_matrix(self):
+        """
+        Agenda a atualização incremental da matriz materializada no pool. Uma por vez:
+        pedidos durante a execução geram uma única passada extra ao final
+        """
+        with self._lock:
+            if self._matrix_running:
+                self._matrix_again = True
+                return
+            self._matrix_running = True
+        self._pool.submit(self._refresh_matrix)
+
+    def _refresh_matrix(self):
+        while True:
+            session = self.session_factory()
+            try:
+                stats = MatchingService(session).score_matrix().refresh()
+                print(f"[OK] Matriz de scores: {stats['rows_refreshed']} linhas, "
+                      f"{stats['columns_refreshed']} colunas recalculadas")
+            except Exception as e:
+                session.rollback()
+                print(f"[AVISO] Matriz de scores não atualizada: {e}")
+            finally:
+                session.close()
+            with self._lock:
+                if not self._matrix_again:
+                    self._matrix_running = False
+                    return
+                self._matrix_again = False
+
+    def start_monitor(self, interval: float = STALE_AFTER):
+        """Thread daemon que retoma jobs pendentes/abandonados a cada `interval` segundos"""
+        with self._lock:
+            if self._monitor is not None:
+                return
+            self._monitor = threading.Thread(target=self._watch, args=(interval,),
+                                             name='batch-job-monitor', daemon=True)
+        self._monitor.start()
+
+    def stop_monitor(self):
+        self._stop.set()
+
+    def _watch(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.resume_pending()
+            except Exception as e:
+                print(f"[AVISO] Erro ao retomar jobs de lote: {e}")
+
+    def _schedule(self, job_id: int):
+        with self._lock:
+            if job_id in self._active:
+                return
+            self._active.add(job_id)
+        self._pool.submit(self._run, job_id)
+
+    def _claim(self, session: Session, job_id: int) -> bool:
+        """Reivindica o job (UPDATE condicional: só um processo vence)"""
+        now = datetime.now()
+        stale = now - timedelta(seconds=STALE_AFTER)
+        job = session.get(BatchJob, job_id)
+        if job is None:
+            return False
+        claimed = session.query(BatchJob).filter(BatchJob.id == job_id, or_(
+            BatchJob.status == 'queued',
+            and_(BatchJob.status == 'running',
+                 or_(BatchJob.heartbeat_at.is_(None), BatchJob.heartbeat_at < stale))
+        )).update({
+            'status': 'running', 'worker': self.worker_id, 'heartbeat_at': now,
+            'resumed_at': now, 'resumed_from': job.completed,
+            'started_at': job.started_at or now
+        }, synchronize_session=False)
+        session.commit()
+        return claimed == 1
+
+    def _owned(self, session: Session, job_id: int):
+        """Query do job restrita a este processo (perde a posse se outro o reivindicou)"""
+        return session.query(BatchJob).filter(BatchJob.id == job_id, BatchJob.worker == self.worker_id)
+
+    def _run(self, job_id: int):
+        session = self.session_factory()
+        try:
+            if not self._claim(session, job_id):
+                return
+            job = session.get(BatchJob, job_id)
+            params = job.params or {}
+            female_ids = job.female_ids or []
+            service = MatchingService(session)
+            completed = job.completed
+
+            while completed < job.total:
+                chunk = female_ids[completed:completed + JOB_CHUNK]
+                batch = service.match_batch(
+                    female_ids=chunk,
+                    priorities=params.get('priorities'),
+                    max_inbreeding=params.get('max_inbreeding', 6.0),
+                    top_n=params.get('top_n', 5),
+                    filters=params.get('filters'),
+                    formula=params.get('formula'),
+                    diversity=params.get('diversity')
+                )
+                # match_batch devolve na ordem do banco; fêmeas inexistentes não geram resultado
+                by_female = {result['female']['id']: result for result in batch['results']}
+                for offset, female_id in enumerate(chunk):
+                    if female_id in by_female:
+                        session.add(BatchJobResult(job_id=job_id, position=completed + offset,
+                                                   female_id=female_id, result=by_female[female_id]))
+
+                updated = self._owned(session, job_id).update(
+                    {'completed': completed + len(chunk), 'heartbeat_at': datetime.now()},
+                    synchronize_session=False)
+                if not updated:
+                    session.rollback()
+                    return
+                session.commit()
+                completed += len(chunk)
+
+            self._finish(session, job_id, service, params)
+        except Exception as e:
+            session.rollback()
+            self._owned(session, job_id).update(
+                {'status': 'failed', 'error': str(e), 'finished_at': datetime.now()},
+                synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+            with self._lock:
+                self._active.discard(job_id)
+
+    def _finish(self, session: Session, job_id: int, service: MatchingService, params: Dict):
+        """Salva o lote completo em BatchMating e encerra o job (mesma transação)"""
+        job = session.get(BatchJob, job_id)
+        results = [row.result for row in session.query(BatchJobResult)
+                   .filter(BatchJobResult.job_id == job_id).order_by(BatchJobResult.position)]
+        panel = get_bull_panel(session, service.engine)
+        total_bulls = int(np.count_nonzero(panel.filter_mask(params.get('filters'))))
+
+        max_inbreeding = params.get('max_inbreeding', 6.0)
+        batch = BatchMating(
+            batch_name=params.get('batch_name') or f'Lote {datetime.now().strftime("%Y-%m-%d %H:%M")}',
+            description=params.get('description'),
+            priorities=params.get('priorities'),
+            max_inbreeding=max_inbreeding,
+            female_ids=job.female_ids,
+            recommendations={
+                'summary': batch_summary(results, total_bulls, params.get('top_n', 5),
+                                         max_inbreeding, params.get('priorities'), params.get('formula'),
+                                         params.get('diversity')),
+                'results': results
+            },
+            created_by=job.created_by
+        )
+        session.add(batch)
+        session.flush()
+
+        updated = self._owned(session, job_id).update(
+            {'status': 'completed', 'batch_mating_id': batch.id, 'finished_at': datetime.now(),
+             'heartbeat_at': datetime.now()}, synchronize_session=False)
+        if not updated:
+            session.rollback()
+            return
+        session.commit()
+
+
+def job_status(job: BatchJob) -> Dict:
+    """Status do job: progresso (concluídas/total) e ETA pela taxa da execução atual"""
+    eta_seconds = None
+    if job.status == 'running' and job.resumed_at and job.heartbeat_at:
+        done = job.completed - (job.resumed_from or 0)
+        elapsed = (job.heartbeat_at - job.resumed_at).total_seconds()
+        if done > 0 and elapsed > 0:
+            remaining = (job.total - job.completed) * elapsed / done
+            since_heartbeat = (datetime.now() - job.heartbeat_at).total_seconds()
+            eta_seconds = round(max(remaining - since_heartbeat, 0.0), 1)
+    elif job.status == 'completed':
+        eta_seconds = 0.0
+
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'progress': {
+            'completed': job.completed, 'total': job.total,
+            'percent': round(100.0 * job.completed / job.total, 1) if job.total else 100.0
+        },
+        'eta_seconds': eta_seconds,
+        'batch_id': job.batch_mating_id,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+def job_results(session: Session, job: BatchJob, page: int = 1, per_page: int = 50) -> Dict:
+    """Página dos resultados já gravados (na ordem do lote)"""
+    query = session.query(BatchJobResult).filter(BatchJobResult.job_id == job.id)
+    available = query.count()
+    rows = query.order_by(BatchJobResult.position).offset((page - 1) * per_page).limit(per_page).all()
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'complete': job.status == 'completed',
+        'available': available,
+        'total': job.total,
+        'page': page,
+        'per_page': per_page,
+        'total_pages': (available + per_page - 1) // per_page,
+        'results': [row.result for row in rows]
+    }
+
+
+_manager: Optional[BatchJobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager(session_factory: Callable[[], Session]) -> BatchJobManager:
+    """
+    Gerenciador do processo; na criação retoma os jobs pendentes ou abandonados e
+    inicia o monitoramento periódico (chamado na inicialização do app)
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = BatchJobManager(session_factory)
+            _manager.resume_pending()
+            _manager.start_monitor()
+    return _manager
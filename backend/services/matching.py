@@ -3,11 +3,118 @@ Serviço de Matching e Recomendação AVANÇADO
 Sistema Genefy - Usa cálculos genéticos com ~80% acurácia
 """
 
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
+import threading
+import numpy as np
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from backend.models.database import Female, Bull
 from backend.services.genetics import genetic_calculator, GeneticCalculator
+from backend.services.traits import LETHAL_HAPLOTYPES, TRAITS, TRAIT_POSITIONS, as_record
+from backend.services.formulas import compile_formula, catalog_index, pair_index
+from backend.services.scoring import (ScoringEngine, INBREEDING_RISKS, build_trait_matrix, py_round,
+                                      expected_inbreeding, bull_coancestry, pair_pppv)
+from backend.services.simulation import OffspringSimulator, Condition, DEFAULT_QUANTILES
+from backend.services.panels import get_bull_panel, get_herd_panel, prepare_bull_data
+from backend.services.pedigree import get_pedigree
+from backend.services.cache import fingerprint
+from backend.services.score_matrix import ScoreMatrixStore
+from backend.services.allocation import solve_allocation, VALUE_SCALE
+from backend.services.mating_plan import PlanProblem, optimize_plan
+from backend.services.parallel import score_components
+from backend.services.similarity import get_similarity_index
+from backend.services.skyline import pareto_front
+from backend.services.diversity import DiversityRule, diverse_top, penalty_pool, pool_coancestry
+from backend.services.population import (POPULATIONS, REBUILD_CHUNK, active_versions, get_population_stats,
+                                         rebuild_moments)
+
+
+# Perfis de peso por chamada de match_profiles
+MAX_PROFILES = 16
+
+# Objetivos padrão da fronteira de Pareto (NM$, vida produtiva, fertilidade, consanguinidade)
+DEFAULT_OBJECTIVES = ('net_merit', 'productive_life', 'fertility_index', 'inbreeding')
+
+# Objetivos por consulta de fronteira
+MAX_OBJECTIVES = 8
+
+
+class BatchSummary:
+    """Resumo de um lote acumulado fêmea a fêmea (memória não depende do tamanho do lote)"""
+    
+    def __init__(self, total_bulls: int, top_n: int, max_inbreeding: float, priorities: Optional[Dict],
+                 formula: Optional[str] = None, diversity: Optional[Dict] = None):
+        self.total_bulls = total_bulls
+        self.top_n = top_n
+        self.max_inbreeding = max_inbreeding
+        self.priorities = priorities
+        self.formula = formula
+        self.diversity = diversity
+        self.females = 0
+        self.recommendations = 0
+        self.score_sum = 0.0
+        self.inbreeding_sum = 0.0
+        self.bulls_used = set()
+    
+    def add(self, result: Dict):
+        self.females += 1
+        for bull in result['top_bulls']:
+            self.recommendations += 1
+            self.score_sum += bull['score']
+            self.inbreeding_sum += bull['inbreeding']['expected_inbreeding']
+            self.bulls_used.add(bull['bull']['code'])
+    
+    def as_dict(self) -> Dict:
+        count = self.recommendations
+        summary = {
+            'total_females': self.females, 'total_bulls_analyzed': self.total_bulls,
+            'top_n': self.top_n, 'max_inbreeding': self.max_inbreeding,
+            'priorities_used': self.priorities or 'default',
+            'average_iep': round(self.score_sum / count, 1) if count else 0,
+            'average_inbreeding': round(self.inbreeding_sum / count, 2) if count else 0,
+            'unique_bulls_recommended': len(self.bulls_used)
+        }
+        if self.formula:
+            summary['index_formula'] = self.formula
+        if self.diversity:
+            summary['diversity'] = self.diversity
+        return summary
+
+
+def batch_summary(results: List[Dict], total_bulls: int, top_n: int, max_inbreeding: float,
+                  priorities: Optional[Dict], formula: Optional[str] = None, diversity: Optional[Dict] = None) -> Dict:
+    """Resumo de um lote a partir dos resultados por fêmea de match_batch"""
+    rule = DiversityRule.parse(diversity)
+    summary = BatchSummary(total_bulls, top_n, max_inbreeding, priorities, formula, rule and rule.as_dict())
+    for result in results:
+        summary.add(result)
+    return summary.as_dict()
+
+
+_context_lock = threading.Lock()
+_context: Optional[Tuple[Tuple, GeneticCalculator, ScoringEngine]] = None
+
+
+def scoring_context(session: Session) -> Tuple[GeneticCalculator, ScoringEngine]:
+    """
+    (calculador, motor) com o pedigree e as estatísticas populacionais atuais: um
+    instantâneo de genetic_calculator (GeneticCalculator.snapshot), refeito só quando a
+    revisão do pedigree ou a versão das estatísticas muda. O calculador global nunca é
+    alterado, então requisições e jobs simultâneos não trocam os dados uns dos outros.
+    """
+    global _context
+    pedigree = get_pedigree(session)
+    versions, stats = get_population_stats(session, genetic_calculator.params.stats_populations)
+    key = (pedigree.revision, tuple(sorted(versions.items())))
+    context = _context
+    if context is None or context[0] != key:
+        with _context_lock:
+            if _context is None or _context[0] != key:
+                calculator = genetic_calculator.snapshot(pedigree, stats, versions)
+                _context = (key, calculator, ScoringEngine(calculator))
+            context = _context
+    return context[1], context[2]
 
 
 class MatchingService:
@@ -15,10 +122,65 @@ class MatchingService:
     
     def __init__(self, db_session: Session):
         self.session = db_session
-        self.calculator = genetic_calculator
+        self._context = None  # (calculador, motor) carregados no primeiro uso
+    
+    @property
+    def calculator(self) -> GeneticCalculator:
+        return self._scoring_context()[0]
     
-    def match_single(self, female_id: int, bull_id: int) -> Dict:
-        """Analisa um acasalamento específico"""
+    @property
+    def engine(self) -> ScoringEngine:
+        return self._scoring_context()[1]
+    
+    def _scoring_context(self):
+        """
+        Pedigree e estatísticas populacionais só são lidos quando o serviço pontua algo
+        (importações que só usam trait_values não pagam por eles); o par fica fixo até o
+        fim do serviço, mesmo que outra requisição carregue versões mais novas
+        """
+        if self._context is None:
+            self._context = scoring_context(self.session)
+        return self._context
+    
+    def ensure_population_stats(self) -> Dict[str, int]:
+        """
+        Passo de inicialização: reconstrói as estatísticas se nenhuma população foi calculada
+        ainda (banco novo); depois disso as importações as mantêm de forma incremental
+        """
+        if active_versions(self.session):
+            return {}
+        return self.rebuild_population_stats()
+    
+    def rebuild_population_stats(self) -> Dict[str, int]:
+        """Recalcula os momentos de cada população numa passada sobre o banco (novas versões)"""
+        versions = {}
+        try:
+            for population in POPULATIONS:
+                model = Bull if population == 'bulls' else Female
+                animals = self.session.query(model).yield_per(REBUILD_CHUNK)
+                versions[population] = rebuild_moments(self.session, population,
+                                                       (self.trait_values(animal) for animal in animals))
+            self.session.commit()
+        except IntegrityError:
+            # Outro processo reconstruiu ao mesmo tempo: vale a versão dele
+            self.session.rollback()
+        return versions
+    
+    def trait_values(self, animal, is_bull: Optional[bool] = None):
+        """
+        Valores das características (posições de TRAITS, NaN = ausente) de uma fêmea ou touro.
+        Aceita qualquer objeto com os atributos do modelo (ex.: linha lida por SQL direto,
+        com `is_bull` explícito); não consulta o banco.
+        """
+        if isinstance(animal, Bull) if is_bull is None else is_bull:
+            return as_record(self._prepare_bull_data(animal), is_bull=True).values
+        return as_record(self._prepare_female_data(animal)).values
+    
+    def match_single(self, female_id: int, bull_id: int, detail: str = 'full', include_pppv: bool = True) -> Dict:
+        """
+        Analisa um acasalamento específico. `detail` (summary/categories/full) limita o que o
+        calculador monta; o PPPV por índice só é calculado em 'full' com `include_pppv`
+        """
         female = self.session.query(Female).get(female_id)
         bull = self.session.query(Bull).get(bull_id)
         
@@ -27,12 +189,22 @@ class MatchingService:
         if not bull:
             raise ValueError(f"Touro {bull_id} não encontrado")
         
-        female_data = self._prepare_female_data(female)
-        bull_data = self._prepare_bull_data(bull)
+        female_data = self.calculator.cached_record(female, self._prepare_female_data)
+        bull_data = self.calculator.cached_record(bull, self._prepare_bull_data, is_bull=True)
         
-        pppv = self.calculator.calculate_pppv(female_data, bull_data)
-        inbreeding = self.calculator.calculate_inbreeding(female_data, bull_data)
-        compatibility = self.calculator.calculate_compatibility_score(female_data, bull_data)
+        include_pppv = include_pppv and detail == 'full'
+        
+        def analyze():
+            analysis = {}
+            if include_pppv:
+                analysis['pppv'] = self.calculator.calculate_pppv(female_data, bull_data)
+            analysis['inbreeding'] = self.calculator.calculate_inbreeding(female_data, bull_data, detail)
+            analysis['compatibility'] = self.calculator.calculate_compatibility_score(female_data, bull_data, detail=detail)
+            return analysis
+        
+        # Reaberturas do mesmo par são servidas do cache (até um dos animais mudar)
+        analysis = self.calculator.memoize_pair('match_single', female, bull, analyze,
+                                                options={'detail': detail, 'pppv': include_pppv})
         
         return {
             'female': {
@@ -44,72 +216,765 @@ class MatchingService:
                 'id': bull.id, 'code': bull.code, 'name': bull.name,
                 'source': bull.source, 'main_indices': self._get_main_indices(bull_data)
             },
-            'analysis': {'pppv': pppv, 'inbreeding': inbreeding, 'compatibility': compatibility},
-            'recommendation': self._generate_recommendation(compatibility, inbreeding)
+            'analysis': analysis,
+            'recommendation': self._generate_recommendation(analysis['compatibility'], analysis['inbreeding'], detail)
         }
     
     def match_batch(self, female_ids: List[int], priorities: Optional[Dict] = None,
-                   max_inbreeding: float = 6.0, top_n: int = 5, filters: Optional[Dict] = None) -> Dict:
-        """Encontra os melhores touros para um lote de fêmeas"""
+                   max_inbreeding: float = 6.0, top_n: int = 5, filters: Optional[Dict] = None,
+                   workers: int = 1, detail: str = 'categories', formula: Optional[str] = None,
+                   diversity: Optional[Dict] = None) -> Dict:
+        """
+        Encontra os melhores touros para um lote de fêmeas (scoring em `workers` processos).
+        `detail`: 'summary' (sem categorias), 'categories' ou 'full' (+ análise completa do par)
+        `formula`: índice personalizado (ver formulas.py) que ordena os touros no lugar do IEP
+        `diversity`: limites por pai/MGS e penalidade de coancestria no top N (ver diversity.py)
+        """
+        results = []
+        summary = None
+        for item in self.iter_batch(female_ids, priorities, max_inbreeding, top_n, filters, workers,
+                                    detail=detail, formula=formula, diversity=diversity):
+            if 'summary' in item:
+                summary = item['summary']
+            else:
+                results.append(item)
+        
+        return {'summary': summary, 'results': results}
+    
+    def iter_batch(self, female_ids: List[int], priorities: Optional[Dict] = None,
+                   max_inbreeding: float = 6.0, top_n: int = 5, filters: Optional[Dict] = None,
+                   workers: int = 1, chunk_size: Optional[int] = None, detail: str = 'categories',
+                   formula: Optional[str] = None, diversity: Optional[Dict] = None) -> Iterator[Dict]:
+        """
+        Resultados de match_batch fêmea a fêmea, seguidos de um item final {'summary': ...}
+        (agregados calculados incrementalmente). Com `chunk_size`, as fêmeas são lidas e
+        pontuadas em blocos desse tamanho: o primeiro resultado sai após o primeiro bloco e
+        a memória não cresce com o lote. Erros de validação são levantados já na chamada.
+        """
+        index = compile_formula(formula) if formula else None
+        rule = DiversityRule.parse(diversity)
+        
+        # Touros vêm do painel colunar em cache (sem reconsultar o banco)
+        panel = get_bull_panel(self.session, self.engine)
+        rows = np.flatnonzero(panel.filter_mask(filters))
+        
+        if len(rows) == 0:
+            raise ValueError("Nenhum touro disponível")
+        
+        bull_matrix, bulls_data = panel.select(rows)
+        summary = BatchSummary(len(rows), top_n, max_inbreeding, priorities, index and index.expression,
+                               rule and rule.as_dict())
+        female_ids = list(female_ids)
+        step = chunk_size or max(len(female_ids), 1)
+        
+        def generate():
+            for start in range(0, len(female_ids), step):
+                females = self.session.query(Female).filter(Female.id.in_(female_ids[start:start + step])).all()
+                for result in self._rank_batch(females, panel, rows, bull_matrix, bulls_data,
+                                               priorities, max_inbreeding, top_n, filters, workers, detail,
+                                               index, rule):
+                    summary.add(result)
+                    yield result
+            yield {'summary': summary.as_dict()}
+        
+        return generate()
+    
+    def _rank_batch(self, females: List[Female], panel, rows: np.ndarray, bull_matrix, bulls_data: List[Dict],
+                    priorities: Optional[Dict], max_inbreeding: float, top_n: int,
+                    filters: Optional[Dict], workers: int, detail: str = 'categories', index=None,
+                    rule: Optional[DiversityRule] = None) -> List[Dict]:
+        """
+        Top N touros de cada fêmea do bloco (na ordem de `females`), montados no nível `detail`.
+        Com `index` (IndexFormula), os touros são ordenados pelo índice do par em vez do IEP.
+        Com `rule` (DiversityRule), o top N limita touros por pai/MGS (seleção gulosa na ordem do ranking).
+        """
         results = []
+        females_data = [self.calculator.cached_record(female, self._prepare_female_data) for female in females]
+        
+        # Fêmeas já ranqueadas com o mesmo painel/opções saem do cache; só as demais são pontuadas
+        options = fingerprint((panel.version, priorities, max_inbreeding, top_n, filters, detail,
+                               index and index.digest, rule and rule.as_dict()))
+        params_hash = self.calculator.params_fingerprint()
+        keys = [self.calculator.pair_key('match_batch', female, options=options, params_hash=params_hash) for female in females]
+        top_by_female = {}
+        for row, key in enumerate(keys):
+            cached = self.calculator.pairs.lookup(key)
+            if cached is not None:
+                top_by_female[row] = cached
+        pending = [row for row in range(len(females)) if row not in top_by_female]
+        
+        # Componentes por categoria do lote ficam guardados no painel: quando só os pesos mudam,
+        # o IEP é re-ponderado (scores por categoria × pesos) sem recalcular PPPV/z-scores
+        # Com os pesos padrão, a matriz materializada (se atualizada) reduz cada fêmea aos
+        # candidatos ao top N, que são recalculados em precisão total
+        candidates = None
+        if pending and not priorities and index is None and rule is None:
+            materialized = self.score_matrix().read([females[row] for row in pending], panel.ids[rows])
+            if materialized is not None:
+                candidates = materialized.candidates(top_n, max_inbreeding)
+        
+        components = self._category_components(panel, bull_matrix, [females[row] for row in pending],
+                                               [females_data[row] for row in pending], filters, max_inbreeding,
+                                               params_hash, candidates, top_n, workers) if pending else []
+        
+        for start, cols, category_scores in components:
+            scores = self.engine.reweight(category_scores, priorities)
+            values = None
+            if index is not None:
+                # Índice de todos os pares do bloco numa passada (PPPV das características da fórmula)
+                chunk = [females_data[row] for row in pending[start:start + scores.shape[0]]]
+                values = pair_index(index, build_trait_matrix(self.calculator, chunk, index.traits),
+                                    panel.catalog.take(rows[cols]), self.calculator.population_stats,
+                                    scores.expected_inbreeding, scores.iep_normalized)
+            orders = lineage = coancestry = None
+            if rule is not None:
+                # Ordem completa de cada fêmea; a seleção gulosa só percorre o começo dela
+                orders = [scores.rank_row(row, len(cols), max_inbreeding, None if values is None else values[row])
+                          for row in range(scores.shape[0])]
+                lineage = panel.lineage().take(rows[cols])
+                if rule.coancestry_penalty > 0:
+                    coancestry = self._pool_coancestry(bull_matrix.take(cols), orders, top_n)
+            for row in range(scores.shape[0]):
+                formatted_bulls = []
+                if rule is None:
+                    ranked = scores.rank_row(row, top_n, max_inbreeding, None if values is None else values[row])
+                else:
+                    criterion = py_round(scores.iep_normalized[row], 1) if values is None else values[row]
+                    ranked = diverse_top(orders[row], criterion, lineage, rule, top_n, coancestry)
+                for rank, col in enumerate(ranked, 1):
+                    bull_data = bulls_data[cols[col]]
+                    inbreeding = float(scores.expected_inbreeding[row, col])
+                    item = {
+                        'rank': rank,
+                        'bull': {'id': bull_data.get('id'), 'code': bull_data.get('code'), 'name': bull_data.get('name'), 'source': bull_data.get('source')},
+                        'score': round(float(scores.iep_normalized[row, col]), 1),
+                        'grade': self.calculator._grade_iep(scores.iep_normalized[row, col]),
+                        'inbreeding': {'expected_inbreeding': inbreeding, 'risk_level': INBREEDING_RISKS[scores.inbreeding_risk[row, col]]},
+                        'reliability': float(scores.reliability[row, col])
+                    }
+                    if values is not None:
+                        item['index_value'] = round(float(values[row, col]), 3)
+                    if lineage is not None:
+                        item['lineage'] = lineage.lineage(col)
+                    if detail != 'summary':
+                        item['categories'] = scores.category_dict(row, col)
+                    if detail == 'full':
+                        item['full_analysis'] = self.calculator.calculate_economic_index(
+                            females_data[pending[start + row]], bull_data, priorities)
+                    formatted_bulls.append(item)
+                female_row = pending[start + row]
+                top_by_female[female_row] = formatted_bulls
+                self.calculator.pairs.store(keys[female_row], (('female', females[female_row].id), ('bull', None)), formatted_bulls)
+        
+        for row, (female, female_data) in enumerate(zip(females, females_data)):
+            female_item = {'id': female.id, 'reg_id': female.reg_id, 'internal_id': female.internal_id, 'name': female.name}
+            if detail != 'summary':
+                female_item['main_indices'] = self._get_main_indices(female_data)
+            results.append({'female': female_item, 'top_bulls': top_by_female[row]})
+        
+        return results
+    
+    def _pool_coancestry(self, bulls, orders: List[np.ndarray], top_n: int):
+        """Coancestria entre os candidatos da seleção com penalidade (união dos pools das fêmeas do bloco)"""
+        return pool_coancestry(bulls, [penalty_pool(order, top_n) for order in orders], self.calculator.pedigree)
+    
+    def match_profiles(self, female_ids: List[int], profiles: Dict[str, Optional[Dict]], max_inbreeding: float = 6.0,
+                       top_n: int = 5, filters: Optional[Dict] = None, workers: int = 1) -> Dict:
+        """
+        Ranking do lote sob K perfis de pesos de categoria numa só passada: PPPV, z-scores e
+        scores por categoria são calculados uma vez e a matriz K × C de pesos é aplicada de uma
+        vez. Retorna o top N de cada perfil por fêmea e a sobreposição entre os perfis.
+        """
+        if not profiles:
+            raise ValueError("Informe ao menos um perfil de pesos")
+        if len(profiles) > MAX_PROFILES:
+            raise ValueError(f"No máximo {MAX_PROFILES} perfis por chamada")
+        names = list(profiles)
+        weights = [profiles[name] or None for name in names]
+        for name, profile in zip(names, weights):
+            if profile is not None and not isinstance(profile, dict):
+                raise ValueError(f"Perfil '{name}' deve ser um dicionário categoria -> peso")
         
         females = self.session.query(Female).filter(Female.id.in_(female_ids)).all()
-        bulls_query = self.session.query(Bull).filter(Bull.is_available == True)
+        panel = get_bull_panel(self.session, self.engine)
+        rows = np.flatnonzero(panel.filter_mask(filters))
+        
+        if len(rows) == 0:
+            raise ValueError("Nenhum touro disponível")
+        
+        bull_matrix, bulls_data = panel.select(rows)
+        females_data = [self.calculator.cached_record(female, self._prepare_female_data) for female in females]
+        components = self._category_components(panel, bull_matrix, females, females_data, filters, max_inbreeding,
+                                               self.calculator.params_fingerprint(), workers=workers) if females else []
+        
+        top_by_profile = {name: [[] for _ in females] for name in names}
+        for start, cols, category_scores in components:
+            iep = self.engine.reweight_profiles(category_scores, weights)  # (K, linhas, colunas)
+            rounded = py_round(iep, 1)
+            allowed = (category_scores.expected_inbreeding <= max_inbreeding) & ~category_scores.critical_haplotypes
+            for row in range(category_scores.shape[0]):
+                eligible = np.flatnonzero(allowed[row])
+                for k, name in enumerate(names):
+                    # Mesma ordem de rank_row: IEP arredondado, desempate estável pela ordem do painel
+                    order = np.argsort(-rounded[k, row, eligible], kind='stable')[:top_n]
+                    formatted_bulls = []
+                    for rank, col in enumerate(eligible[order], 1):
+                        bull_data = bulls_data[cols[col]]
+                        formatted_bulls.append({
+                            'rank': rank,
+                            'bull': {'id': bull_data.get('id'), 'code': bull_data.get('code'), 'name': bull_data.get('name')},
+                            'score': round(float(iep[k, row, col]), 1),
+                            'grade': self.calculator._grade_iep(iep[k, row, col]),
+                            'inbreeding': float(category_scores.expected_inbreeding[row, col])
+                        })
+                    top_by_profile[name][start + row] = formatted_bulls
+        
+        results = []
+        for row, female in enumerate(females):
+            top_sets = [{bull['bull']['code'] for bull in top_by_profile[name][row]} for name in names]
+            top_ones = {top_by_profile[name][row][0]['bull']['code'] if top_by_profile[name][row] else None for name in names}
+            consensus = set.intersection(*top_sets)
+            results.append({
+                'female': {'id': female.id, 'reg_id': female.reg_id, 'internal_id': female.internal_id, 'name': female.name},
+                'profiles': {name: top_by_profile[name][row] for name in names},
+                'overlap': {
+                    'consensus_bulls': [bull['bull']['code'] for bull in top_by_profile[names[0]][row]
+                                        if bull['bull']['code'] in consensus],
+                    'top1_agreement': len(top_ones) == 1
+                }
+            })
+        
+        return {
+            'summary': self._profile_summary(names, top_by_profile, results, len(rows), top_n, max_inbreeding),
+            'results': results
+        }
+    
+    def _profile_summary(self, names: List[str], top_by_profile: Dict[str, List[List[Dict]]], results: List[Dict],
+                         total_bulls: int, top_n: int, max_inbreeding: float) -> Dict:
+        """Médias por perfil e sobreposição (Jaccard do top N e concordância do 1º) entre perfis"""
+        n_females = len(results)
+        per_profile = {}
+        for name in names:
+            scores = [bull['score'] for tops in top_by_profile[name] for bull in tops]
+            per_profile[name] = {
+                'average_iep': round(sum(scores) / len(scores), 1) if scores else 0,
+                'unique_bulls_recommended': len({bull['bull']['code'] for tops in top_by_profile[name] for bull in tops})
+            }
         
-        if filters:
-            bulls_query = self._apply_bull_filters(bulls_query, filters)
+        pairwise = []
+        for a in range(len(names)):
+            for b in range(a + 1, len(names)):
+                jaccard, agree = [], 0
+                for tops_a, tops_b in zip(top_by_profile[names[a]], top_by_profile[names[b]]):
+                    set_a = {bull['bull']['code'] for bull in tops_a}
+                    set_b = {bull['bull']['code'] for bull in tops_b}
+                    union = set_a | set_b
+                    jaccard.append(len(set_a & set_b) / len(union) if union else 1.0)
+                    first_a = tops_a[0]['bull']['code'] if tops_a else None
+                    first_b = tops_b[0]['bull']['code'] if tops_b else None
+                    agree += first_a == first_b
+                pairwise.append({
+                    'profiles': [names[a], names[b]],
+                    'mean_jaccard': round(sum(jaccard) / n_females, 3) if n_females else 1.0,
+                    'top1_agreement': round(agree / n_females, 3) if n_females else 1.0
+                })
         
-        bulls = bulls_query.all()
+        return {
+            'total_females': n_females, 'total_bulls_analyzed': total_bulls,
+            'top_n': top_n, 'max_inbreeding': max_inbreeding,
+            'profiles': per_profile,
+            'overlap': {
+                'pairwise': pairwise,
+                'top1_agreement': round(sum(r['overlap']['top1_agreement'] for r in results) / n_females, 3) if n_females else 1.0,
+                'average_consensus_bulls': round(sum(len(r['overlap']['consensus_bulls']) for r in results) / n_females, 2) if n_females else 0
+            }
+        }
+    
+    def _category_components(self, panel, bull_matrix, females: List[Female], females_data: List[Dict],
+                             filters: Optional[Dict], max_inbreeding: float, params_hash: str,
+                             candidates: Optional[np.ndarray] = None, top_n: Optional[int] = None,
+                             workers: int = 1) -> List:
+        """Scores por categoria (compactos) do lote em blocos: [(início, colunas, ScoreMatrices)]"""
+        components_key = ('match_batch', tuple((female.id, female.last_updated) for female in females),
+                          fingerprint(filters), max_inbreeding, params_hash,
+                          getattr(self.calculator.pedigree, 'revision', None),
+                          top_n if candidates is not None else None)
+        components = panel.cached_scores(components_key)
+        if components is None:
+            female_matrix = self.engine.build_matrix(females_data)
+            # Pré-filtro vetorizado (consanguinidade esperada + haplótipos letais): cada bloco de
+            # fêmeas só calcula o IEP dos touros elegíveis para pelo menos uma delas
+            # Pool reaproveitado enquanto painel, filtros, parâmetros e pedigree forem os mesmos
+            pool_key = (panel.version, fingerprint(filters), params_hash,
+                        getattr(self.calculator.pedigree, 'revision', None))
+            components = score_components(self.engine, female_matrix, bull_matrix, max_inbreeding,
+                                          candidates=candidates, workers=workers, key=pool_key)
+            panel.store_scores(components_key, components)
+        return components
+    
+    def _pair_values(self, female_ids: List[int], priorities: Optional[Dict], max_inbreeding: float,
+                     max_uses_per_bull: Optional[int], filters: Optional[Dict]):
+        """
+        Base dos planos do lote: fêmeas, linhas do painel, IEP (F, B) arredondado dos pares
+        permitidos (NaN = consanguinidade acima do limite ou letal), consanguinidade esperada
+        e capacidade de cada touro (doses em estoque, nulo = sem limite, e limite de uso)
+        """
+        females = self.session.query(Female).filter(Female.id.in_(female_ids)).order_by(Female.id).all()
+        if not females:
+            raise ValueError("Nenhuma fêmea encontrada")
         
-        if not bulls:
+        panel = get_bull_panel(self.session, self.engine)
+        rows = np.flatnonzero(panel.filter_mask(filters))
+        if len(rows) == 0:
             raise ValueError("Nenhum touro disponível")
         
-        bulls_data = [self._prepare_bull_data(bull) for bull in bulls]
+        bull_matrix, bulls_data = panel.select(rows)
+        females_data = [self.calculator.cached_record(female, self._prepare_female_data) for female in females]
+        components = self._category_components(panel, bull_matrix, females, females_data, filters, max_inbreeding,
+                                               self.calculator.params_fingerprint())
         
-        for female in females:
-            female_data = self._prepare_female_data(female)
+        iep = np.full((len(females), len(rows)), np.nan)
+        inbreeding = np.full((len(females), len(rows)), np.nan)
+        for start, cols, category_scores in components:
+            scores = self.engine.reweight(category_scores, priorities)
+            allowed = (scores.expected_inbreeding <= max_inbreeding) & ~scores.critical_haplotypes
+            block = iep[start:start + scores.shape[0]]
+            block[:, cols] = np.where(allowed, py_round(scores.iep_normalized, 1), np.nan)
+            inbreeding[start:start + scores.shape[0], cols] = scores.expected_inbreeding
+        
+        doses = panel.columns['doses_available'][rows]
+        capacity = np.where(np.isnan(doses), len(females), np.nan_to_num(doses)).astype(np.int64)
+        if max_uses_per_bull is not None:
+            capacity = np.minimum(capacity, int(max_uses_per_bull))
+        
+        return females, females_data, panel, rows, bull_matrix, bulls_data, iep, inbreeding, capacity
+    
+    def _plan_result(self, females: List[Female], panel, rows: np.ndarray, bulls_data: List, iep: np.ndarray,
+                     inbreeding: np.ndarray, capacity: np.ndarray, assignment: np.ndarray) -> Dict:
+        """Atribuições, uso por touro e totais de um plano (touro de cada fêmea ou -1)"""
+        prices = panel.columns['price_per_dose'][rows]
+        assignments = []
+        for row, (female, col) in enumerate(zip(females, assignment)):
+            entry = {'female': {'id': female.id, 'reg_id': female.reg_id, 'internal_id': female.internal_id, 'name': female.name},
+                     'bull': None}
+            if col >= 0:
+                bull_data = bulls_data[col]
+                entry.update({
+                    'bull': {'id': bull_data.get('id'), 'code': bull_data.get('code'), 'name': bull_data.get('name'), 'source': bull_data.get('source')},
+                    'score': float(iep[row, col]),
+                    'grade': self.calculator._grade_iep(float(iep[row, col])),
+                    'expected_inbreeding': round(float(inbreeding[row, col]), 2)
+                })
+            assignments.append(entry)
+        
+        used = np.bincount(assignment[assignment >= 0], minlength=len(rows))
+        bull_usage = []
+        for col in np.argsort(-used, kind='stable')[:np.count_nonzero(used)]:
+            price = None if np.isnan(prices[col]) else float(prices[col])
+            bull_usage.append({
+                'bull': {'id': int(panel.ids[rows[col]]), 'code': panel.codes[rows[col]], 'name': panel.names[rows[col]]},
+                'females': int(used[col]),
+                'capacity': int(capacity[col]) if capacity[col] < len(females) else None,
+                'price_per_dose': price,
+                'cost': round(price * int(used[col]), 2) if price is not None else None
+            })
+        
+        assigned = np.flatnonzero(assignment >= 0)
+        scores = iep[assigned, assignment[assigned]]
+        costs = [usage['cost'] for usage in bull_usage if usage['cost'] is not None]
+        return {
+            'summary': {
+                'total_females': len(females), 'assigned_females': len(assigned),
+                'unassigned_females': len(females) - len(assigned),
+                'total_bulls_analyzed': len(rows), 'bulls_used': len(bull_usage),
+                'total_iep': round(float(scores.sum()), 1),
+                'average_iep': round(float(scores.mean()), 1) if len(scores) else 0,
+                'average_inbreeding': round(float(inbreeding[assigned, assignment[assigned]].mean()), 2) if len(assigned) else 0,
+                'total_cost': round(sum(costs), 2) if costs else None
+            },
+            'bull_usage': bull_usage,
+            'assignments': assignments
+        }
+    
+    def allocate_batch(self, female_ids: List[int], priorities: Optional[Dict] = None,
+                       max_inbreeding: float = 6.0, max_uses_per_bull: Optional[int] = None,
+                       filters: Optional[Dict] = None) -> Dict:
+        """
+        Plano de acasalamento do lote: um touro por fêmea maximizando o IEP total,
+        respeitando doses em estoque, limite de uso por touro, consanguinidade e letais
+        """
+        females, _, panel, rows, _, bulls_data, iep, inbreeding, capacity = self._pair_values(
+            female_ids, priorities, max_inbreeding, max_uses_per_bull, filters)
+        
+        # Valores inteiros (IEP × 10) para o fluxo de custo mínimo
+        assignment, steps = solve_allocation(np.rint(iep * VALUE_SCALE), capacity)
+        
+        result = self._plan_result(females, panel, rows, bulls_data, iep, inbreeding, capacity, assignment)
+        result['summary'].update({
+            'max_inbreeding': max_inbreeding, 'max_uses_per_bull': max_uses_per_bull,
+            'priorities_used': priorities or 'default', 'solver_steps': steps
+        })
+        return result
+    
+    def plan_matings(self, female_ids: List[int], priorities: Optional[Dict] = None, max_inbreeding: float = 6.0,
+                     coancestry_weight: float = 1.0, max_uses_per_bull: Optional[int] = None,
+                     filters: Optional[Dict] = None, restarts: int = 4, workers: int = 1, seed: int = 0) -> Dict:
+        """
+        Plano do lote com controle da coancestria média da próxima safra (contribuição ótima):
+        maximiza IEP total − coancestry_weight × N × coancestria média (%)
+        """
+        females, females_data, panel, rows, bull_matrix, bulls_data, iep, inbreeding, capacity = self._pair_values(
+            female_ids, priorities, max_inbreeding, max_uses_per_bull, filters)
+        
+        # Coancestria fêmea × touro = consanguinidade esperada de todos os pares (inclusive proibidos)
+        female_matrix = self.engine.build_matrix(females_data)
+        dam_coancestry = expected_inbreeding(female_matrix, bull_matrix, self.calculator.pedigree)[0].sum(axis=0) / 100
+        problem = PlanProblem(
+            merit=np.where(np.isnan(iep), -np.inf, iep),
+            coancestry=bull_coancestry(bull_matrix, self.calculator.pedigree),
+            dam_coancestry=dam_coancestry, capacity=capacity, weight=float(coancestry_weight)
+        )
+        
+        # Primeira partida: alocação de IEP máximo (ótima com coancestry_weight = 0)
+        start, _ = solve_allocation(np.rint(iep * VALUE_SCALE), capacity)
+        assignment, runs = optimize_plan(problem, start, restarts=restarts, workers=workers, seed=seed)
+        
+        result = self._plan_result(females, panel, rows, bulls_data, iep, inbreeding, capacity, assignment)
+        result['summary'].update({
+            'max_inbreeding': max_inbreeding, 'max_uses_per_bull': max_uses_per_bull,
+            'priorities_used': priorities or 'default', 'coancestry_weight': coancestry_weight,
+            'mean_coancestry': round(problem.mean_coancestry(assignment), 3),
+            'max_merit_mean_coancestry': round(problem.mean_coancestry(start), 3),
+            'objective': round(problem.objective(assignment), 2),
+            'restarts': [{'objective': round(objective, 2), 'passes': passes, 'moves': moves}
+                         for objective, passes, moves in runs]
+        })
+        return result
+    
+    def bull_index_values(self, formula: str):
+        """(painel, fórmula compilada, índice (B,) de cada touro do painel pelos próprios valores)"""
+        index = compile_formula(formula)
+        panel = get_bull_panel(self.session, self.engine)
+        return panel, index, catalog_index(index, panel.catalog, self.calculator.population_stats)
+    
+    def score_matrix(self) -> ScoreMatrixStore:
+        """Matriz materializada fêmea × touro (parâmetros padrão)"""
+        return ScoreMatrixStore(self.session, self.engine, self._prepare_female_data)
+    
+    def recommend_for_female(self, female_id: int, top_n: int = 10, max_inbreeding: float = 8.0,
+                             available_only: bool = True, formula: Optional[str] = None,
+                             diversity: Optional[Dict] = None) -> Dict:
+        """
+        Melhores touros de uma fêmea lidos da matriz materializada (atualizada se preciso).
+        Com `formula`, ordena pelo índice personalizado do par (IEP/consanguinidade da matriz).
+        Com `diversity`, limita touros por pai/MGS e penaliza a coancestria entre os recomendados.
+        """
+        index = compile_formula(formula) if formula else None
+        rule = DiversityRule.parse(diversity)
+        female = self.session.query(Female).get(female_id)
+        if not female:
+            raise ValueError(f"Fêmea {female_id} não encontrada")
+        
+        panel = get_bull_panel(self.session, self.engine)
+        rows = np.flatnonzero(panel.filter_mask(available_only=available_only))
+        store = self.score_matrix()
+        materialized = store.read([female], panel.ids[rows])
+        if materialized is None:
+            store.refresh()
+            materialized = store.read([female], panel.ids[rows])
+        if materialized is None:
+            raise ValueError("Matriz de scores indisponível")
+        
+        iep = materialized.iep[0].astype(float)
+        inbreeding = materialized.inbreeding[0].astype(float)
+        allowed = (inbreeding <= max_inbreeding + 1e-6) & ~materialized.lethal[0]
+        values = iep
+        if index is not None:
+            female_data = self.calculator.cached_record(female, self._prepare_female_data)
+            values = pair_index(index, build_trait_matrix(self.calculator, [female_data], index.traits),
+                                panel.catalog.take(rows), self.calculator.population_stats,
+                                inbreeding[None, :], iep[None, :])[0]
+            allowed &= ~np.isnan(values)
+        eligible = np.flatnonzero(allowed)
+        if rule is None:
+            order = eligible[np.argsort(-values[eligible], kind='stable')[:max(top_n, 0)]]
+        else:
+            lineage = panel.lineage().take(rows)
+            order = eligible[np.argsort(-values[eligible], kind='stable')]
+            coancestry = None
+            if rule.coancestry_penalty > 0:
+                coancestry = self._pool_coancestry(panel.matrix.take(rows), [order], top_n)
+            order = diverse_top(order, values, lineage, rule, top_n, coancestry)
+        
+        recommendations = []
+        for rank, col in enumerate(order, 1):
+            row = rows[col]
+            item = {
+                'rank': rank,
+                'bull': {'id': int(panel.ids[row]), 'code': panel.codes[row], 'name': panel.names[row], 'source': panel.sources[row]},
+                'score': round(float(iep[col]), 1),
+                'grade': self.calculator._grade_iep(float(iep[col])),
+                'expected_inbreeding': round(float(inbreeding[col]), 2)
+            }
+            if index is not None:
+                item['index_value'] = round(float(values[col]), 3)
+            if rule is not None:
+                item['lineage'] = lineage.lineage(col)
+            recommendations.append(item)
+        
+        return {
+            'female': {'id': female.id, 'reg_id': female.reg_id, 'internal_id': female.internal_id, 'name': female.name},
+            'total_bulls_analyzed': len(rows), 'eligible_bulls': len(eligible),
+            'recommendations': recommendations
+        }
+    
+    def best_females_for_bull(self, bull_code: str, page: int = 1, per_page: int = 20, top_n: int = 100,
+                              max_inbreeding: float = 6.0, priorities: Optional[Dict] = None,
+                              formula: Optional[str] = None) -> Dict:
+        """
+        Ranking reverso: as melhores fêmeas ativas do rebanho para um touro (ex.: lote de sêmen
+        recebido). O rebanho inteiro é pontuado contra o touro numa passada vetorizada (painel
+        do rebanho em cache), com os filtros de consanguinidade e haplótipos letais de rank_row.
+        Retorna a página `page` do top N.
+        """
+        if page < 1 or per_page < 1:
+            raise ValueError("page e per_page devem ser positivos")
+        index = compile_formula(formula) if formula else None
+        
+        panel = get_bull_panel(self.session, self.engine)
+        matches = np.flatnonzero(panel.codes == bull_code)
+        if not len(matches):
+            raise ValueError(f"Touro {bull_code} não encontrado")
+        bull_row = matches[:1]
+        
+        herd = get_herd_panel(self.session, self.engine, self._prepare_female_data)
+        rows = np.flatnonzero(herd.active)
+        scores = self.engine.score(herd.matrix.take(rows), panel.matrix.take(bull_row), priorities)
+        
+        allowed = (scores.expected_inbreeding[:, 0] <= max_inbreeding) & ~scores.critical_haplotypes[:, 0]
+        values = py_round(scores.iep_normalized[:, 0], 1)
+        if index is not None:
+            values = pair_index(index, herd.catalog.take(rows), panel.catalog.take(bull_row),
+                                self.calculator.population_stats, scores.expected_inbreeding,
+                                scores.iep_normalized)[:, 0]
+            allowed &= ~np.isnan(values)
+        eligible = np.flatnonzero(allowed)
+        # Mesma ordem de rank_row (valor decrescente, empate pela ordem do rebanho)
+        ranked = eligible[np.argsort(-values[eligible], kind='stable')[:max(top_n, 0)]]
+        
+        females = []
+        for rank, row in enumerate(ranked[(page - 1) * per_page:page * per_page], (page - 1) * per_page + 1):
+            item = {
+                'rank': rank,
+                'female': herd.female_item(rows[row]),
+                'score': round(float(scores.iep_normalized[row, 0]), 1),
+                'grade': self.calculator._grade_iep(scores.iep_normalized[row, 0]),
+                'inbreeding': {'expected_inbreeding': float(scores.expected_inbreeding[row, 0]),
+                               'risk_level': INBREEDING_RISKS[scores.inbreeding_risk[row, 0]]},
+                'reliability': float(scores.reliability[row, 0]),
+                'categories': scores.category_dict(row, 0)
+            }
+            if index is not None:
+                item['index_value'] = round(float(values[row]), 3)
+            females.append(item)
+        
+        doses = panel.columns['doses_available'][bull_row[0]]
+        result = {
+            'bull': {'id': int(panel.ids[bull_row[0]]), 'code': panel.codes[bull_row[0]],
+                     'name': panel.names[bull_row[0]], 'source': panel.sources[bull_row[0]],
+                     'doses_available': None if np.isnan(doses) else int(doses)},
+            'total_females': len(rows), 'eligible_females': len(eligible),
+            'total': len(ranked), 'page': page, 'per_page': per_page,
+            'total_pages': (len(ranked) + per_page - 1) // per_page,
+            'females': females
+        }
+        if index is not None:
+            result['index_formula'] = index.expression
+        return result
+    
+    def similar_bulls(self, bull_code: str, k: int = 10, filters: Optional[Dict] = None,
+                      available_only: bool = True, in_stock: bool = False) -> Dict:
+        """
+        Touros mais parecidos com `bull_code` (k vizinhos pelos z-scores das características),
+        entre os que passam nos filtros do painel (beta_casein, source, max_gfi...). Com
+        `in_stock`, touros com doses_available = 0 ficam de fora (nulo = estoque desconhecido).
+        """
+        panel = get_bull_panel(self.session, self.engine)
+        matches = np.flatnonzero(panel.codes == bull_code)
+        if not len(matches):
+            raise ValueError(f"Touro {bull_code} não encontrado")
+        row = int(matches[0])
+        
+        index = get_similarity_index(panel, self.calculator.population_stats)
+        mask = panel.filter_mask(filters, available_only=available_only)
+        if in_stock:
+            mask &= ~(panel.columns['doses_available'] <= 0)
+        neighbors, distances, dims = index.neighbors(row, k, np.flatnonzero(mask))
+        
+        similar = []
+        for rank, (other, distance) in enumerate(zip(neighbors, distances), 1):
+            doses = panel.columns['doses_available'][other]
+            similar.append({
+                'rank': rank,
+                'bull': panel.summaries[other],
+                'distance': round(float(distance), 3),
+                'shared_traits': int(index.present[other, dims].sum()),
+                'largest_differences': index.differences(row, other, dims),
+                'in_stock': None if np.isnan(doses) else bool(doses > 0)
+            })
+        
+        return {
+            'bull': panel.summaries[row],
+            'traits_compared': [index.traits[d] for d in dims],
+            'candidates': int(np.count_nonzero(mask) - mask[row]),
+            'similar': similar
+        }
+    
+    def pareto_bulls(self, female_ids: List[int], objectives: Optional[List] = None, max_inbreeding: float = 6.0,
+                     bull_codes: Optional[List[str]] = None, filters: Optional[Dict] = None,
+                     priorities: Optional[Dict] = None) -> Dict:
+        """
+        Fronteira de Pareto dos touros para cada fêmea: touros não dominados nos objetivos
+        escolhidos (PPPV de características, 'inbreeding' esperada e/ou 'iep'), entre os pares
+        permitidos (consanguinidade e haplótipos letais). `bull_codes` restringe a uma lista curta.
+        """
+        objectives = self._pareto_objectives(objectives)
+        females = self.session.query(Female).filter(Female.id.in_(female_ids)).order_by(Female.id).all()
+        if not females:
+            raise ValueError("Nenhuma fêmea encontrada")
+        
+        panel = get_bull_panel(self.session, self.engine)
+        mask = panel.filter_mask(filters)
+        if bull_codes:
+            mask &= np.isin(panel.codes, list(bull_codes))
+        rows = np.flatnonzero(mask)
+        if len(rows) == 0:
+            raise ValueError("Nenhum touro disponível")
+        
+        # Mesmos dados de calculate_pppv/calculate_inbreeding, para todos os pares de uma vez
+        females_data = [self.calculator.cached_record(female, self._prepare_female_data) for female in females]
+        scores = self.engine.score(self.engine.build_matrix(females_data), panel.matrix.take(rows), priorities)
+        traits = [name for name, _ in objectives if name in TRAITS]
+        if traits:
+            pppv, present = pair_pppv(build_trait_matrix(self.calculator, females_data, traits),
+                                      panel.catalog.take(rows).select_traits(traits))
+            pppv = np.where(present, pppv, np.nan)
+        
+        def column(name: str, row: int, cols: np.ndarray) -> np.ndarray:
+            if name == 'inbreeding':
+                return scores.expected_inbreeding[row, cols]
+            if name == 'iep':
+                return py_round(scores.iep_normalized[row, cols], 1)
+            return pppv[row, cols, traits.index(name)]
+        
+        results = []
+        for row, female in enumerate(females):
+            eligible = np.flatnonzero((scores.expected_inbreeding[row] <= max_inbreeding) & ~scores.critical_haplotypes[row])
+            values = np.column_stack([column(name, row, eligible) for name, _ in objectives]) if len(eligible) else np.empty((0, len(objectives)))
+            signs = np.array([1.0 if direction == 'max' else -1.0 for _, direction in objectives])
+            oriented = np.where(np.isnan(values), -np.inf, values * signs)
+            front, _ = pareto_front(oriented)
             
-            top_bulls = self.calculator.rank_bulls_for_female(
-                female_data=female_data, bulls=bulls_data,
-                top_n=top_n, max_inbreeding=max_inbreeding, custom_weights=priorities
-            )
+            # Melhor primeiro no 1º objetivo (depois no IEP); quantos pares cada touro domina
+            front = front[np.lexsort((-scores.iep_normalized[row, eligible[front]], -oriented[front, 0]))]
+            better = oriented[front][:, None, :]
+            dominated = (np.all(better >= oriented[None], axis=2) & np.any(better > oriented[None], axis=2)).sum(axis=1)
             
-            formatted_bulls = []
-            for item in top_bulls:
-                formatted_bulls.append({
-                    'rank': item['rank'], 'bull': item['bull'],
-                    'score': item['iep'], 'grade': item['grade'],
-                    'inbreeding': {'expected_inbreeding': item['inbreeding'], 'risk_level': item['inbreeding_risk']},
-                    'reliability': item['reliability'], 'categories': item['categories']
+            frontier = []
+            for k, point in enumerate(front):
+                col = eligible[point]
+                bull_data = panel.records[rows[col]]
+                iep = scores.iep_normalized[row, col]
+                frontier.append({
+                    'bull': {'id': bull_data.get('id'), 'code': bull_data.get('code'), 'name': bull_data.get('name'), 'source': bull_data.get('source')},
+                    'objectives': {name: None if np.isnan(values[point, m]) else round(float(values[point, m]), 2)
+                                   for m, (name, _) in enumerate(objectives)},
+                    'score': round(float(iep), 1),
+                    'grade': self.calculator._grade_iep(iep),
+                    'dominates': int(dominated[k])
                 })
             
             results.append({
-                'female': {
-                    'id': female.id, 'reg_id': female.reg_id,
-                    'internal_id': female.internal_id, 'name': female.name,
-                    'main_indices': self._get_main_indices(female_data)
-                },
-                'top_bulls': formatted_bulls
+                'female': {'id': female.id, 'reg_id': female.reg_id, 'internal_id': female.internal_id, 'name': female.name},
+                'eligible_bulls': len(eligible),
+                'frontier_size': len(frontier),
+                'frontier': frontier
             })
         
-        all_scores = []
-        all_inbreeding = []
-        bulls_used = set()
+        return {
+            'objectives': [{'name': name, 'direction': direction} for name, direction in objectives],
+            'max_inbreeding': max_inbreeding,
+            'total_bulls_analyzed': len(rows),
+            'results': results
+        }
+    
+    def _pareto_objectives(self, objectives: Optional[List]) -> List:
+        """
+        [(nome, 'max'|'min')] a partir de nomes ou {'name', 'direction'}; sem direção, índices
+        negativos e 'inbreeding' são minimizados e os demais maximizados
+        """
+        parsed = []
+        for objective in objectives or DEFAULT_OBJECTIVES:
+            name, direction = (objective.get('name'), objective.get('direction')) if isinstance(objective, dict) else (objective, None)
+            if name not in TRAITS and name not in ('inbreeding', 'iep'):
+                raise ValueError(f"Objetivo desconhecido: {name}")
+            if direction is None:
+                direction = 'min' if name == 'inbreeding' or name in self.calculator.params.negative_indices else 'max'
+            if direction not in ('max', 'min'):
+                raise ValueError(f"Direção inválida para {name}: use 'max' ou 'min'")
+            parsed.append((name, direction))
+        
+        if len({name for name, _ in parsed}) != len(parsed):
+            raise ValueError("Objetivos repetidos")
+        if not 1 <= len(parsed) <= MAX_OBJECTIVES:
+            raise ValueError(f"Informe de 1 a {MAX_OBJECTIVES} objetivos")
+        return parsed
+    
+    def simulate_offspring(self, female_ids: List[int], bull_codes: List[str], traits: Optional[List[str]] = None,
+                           conditions: Optional[List[Dict]] = None, quantiles: Optional[List[float]] = None,
+                           draws: int = 10000, seed: Optional[int] = None) -> Dict:
+        """Simulação Monte Carlo da progênie de cada fêmea × touro (probabilidades e quantis)"""
+        conditions = [Condition.parse(cond) for cond in conditions or []]
+        traits = list(dict.fromkeys(list(traits or ['net_merit', 'milk', 'productive_life']) + [c.trait for c in conditions]))
+        unknown = [trait for trait in traits if trait not in TRAIT_POSITIONS]
+        if unknown:
+            raise ValueError(f"Características desconhecidas: {', '.join(map(str, unknown))}")
         
-        for result in results:
-            for bull in result['top_bulls']:
-                all_scores.append(bull['score'])
-                all_inbreeding.append(bull['inbreeding']['expected_inbreeding'])
-                bulls_used.add(bull['bull']['code'])
+        females = self.session.query(Female).filter(Female.id.in_(female_ids)).all()
+        if not females:
+            raise ValueError("Nenhuma fêmea encontrada")
+        
+        panel = get_bull_panel(self.session, self.engine)
+        positions = {code: row for row, code in enumerate(panel.codes)}
+        rows = np.array([positions[code] for code in dict.fromkeys(bull_codes) if code in positions], dtype=np.int64)
+        if len(rows) == 0:
+            raise ValueError("Nenhum touro encontrado")
+        
+        _, bulls_data = panel.select(rows)
+        females_data = [self.calculator.cached_record(female, self._prepare_female_data) for female in females]
+        female_matrix = build_trait_matrix(self.calculator, females_data, traits)
+        bull_matrix = build_trait_matrix(self.calculator, bulls_data, traits, is_bull=True)
+        
+        simulation = OffspringSimulator(self.calculator).simulate(
+            female_matrix, bull_matrix, conditions,
+            DEFAULT_QUANTILES if quantiles is None else quantiles, draws, seed
+        )
+        
+        results = []
+        for row, female in enumerate(females):
+            for col, bull_data in enumerate(bulls_data):
+                result = {
+                    'female': {'id': female.id, 'reg_id': female.reg_id, 'internal_id': female.internal_id},
+                    'bull': {'id': bull_data.get('id'), 'code': bull_data.get('code'), 'name': bull_data.get('name')}
+                }
+                result.update(simulation.pair_dict(row, col))
+                results.append(result)
         
         return {
             'summary': {
-                'total_females': len(females), 'total_bulls_analyzed': len(bulls),
-                'top_n': top_n, 'max_inbreeding': max_inbreeding,
-                'priorities_used': priorities or 'default',
-                'average_iep': round(sum(all_scores) / len(all_scores), 1) if all_scores else 0,
-                'average_inbreeding': round(sum(all_inbreeding) / len(all_inbreeding), 2) if all_inbreeding else 0,
-                'unique_bulls_recommended': len(bulls_used)
+                'total_females': len(females), 'total_bulls': len(rows), 'total_matings': len(results),
+                'traits': traits, 'conditions': [cond.label for cond in conditions],
+                'quantiles': list(simulation.quantile_levels), 'draws': draws, 'seed': seed
             },
             'results': results
         }
@@ -132,7 +997,7 @@ class MatchingService:
             if value:
                 data[field] = value
         
-        for field in ['hh1', 'hh2', 'hh3', 'hh4', 'hh5', 'hh6']:
+        for field in LETHAL_HAPLOTYPES:
             value = getattr(female, field, None)
             if value is not None:
                 data[field] = value
@@ -141,37 +1006,7 @@ class MatchingService:
     
     def _prepare_bull_data(self, bull: Bull) -> Dict:
         """Prepara dados do touro"""
-        data = {
-            'id': bull.id, 'code': bull.code, 'name': bull.name,
-            'source': bull.source, 'naab_code': bull.naab_code,
-            'genetic_data': bull.genetic_data or {}
-        }
-        
-        indices = ['milk', 'protein', 'fat', 'net_merit', 'cheese_merit', 'grazing_merit',
-                   'tpi', 'gtpi', 'udc', 'flc', 'ptat', 'productive_life', 'scs', 'dpr',
-                   'fertility_index', 'rfi', 'feed_saved', 'beta_casein', 'kappa_casein', 'gfi',
-                   'hcr', 'ccr', 'cow_livability', 'heifer_livability', 'sire_calving_ease',
-                   'daughter_calving_ease', 'sire_stillbirth', 'daughter_stillbirth',
-                   'milk_rel', 'dpr_rel', 'productive_life_rel', 'num_daughters']
-        
-        for index in indices:
-            value = getattr(bull, index, None)
-            if value is not None:
-                data[index] = value
-        
-        # Reliabilities
-        reliabilities = getattr(bull, 'reliabilities', None)
-        if reliabilities:
-            data['reliabilities'] = reliabilities
-        
-        # Haplótipos
-        haplotypes = bull.haplotypes or {}
-        if isinstance(haplotypes, dict):
-            data['haplotypes'] = haplotypes
-            for hap, status in haplotypes.items():
-                data[hap.lower()] = status
-        
-        return data
+        return prepare_bull_data(bull)
     
     def _get_main_indices(self, data: Dict) -> Dict:
         indices = {}
@@ -185,28 +1020,14 @@ class MatchingService:
         
         return indices
     
-    def _apply_bull_filters(self, query, filters: Dict):
-        if 'min_milk' in filters and filters['min_milk']:
-            query = query.filter(Bull.milk >= filters['min_milk'])
-        if 'min_net_merit' in filters and filters['min_net_merit']:
-            query = query.filter(Bull.net_merit >= filters['min_net_merit'])
-        if 'min_productive_life' in filters and filters['min_productive_life']:
-            query = query.filter(Bull.productive_life >= filters['min_productive_life'])
-        if 'beta_casein' in filters and filters['beta_casein']:
-            query = query.filter(Bull.beta_casein == filters['beta_casein'])
-        if 'max_gfi' in filters and filters['max_gfi']:
-            query = query.filter(Bull.gfi <= filters['max_gfi'])
-        if 'source' in filters and filters['source']:
-            query = query.filter(Bull.source == filters['source'])
-        return query
-    
-    def _generate_recommendation(self, compatibility: Dict, inbreeding: Dict) -> Dict:
+    def _generate_recommendation(self, compatibility: Dict, inbreeding: Dict, detail: str = 'full') -> Dict:
         score = compatibility['score']
         inb = inbreeding['expected_inbreeding']
         haplotype_risks = inbreeding.get('haplotype_risks', [])
         critical_risks = [r for r in haplotype_risks if r.get('severity') == 'critical']
+        critical = bool(critical_risks) or inbreeding.get('critical_haplotype', False)
         
-        if critical_risks:
+        if critical:
             status, message, color = 'not_recommended', '❌ Acasalamento NÃO recomendado - Risco letal', 'red'
         elif score >= 75 and inb <= 6.0:
             status, message, color = 'highly_recommended', '✅ Altamente recomendado!', 'green'
@@ -217,13 +1038,17 @@ class MatchingService:
         else:
             status, message, color = 'not_recommended', '❌ Não recomendado', 'red'
         
+        if detail == 'summary':
+            return {'status': status, 'color': color, 'grade': compatibility['grade'],
+                    'confidence': compatibility.get('reliability', 60)}
+        
         positives, negatives = [], []
         
         if score >= 70:
             positives.append('Excelente compatibilidade genética')
         if inb <= 6.25:
             positives.append(f'Consanguinidade ideal ({inb:.1f}%)')
-        if not haplotype_risks:
+        if 'haplotype_risks' in inbreeding and not haplotype_risks:
             positives.append('Sem riscos de haplótipos')
         
         if score < 50:
@@ -232,6 +1057,8 @@ class MatchingService:
             negatives.append(f'Consanguinidade acima do ideal ({inb:.1f}%)')
         for risk in critical_risks:
             negatives.append(f"Risco crítico: {risk['haplotype']}")
+        if critical and not critical_risks:
+            negatives.append('Risco crítico: haplótipo letal em comum')
         
         return {
             'status': status, 'message': message, 'color': color,
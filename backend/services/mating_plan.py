@@ -0,0 +1,189 @@
+"""
+Plano de Acasalamento com Controle de Coancestria
+
+Otimiza o conjunto de acasalamentos do rebanho (contribuição ótima):
+
+    objetivo = Σ IEP dos pares − λ · 100 · N · coancestria média da próxima safra
+
+A coancestria entre os bezerros i e j é ¼[f(mãe_i, mãe_j) + f(mãe_i, pai_j) +
+f(pai_i, mãe_j) + f(pai_i, pai_j)]. O termo mãe × mãe não depende do plano, e os
+demais dependem só do uso de cada touro (u):
+
+    coancestria média = (2 Σ_b u_b s_b + uᵀ C u) / 4N²  (+ termo fixo das mães)
+
+com C = coancestria touro × touro (pedigree: pais/avô materno em comum) e
+s_b = Σ das coancestrias fêmea × touro (consanguinidade esperada de
+calculate_inbreeding). Assim cada movimento tem delta O(1) por touro candidato.
+
+Busca: construção gulosa (ou a alocação de IEP máximo) + busca local com
+realocação de uma fêmea e troca de touros entre duas fêmeas, repetida a partir
+de várias ordens aleatórias em paralelo (pool de processos); vence o melhor plano.
+"""
+
+from typing import List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import numpy as np
+
+
+# Ganho mínimo para aceitar um movimento
+MOVE_TOLERANCE = 1e-9
+
+# Passadas completas da busca local (realocação + troca)
+MAX_PASSES = 50
+
+
+@dataclass
+class PlanProblem:
+    """Dados do plano: F fêmeas × B touros"""
+
+    merit: np.ndarray  # (F, B) IEP do par; -inf = par proibido
+    coancestry: np.ndarray  # (B, B) coancestria touro × touro (fração)
+    dam_coancestry: np.ndarray  # (B,) soma das coancestrias fêmea × touro (fração)
+    capacity: np.ndarray  # (B,) usos permitidos por touro
+    weight: float  # λ: pontos de IEP por ponto percentual de coancestria média
+
+    @property
+    def scale(self) -> float:
+        """Penalidade por unidade de (2 Σ u s + uᵀ C u)"""
+        n = max(len(self.merit), 1)
+        return self.weight * 100.0 / (4.0 * n)
+
+    def mean_coancestry(self, assignment: np.ndarray) -> float:
+        """Coancestria média da safra em % (sem o termo fixo mãe × mãe)"""
+        usage = np.bincount(assignment[assignment >= 0], minlength=len(self.capacity)).astype(float)
+        n = max(len(self.merit), 1)
+        return 100.0 * (2 * usage @ self.dam_coancestry + usage @ self.coancestry @ usage) / (4.0 * n * n)
+
+    def objective(self, assignment: np.ndarray) -> float:
+        assigned = np.flatnonzero(assignment >= 0)
+        merit = self.merit[assigned, assignment[assigned]].sum()
+        return float(merit - self.weight * len(self.merit) * self.mean_coancestry(assignment))
+
+
+class PlanSearch:
+    """Construção gulosa + busca local com avaliação incremental dos movimentos"""
+
+    def __init__(self, problem: PlanProblem, assignment: Optional[np.ndarray] = None):
+        self.problem = problem
+        n_females, n_bulls = problem.merit.shape
+        self.assignment = np.full(n_females, -1, dtype=np.int64) if assignment is None else assignment.copy()
+        self.usage = np.bincount(self.assignment[self.assignment >= 0], minlength=n_bulls)
+        self.pressure = problem.coancestry @ self.usage  # (C u)_b
+        self.diagonal = np.diag(problem.coancestry)
+        self.moves = 0
+
+    def _gain(self, female: int) -> np.ndarray:
+        """Ganho do objetivo ao (re)colocar `female` em cada touro (-inf onde não cabe)"""
+        p = self.problem
+        current = self.assignment[female]
+        cost = 2 * p.dam_coancestry + 2 * self.pressure + self.diagonal
+        gain = p.merit[female].copy()
+        if current >= 0:
+            cost = cost - (2 * p.dam_coancestry[current] + 2 * self.pressure[current]
+                           - self.diagonal[current] + 2 * p.coancestry[current])
+            gain -= p.merit[female, current]
+        gain -= p.scale * cost
+        gain[self.usage >= p.capacity] = -np.inf
+        if current >= 0:
+            gain[current] = -np.inf
+        return gain
+
+    def _move(self, female: int, bull: int):
+        current = self.assignment[female]
+        if current >= 0:
+            self.usage[current] -= 1
+            self.pressure -= self.problem.coancestry[current]
+        self.assignment[female] = bull
+        self.usage[bull] += 1
+        self.pressure += self.problem.coancestry[bull]
+        self.moves += 1
+
+    def construct(self, order: np.ndarray):
+        """Coloca cada fêmea ainda sem touro no touro de maior ganho marginal"""
+        for female in order:
+            if self.assignment[female] >= 0:
+                continue
+            gain = self._gain(female)
+            bull = int(np.argmax(gain))
+            if np.isfinite(gain[bull]):
+                self._move(female, bull)
+
+    def improve(self, order: np.ndarray, max_passes: int = MAX_PASSES) -> int:
+        """Busca local até nenhum movimento melhorar o objetivo; retorna as passadas feitas"""
+        merit = self.problem.merit
+        for passes in range(1, max_passes + 1):
+            improved = False
+
+            # Realocação: a fêmea muda de touro (delta de coancestria pelo uso dos touros)
+            for female in order:
+                gain = self._gain(female)
+                bull = int(np.argmax(gain))
+                if gain[bull] > MOVE_TOLERANCE:
+                    self._move(female, bull)
+                    improved = True
+
+            # Troca: duas fêmeas trocam de touro (uso dos touros não muda, só o IEP)
+            assigned = np.flatnonzero(self.assignment >= 0)
+            for female in order:
+                bull = self.assignment[female]
+                if bull < 0:
+                    continue
+                others = self.assignment[assigned]
+                gain = (merit[female, others] + merit[assigned, bull]
+                        - merit[female, bull] - merit[assigned, others])
+                gain[others == bull] = -np.inf
+                best = int(np.argmax(gain)) if len(gain) else -1
+                if best >= 0 and gain[best] > MOVE_TOLERANCE:
+                    partner = assigned[best]
+                    self.assignment[female], self.assignment[partner] = others[best], bull
+                    self.moves += 1
+                    improved = True
+
+            if not improved:
+                return passes
+        return max_passes
+
+
+# ============================================================================
+# BUSCA EM PARALELO
+# ============================================================================
+
+_worker_problem: Optional[PlanProblem] = None
+
+
+def _init_worker(problem: PlanProblem):
+    global _worker_problem
+    _worker_problem = problem
+
+
+def _search(problem: PlanProblem, start: Optional[np.ndarray], seed: int) -> Tuple[np.ndarray, float, int, int]:
+    """(plano, objetivo, passadas, movimentos) de uma partida"""
+    order = np.random.default_rng(seed).permutation(len(problem.merit))
+    search = PlanSearch(problem, start)
+    search.construct(order)
+    passes = search.improve(order)
+    return search.assignment, problem.objective(search.assignment), passes, search.moves
+
+
+def _search_in_worker(start: Optional[np.ndarray], seed: int):
+    return _search(_worker_problem, start, seed)
+
+
+def optimize_plan(problem: PlanProblem, start: Optional[np.ndarray] = None, restarts: int = 4,
+                  workers: int = 1, seed: int = 0) -> Tuple[np.ndarray, List[Tuple[float, int, int]]]:
+    """
+    Melhor plano entre `restarts` partidas: a primeira parte de `start` (se houver),
+    as demais de construções gulosas em ordens aleatórias.
+    Retorna (plano, [(objetivo, passadas, movimentos) de cada partida]).
+    """
+    starts = [(start if k == 0 else None, seed + k) for k in range(max(restarts, 1))]
+    if workers > 1 and len(starts) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(starts)), initializer=_init_worker,
+                                 initargs=(problem,)) as pool:
+            results = list(pool.map(_search_in_worker, *zip(*starts)))
+    else:
+        results = [_search(problem, s, k) for s, k in starts]
+
+    best = max(range(len(results)), key=lambda k: results[k][1])
+    return results[best][0], [(objective, passes, moves) for _, objective, passes, moves in results]
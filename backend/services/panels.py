@@ -0,0 +1,274 @@
+"""
+Painel de Touros em Memória (cache colunar)
+
+Mantém o catálogo de touros em formato colunar por processo:
+- Matriz de características + reliabilities (TraitMatrix)
+- Flags de haplótipos, GFI, pedigree
+- Arrays de id/código/nome e colunas numéricas para filtros e ordenação
+
+O painel carrega a versão do catálogo (tabela catalog_versions). Toda escrita
+em Bull incrementa a versão, e o painel só é reconstruído quando ela muda.
+O rebanho (HerdPanel) segue o mesmo esquema com a versão 'females'.
+"""
+
+from typing import Callable, Dict, Hashable, List, Optional
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import threading
+import numpy as np
+from sqlalchemy import Float, Integer
+from sqlalchemy.orm import Session
+
+from backend.models.database import Bull, Female, get_catalog_version
+from backend.services.genetics import genetic_calculator
+from backend.services.diversity import LineageIndex
+from backend.services.scoring import ScoringEngine, TraitMatrix, build_trait_matrix
+from backend.services.traits import TRAITS, TraitRecord
+
+
+BULL_INDICES = ['milk', 'protein', 'fat', 'net_merit', 'cheese_merit', 'grazing_merit',
+                'tpi', 'gtpi', 'udc', 'flc', 'ptat', 'productive_life', 'scs', 'dpr',
+                'fertility_index', 'rfi', 'feed_saved', 'beta_casein', 'kappa_casein', 'gfi',
+                'hcr', 'ccr', 'cow_livability', 'heifer_livability', 'sire_calving_ease',
+                'daughter_calving_ease', 'sire_stillbirth', 'daughter_stillbirth',
+                'milk_rel', 'dpr_rel', 'productive_life_rel', 'num_daughters']
+
+RELIABILITY_COLUMNS = [c.name for c in Bull.__table__.columns if c.name.endswith('_rel')]
+
+# Resultados de scoring (componentes por categoria) guardados por painel
+SCORE_CACHE_SIZE = 8
+
+NUMERIC_COLUMNS = [c.name for c in Bull.__table__.columns if isinstance(c.type, (Float, Integer)) and c.name != 'id']
+
+
+def prepare_bull_data(bull: Bull) -> Dict:
+    """Prepara dados do touro para o calculador genético"""
+    data = {
+        'id': bull.id, 'code': bull.code, 'name': bull.name,
+        'source': bull.source, 'naab_code': bull.naab_code,
+        'genetic_data': bull.genetic_data or {}
+    }
+
+    for index in BULL_INDICES:
+        value = getattr(bull, index, None)
+        if value is not None:
+            data[index] = value
+
+    # Reliabilities (colunas *_rel e JSON, decodificados uma vez no TraitRecord)
+    for column in RELIABILITY_COLUMNS:
+        value = getattr(bull, column, None)
+        if value is not None:
+            data[column] = value
+    reliabilities = getattr(bull, 'reliabilities', None)
+    if reliabilities:
+        data['reliabilities'] = reliabilities
+
+    # Haplótipos
+    haplotypes = bull.haplotypes or {}
+    if isinstance(haplotypes, dict):
+        data['haplotypes'] = haplotypes
+        for hap, status in haplotypes.items():
+            data[hap.lower()] = status
+
+    return data
+
+
+@dataclass
+class BullPanel:
+    """Catálogo de touros em formato colunar (todas as linhas, ordenadas por id)"""
+
+    version: int
+    ids: np.ndarray  # (B,) int
+    codes: np.ndarray  # (B,) object
+    names: np.ndarray  # (B,) object
+    sources: np.ndarray  # (B,) object
+    beta_casein: np.ndarray  # (B,) object
+    available: np.ndarray  # (B,) bool
+    stamps: np.ndarray  # (B,) object - last_updated de cada touro
+    columns: Dict[str, np.ndarray]  # colunas numéricas do modelo (NaN = nulo)
+    matrix: TraitMatrix  # características, reliabilities, haplótipos
+    catalog: TraitMatrix  # todas as TRAITS (fórmulas de índice)
+    records: List[TraitRecord]  # registros canônicos (normalizados no carregamento)
+    summaries: List[Dict]  # Bull.to_dict() para listagens
+    scores: 'OrderedDict[Hashable, object]' = field(default_factory=OrderedDict, repr=False)  # LRU de scoring por lote
+    lineage_index: Optional[LineageIndex] = field(default=None, repr=False)  # grupos de pai/MGS (sob demanda)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, session: Session, engine: ScoringEngine, version: int) -> 'BullPanel':
+        bulls = session.query(Bull).order_by(Bull.id).all()
+        records = [engine.calculator.cached_record(bull, prepare_bull_data, is_bull=True) for bull in bulls]
+
+        def column(name):
+            return np.array([getattr(bull, name) for bull in bulls], dtype=float) if bulls else np.empty(0)
+
+        def text(name):
+            return np.array([getattr(bull, name) for bull in bulls], dtype=object)
+
+        return cls(
+            version=version,
+            ids=np.array([bull.id for bull in bulls], dtype=np.int64),
+            codes=text('code'), names=text('name'), sources=text('source'),
+            beta_casein=text('beta_casein'),
+            available=np.array([bool(bull.is_available) for bull in bulls], dtype=bool),
+            stamps=text('last_updated'),
+            columns={name: column(name) for name in NUMERIC_COLUMNS},
+            matrix=engine.build_matrix(records, is_bull=True),
+            catalog=build_trait_matrix(engine.calculator, records, TRAITS, is_bull=True),
+            records=records,
+            summaries=[bull.to_dict() for bull in bulls]
+        )
+
+    def filter_mask(self, filters: Optional[Dict] = None, available_only: bool = True) -> np.ndarray:
+        """Filtros de touros do lote/listagem (nulos nunca passam, como no SQL)"""
+        mask = self.available.copy() if available_only else np.ones(len(self), dtype=bool)
+        if not filters:
+            return mask
+
+        with np.errstate(invalid='ignore'):
+            for key in ('min_milk', 'min_net_merit', 'min_productive_life'):
+                if filters.get(key):
+                    mask &= self.columns[key[4:]] >= float(filters[key])
+            if filters.get('max_gfi'):
+                mask &= self.columns['gfi'] <= float(filters['max_gfi'])
+        if filters.get('beta_casein'):
+            mask &= self.beta_casein == filters['beta_casein']
+        if filters.get('source'):
+            mask &= self.sources == filters['source']
+        return mask
+
+    def select(self, rows: np.ndarray):
+        """(TraitMatrix, records) das linhas selecionadas"""
+        return self.matrix.take(rows), [self.records[i] for i in rows]
+
+    def order_by(self, rows: np.ndarray, column: str, descending: bool = True) -> np.ndarray:
+        """Ordena linhas por uma coluna numérica (nulos primeiro em ASC e por último em DESC, como no SQLite)"""
+        return self.order_values(rows, self.columns[column][rows], descending)
+
+    def order_values(self, rows: np.ndarray, values: np.ndarray, descending: bool = True) -> np.ndarray:
+        """Ordena linhas por valores alinhados a `rows` (ex.: índice personalizado), com os nulos de order_by"""
+        missing = np.isnan(values)
+        present = rows[~missing]
+        order = np.argsort(-values[~missing] if descending else values[~missing], kind='stable')
+        if descending:
+            return np.concatenate([present[order], rows[missing]])
+        return np.concatenate([rows[missing], present[order]])
+
+    def lineage(self) -> LineageIndex:
+        """Índice de linhagem (grupo do pai e do MGS de cada touro), montado uma vez por painel"""
+        if self.lineage_index is None:
+            self.lineage_index = LineageIndex.build(self.matrix)
+        return self.lineage_index
+
+    def cached_scores(self, key: Hashable):
+        """Scoring guardado para este painel (descartado junto com o painel quando a versão muda)"""
+        with _lock:
+            value = self.scores.get(key)
+            if value is not None:
+                self.scores.move_to_end(key)
+            return value
+
+    def store_scores(self, key: Hashable, value):
+        with _lock:
+            self.scores[key] = value
+            while len(self.scores) > SCORE_CACHE_SIZE:
+                self.scores.popitem(last=False)
+
+    def column_values(self, column: str) -> List[float]:
+        """Valores não nulos de uma coluna (todos os touros)"""
+        values = self.columns[column]
+        return values[~np.isnan(values)].tolist()
+
+
+@dataclass
+class HerdPanel:
+    """Rebanho em formato colunar (todas as fêmeas, ordenadas por id)"""
+
+    version: int
+    ids: np.ndarray  # (F,) int
+    reg_ids: np.ndarray  # (F,) object
+    internal_ids: np.ndarray  # (F,) object
+    names: np.ndarray  # (F,) object
+    active: np.ndarray  # (F,) bool
+    matrix: TraitMatrix  # características do motor, reliabilities, haplótipos
+    catalog: TraitMatrix  # todas as TRAITS (fórmulas de índice)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, session: Session, engine: ScoringEngine, version: int,
+              prepare: Callable[[Female], Dict]) -> 'HerdPanel':
+        females = session.query(Female).order_by(Female.id).all()
+        records = [engine.calculator.cached_record(female, prepare) for female in females]
+
+        def text(name):
+            return np.array([getattr(female, name) for female in females], dtype=object)
+
+        return cls(
+            version=version,
+            ids=np.array([female.id for female in females], dtype=np.int64),
+            reg_ids=text('reg_id'), internal_ids=text('internal_id'), names=text('name'),
+            active=np.array([bool(female.is_active) for female in females], dtype=bool),
+            matrix=engine.build_matrix(records),
+            catalog=build_trait_matrix(engine.calculator, records, TRAITS)
+        )
+
+    def female_item(self, row: int) -> Dict:
+        """Identificação da fêmea como nas respostas de matching"""
+        return {'id': int(self.ids[row]), 'reg_id': self.reg_ids[row],
+                'internal_id': self.internal_ids[row], 'name': self.names[row]}
+
+
+# ============================================================================
+# CACHE POR PROCESSO
+# ============================================================================
+
+_lock = threading.Lock()
+_panel: Optional[BullPanel] = None
+_herd: Optional[HerdPanel] = None
+_default_engine: Optional[ScoringEngine] = None
+
+
+def get_bull_panel(session: Session, engine: Optional[ScoringEngine] = None) -> BullPanel:
+    """Painel de touros atual; reconstruído apenas quando a versão do catálogo muda"""
+    global _panel, _default_engine
+
+    if engine is None:
+        if _default_engine is None:
+            _default_engine = ScoringEngine(genetic_calculator)
+        engine = _default_engine
+
+    version = get_catalog_version(session, 'bulls')
+    panel = _panel
+    if panel is not None and panel.version == version and panel.matrix.traits == engine.traits:
+        return panel
+
+    with _lock:
+        if _panel is None or _panel.version != version or _panel.matrix.traits != engine.traits:
+            _panel = BullPanel.build(session, engine, version)
+        return _panel
+
+
+def get_herd_panel(session: Session, engine: ScoringEngine, prepare: Callable[[Female], Dict]) -> HerdPanel:
+    """Painel do rebanho atual; reconstruído apenas quando a versão 'females' muda"""
+    global _herd
+
+    version = get_catalog_version(session, 'females')
+    herd = _herd
+    if herd is not None and herd.version == version and herd.matrix.traits == engine.traits:
+        return herd
+
+    with _lock:
+        if _herd is None or _herd.version != version or _herd.matrix.traits != engine.traits:
+            _herd = HerdPanel.build(session, engine, version, prepare)
+        return _herd
+
+
+def invalidate_bull_panel():
+    """Descarta o painel em cache (próxima leitura reconstrói)"""
+    global _panel
+    with _lock:
+        _panel = None
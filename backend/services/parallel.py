@@ -0,0 +1,100 @@
+"""
+Scoring de Lotes em Paralelo
+
+Divide as fêmeas de um lote em fatias e pontua cada fatia em um pool de
+processos (concurrent.futures):
+- o pool é mantido entre requisições: o motor (parâmetros, estatísticas, pedigree)
+  e a matriz de touros vão para cada processo uma única vez, pelo initializer, e o
+  pool só é recriado quando a chave do chamador (versão do painel, filtros,
+  parâmetros) ou o número de processos muda
+- cada tarefa leva só a fatia de fêmeas (e dos candidatos da matriz materializada)
+- as fatias são múltiplas do bloco de scoring, então os blocos (e o resultado)
+  são idênticos aos da execução serial; a junção segue a ordem original
+"""
+
+from typing import Hashable, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import threading
+import numpy as np
+
+from backend.services.scoring import ScoringEngine, ScoreMatrices, TraitMatrix
+
+
+# Fêmeas por bloco de scoring (mesmo valor padrão de iter_eligible_scores)
+CHUNK_SIZE = 64
+
+# Fatias por processo (equilíbrio de carga entre fatias mais lentas e mais rápidas)
+SHARDS_PER_WORKER = 4
+
+# Abaixo disso o lote é pontuado no próprio processo
+MIN_PARALLEL_FEMALES = 2 * CHUNK_SIZE
+
+
+Components = List[Tuple[int, np.ndarray, ScoreMatrices]]
+
+_worker_state: Optional[Tuple[ScoringEngine, TraitMatrix]] = None
+
+# Pool do processo: (chave, processos, executor); uma requisição paralela por vez o usa
+_pool_lock = threading.Lock()
+_pool: Optional[Tuple[Hashable, int, ProcessPoolExecutor]] = None
+
+
+def _init_worker(engine: ScoringEngine, bulls: TraitMatrix):
+    global _worker_state
+    _worker_state = (engine, bulls)
+
+
+def _score(engine: ScoringEngine, bulls: TraitMatrix, max_inbreeding: float, start: int,
+           females: TraitMatrix, candidates: Optional[np.ndarray]) -> Components:
+    return [(start + offset, cols, scores.compact()) for offset, cols, scores
+            in engine.iter_eligible_scores(females, bulls, max_inbreeding, chunk_size=CHUNK_SIZE,
+                                           candidates=candidates)]
+
+
+def _score_shard(max_inbreeding: float, start: int, females: TraitMatrix,
+                 candidates: Optional[np.ndarray]) -> Components:
+    engine, bulls = _worker_state
+    return _score(engine, bulls, max_inbreeding, start, females, candidates)
+
+
+def _get_pool(key: Hashable, workers: int, engine: ScoringEngine, bulls: TraitMatrix) -> ProcessPoolExecutor:
+    """Pool atual se a chave e o número de processos batem; senão encerra o antigo e cria outro (com _pool_lock)"""
+    global _pool
+    if _pool is not None and _pool[:2] == (key, workers):
+        return _pool[2]
+    if _pool is not None:
+        _pool[2].shutdown(wait=True)
+    _pool = (key, workers, ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                               initargs=(engine, bulls)))
+    return _pool[2]
+
+
+def shutdown_pool():
+    """Encerra o pool do processo (o próximo lote paralelo cria outro)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool[2].shutdown(wait=True)
+            _pool = None
+
+
+def score_components(engine: ScoringEngine, females: TraitMatrix, bulls: TraitMatrix, max_inbreeding: float,
+                     candidates: Optional[np.ndarray] = None, workers: int = 1,
+                     key: Optional[Hashable] = None) -> Components:
+    """
+    Scores compactos por bloco [(início, colunas, ScoreMatrices)], em paralelo se workers > 1.
+    `key` identifica motor + touros (o pool do processo é reaproveitado enquanto ela não muda);
+    sem chave, o lote é pontuado no próprio processo.
+    """
+    if workers <= 1 or key is None or len(females) < MIN_PARALLEL_FEMALES:
+        return _score(engine, bulls, max_inbreeding, 0, females, candidates)
+
+    shard = -(-len(females) // (workers * SHARDS_PER_WORKER))
+    shard = max(CHUNK_SIZE, -(-shard // CHUNK_SIZE) * CHUNK_SIZE)
+    starts = list(range(0, len(females), shard))
+    with _pool_lock:
+        pool = _get_pool(key, workers, engine, bulls)
+        shards = pool.map(_score_shard, [max_inbreeding] * len(starts), starts,
+                          [females.take(slice(start, start + shard)) for start in starts],
+                          [None if candidates is None else candidates[start:start + shard] for start in starts])
+        return [component for components in shards for component in components]
@@ -0,0 +1,557 @@
+"""
+Motor de Pedigree (Meuwissen & Luo)
+
+Representação esparsa do pedigree do rebanho + catálogo:
+- cada animal é um nó com índices de pai/mãe (-1 = desconhecido)
+- coeficientes de consanguinidade (F) por Meuwissen & Luo (1992): percorre só
+  os ancestros de cada animal, sem montar a matriz de parentesco
+- coancestria de pares vaca × touro pelo método de Colleau (A = T D T'),
+  vetorizado por geração e calculado só para o lado menor do bloco pedido
+  (em lotes, o bloco de fêmeas); as colunas ficam em LRU do tamanho do catálogo
+
+Os nós são identificados por aliases normalizados (registro, NAAB, id interno),
+de modo que `sire_naab` de uma fêmea aponta para o mesmo nó do touro do catálogo.
+O pedigree é atualizado de forma incremental: animais novos recebem F sem
+recalcular o restante; só mudanças de pais de animais com descendentes
+disparam a reconstrução completa.
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from collections import OrderedDict
+import hashlib
+import heapq
+import itertools
+import re
+import threading
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from backend.models.database import Female, Bull, get_catalog_version
+
+
+# Acima deste número de nós alterados, F é recalculado em blocos vetorizados
+BULK_THRESHOLD = 500
+
+# Colunas de A calculadas por vez no modo em blocos
+COLUMN_BLOCK = 64
+
+# Colunas de A mantidas em cache (mínimo; get_pedigree amplia para caber o catálogo)
+COLUMN_CACHE_SIZE = 64
+
+# Revisões globais (únicas mesmo após invalidate_pedigree), usadas em chaves de cache
+_revisions = itertools.count(1)
+
+NAAB_PATTERN = re.compile(r'^0*(\d+)([A-Z]{2})0*(\d+)$')
+
+# Chaves de pedigree aceitas em genetic_data (planilhas/PDFs)
+PEDIGREE_KEYS = {
+    'sire': ['sire_naab', 'sire_reg', 'SIRE NAAB', 'SIRE REG'],
+    'dam': ['dam_reg', 'dam_id', 'DAM REG', 'DAM ID'],
+    'mgs': ['mgs_naab', 'mgs_reg', 'MGS NAAB', 'MGS REG'],
+}
+
+
+def normalize_id(value) -> Optional[str]:
+    """Normaliza um identificador (NAAB sem zeros à esquerda, ids numéricos sem '.0')"""
+    if value is None:
+        return None
+    text = str(value).strip().upper()
+    if not text or text in ('NAN', 'NONE', '0'):
+        return None
+    if text.endswith('.0') and text[:-2].isdigit():
+        text = text[:-2]
+    match = NAAB_PATTERN.match(text)
+    if match:
+        return f'{int(match.group(1))}{match.group(2)}{int(match.group(3)):05d}'
+    return text
+
+
+def animal_key(data, is_bull: bool = False) -> Optional[str]:
+    """Alias principal de um animal (código/NAAB para touros, registro/id interno para fêmeas)"""
+    keys = ('code', 'naab_code', 'reg_id') if is_bull else ('reg_id', 'internal_id')
+    for key in keys:
+        value = normalize_id(data.get(key))
+        if value:
+            return value
+    return None
+
+
+def _aliases(values: Iterable) -> List[str]:
+    return [alias for alias in dict.fromkeys(normalize_id(v) for v in values) if alias]
+
+
+class Pedigree:
+    """Pedigree esparso com F (Meuwissen & Luo) e coancestria (Colleau)"""
+
+    def __init__(self, column_cache_size: int = COLUMN_CACHE_SIZE):
+        self._alias: Dict[str, int] = {}
+        self.sire: List[int] = []
+        self.dam: List[int] = []
+        self.generation: List[int] = []
+        self.inbreeding: List[float] = []  # F de cada nó
+        self.d: List[float] = []  # variância mendeliana (diagonal de D)
+        self._children: List[int] = []  # número de filhos conhecidos
+        self._arrays = None
+        self._columns: 'OrderedDict[int, np.ndarray]' = OrderedDict()
+        self._column_cache_size = column_cache_size
+        self._lineage: Optional[List[str]] = None  # hash da ascendência de cada nó
+        self._lock = threading.Lock()
+        self.revision = next(_revisions)
+
+    def __len__(self) -> int:
+        return len(self.sire)
+
+    def __getstate__(self):
+        """Cópia para processos de trabalho: sem lock nem colunas/arrays em cache"""
+        state = self.__dict__.copy()
+        state.update(_lock=None, _arrays=None, _columns=OrderedDict(), _lineage=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def copy(self) -> 'Pedigree':
+        """Cópia independente (mesma revisão), para atualizar sem afetar quem usa esta"""
+        clone = Pedigree(self._column_cache_size)
+        with self._lock:
+            clone._alias = dict(self._alias)
+            clone.sire, clone.dam = list(self.sire), list(self.dam)
+            clone.generation, clone.inbreeding, clone.d = list(self.generation), list(self.inbreeding), list(self.d)
+            clone._children = list(self._children)
+            clone._lineage = self._lineage
+            clone.revision = self.revision
+        return clone
+
+    # ========================================================================
+    # CONSTRUÇÃO / ATUALIZAÇÃO INCREMENTAL
+    # ========================================================================
+
+    def index(self, alias) -> int:
+        """Índice do nó de um alias (-1 se desconhecido)"""
+        return self._alias.get(normalize_id(alias), -1)
+
+    def _node(self, aliases: Sequence[str]) -> int:
+        node = next((self._alias[a] for a in aliases if a in self._alias), -1)
+        if node < 0:
+            node = len(self.sire)
+            self.sire.append(-1)
+            self.dam.append(-1)
+            self.generation.append(0)
+            self.inbreeding.append(0.0)
+            self.d.append(1.0)
+            self._children.append(0)
+        for alias in aliases:
+            self._alias.setdefault(alias, node)
+        return node
+
+    def _set_parent(self, node: int, parents: List[int], parent: int) -> bool:
+        if parent < 0 or parent == node or parents[node] == parent:
+            return False
+        if parents[node] >= 0:
+            self._children[parents[node]] -= 1
+        parents[node] = parent
+        self._children[parent] += 1
+        return True
+
+    def update(self, entries: Iterable[Dict]) -> int:
+        """
+        Registra/atualiza animais. Cada entrada tem listas de aliases:
+        {'aliases': [...], 'sire': [...], 'dam': [...], 'mgs': [...]}
+
+        Retorna o número de nós novos ou alterados.
+        """
+        with self._lock:
+            start = len(self.sire)
+            changed = set()
+            restructure = False
+
+            for entry in entries:
+                aliases = _aliases(entry.get('aliases', ()))
+                if not aliases:
+                    continue
+                node = self._node(aliases)
+
+                sire_aliases = _aliases(entry.get('sire', ()))
+                dam_aliases = _aliases(entry.get('dam', ()))
+                mgs_aliases = _aliases(entry.get('mgs', ()))
+
+                sire = self._node(sire_aliases) if sire_aliases else -1
+                if dam_aliases:
+                    dam = self._node(dam_aliases)
+                elif mgs_aliases:
+                    dam = self._node([f'DAM OF {aliases[0]}'])  # mãe fantasma (só o avô materno é conhecido)
+                else:
+                    dam = -1
+
+                mgs = self._node(mgs_aliases) if mgs_aliases else -1
+                if dam >= 0 and mgs >= 0 and self.sire[dam] < 0:
+                    if self._set_parent(dam, self.sire, mgs):
+                        changed.add(dam)
+                        restructure |= dam < start and self._children[dam] > 0
+
+                for parents, parent in ((self.sire, sire), (self.dam, dam)):
+                    if self._set_parent(node, parents, parent):
+                        changed.add(node)
+                        restructure |= node < start and self._children[node] > 0
+
+            changed.update(range(start, len(self.sire)))
+            if not changed:
+                return 0
+
+            if restructure:
+                self._recompute(range(len(self.sire)))
+            else:
+                self._recompute(changed)
+
+            self._arrays = None
+            self._columns.clear()
+            self._lineage = None
+            self.revision = next(_revisions)
+            return len(changed)
+
+    def _recompute(self, nodes: Iterable[int]):
+        """Gerações e F dos nós em ordem topológica (pais antes dos filhos)"""
+        nodes = set(nodes)
+        for node in nodes:
+            self.generation[node] = -1
+        for node in nodes:
+            self._generation_of(node)
+
+        if len(nodes) > BULK_THRESHOLD:
+            self._arrays = None
+            self._bulk_inbreeding(nodes)
+            return
+
+        for node in sorted(nodes, key=lambda n: self.generation[n]):
+            self.d[node] = self._mendelian_variance(node)
+            sire, dam = self.sire[node], self.dam[node]
+            self.inbreeding[node] = self._meuwissen_luo(node) if sire >= 0 and dam >= 0 else 0.0
+
+    def _mendelian_variance(self, node: int) -> float:
+        sire, dam = self.sire[node], self.dam[node]
+        f_sire = self.inbreeding[sire] if sire >= 0 else 0.0
+        f_dam = self.inbreeding[dam] if dam >= 0 else 0.0
+        if sire >= 0 and dam >= 0:
+            return 0.5 - 0.25 * (f_sire + f_dam)
+        elif sire >= 0 or dam >= 0:
+            return 0.75 - 0.25 * (f_sire if sire >= 0 else f_dam)
+        return 1.0
+
+    def _bulk_inbreeding(self, nodes: set):
+        """
+        F de muitos nós de uma vez, geração por geração: F_i = a(pai, mãe) / 2, com as
+        colunas de A dos pais da geração calculadas em blocos pelo método de Colleau
+        """
+        view = self._numpy_view()
+        sire, dam, d, by_generation = view.sire, view.dam, view.d, view.by_generation
+        n = len(d) - 1
+        inbreeding = np.append(np.array(self.inbreeding, dtype=float), 0.0)
+        pending = np.zeros(n + 1, dtype=bool)
+        pending[list(nodes)] = True
+
+        for g, idx in enumerate(by_generation):
+            idx = idx[pending[idx]]
+            if len(idx) == 0:
+                continue
+            both = idx[(sire[idx] < n) & (dam[idx] < n)]
+            inbreeding[idx] = 0.0
+
+            if len(both):
+                # Colunas para o conjunto menor de pais (touros costumam ser poucos)
+                keys, others = sire[both], dam[both]
+                if len(np.unique(dam[both])) < len(np.unique(keys)):
+                    keys, others = others, keys
+                unique_keys, key_col = np.unique(keys, return_inverse=True)
+                for start in range(0, len(unique_keys), COLUMN_BLOCK):
+                    block = unique_keys[start:start + COLUMN_BLOCK]
+                    columns = view.relationship_columns(block, upto=g)
+                    in_block = (key_col >= start) & (key_col < start + len(block))
+                    inbreeding[both[in_block]] = 0.5 * columns[others[in_block], key_col[in_block] - start]
+
+            f_sire, f_dam = inbreeding[sire[idx]], inbreeding[dam[idx]]
+            known_sire, known_dam = sire[idx] < n, dam[idx] < n
+            d[idx] = np.select(
+                [known_sire & known_dam, known_sire | known_dam],
+                [0.5 - 0.25 * (f_sire + f_dam), 0.75 - 0.25 * np.where(known_sire, f_sire, f_dam)],
+                default=1.0
+            )
+
+        self.inbreeding = inbreeding[:n].tolist()
+        self.d = d[:n].tolist()
+
+    def _generation_of(self, node: int) -> int:
+        """Geração (0 = sem pais conhecidos); vínculos que formariam ciclo são descartados"""
+        stack = [node]
+        while stack:
+            current = stack[-1]
+            if self.generation[current] >= 0:
+                stack.pop()
+                continue
+            self.generation[current] = -2  # em andamento
+            pending = []
+            for parents in (self.sire, self.dam):
+                parent = parents[current]
+                if parent >= 0 and self.generation[parent] == -2:
+                    parents[current] = -1
+                    self._children[parent] -= 1
+                elif parent >= 0 and self.generation[parent] == -1:
+                    pending.append(parent)
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            parent_gens = [self.generation[p] for p in (self.sire[current], self.dam[current]) if p >= 0]
+            self.generation[current] = max(parent_gens) + 1 if parent_gens else 0
+        return self.generation[node]
+
+    def _meuwissen_luo(self, node: int) -> float:
+        """F = a_ii - 1, com a_ii = soma de L_ij² D_j sobre o animal e seus ancestros"""
+        contributions = {node: 1.0}
+        heap = [(-self.generation[node], -node)]
+        a_ii = 0.0
+        while heap:
+            _, neg = heapq.heappop(heap)
+            j = -neg
+            l_ij = contributions.pop(j)
+            a_ii += l_ij * l_ij * self.d[j]
+            for parent in (self.sire[j], self.dam[j]):
+                if parent < 0:
+                    continue
+                if parent not in contributions:
+                    contributions[parent] = 0.0
+                    heapq.heappush(heap, (-self.generation[parent], -parent))
+                contributions[parent] += 0.5 * l_ij
+        return a_ii - 1.0
+
+    # ========================================================================
+    # CONSULTAS
+    # ========================================================================
+
+    def inbreeding_of(self, alias) -> Optional[float]:
+        """F de um animal (None se não estiver no pedigree)"""
+        node = self.index(alias)
+        return self.inbreeding[node] if node >= 0 else None
+
+    def coancestry(self, alias_a, alias_b) -> Optional[float]:
+        """Coancestria (= F esperado da progênie) de dois animais (None se o pedigree não informa)"""
+        value = self.coancestry_matrix([alias_a], [alias_b])[0, 0]
+        return None if np.isnan(value) else float(value)
+
+    def has_parents(self, nodes: np.ndarray) -> np.ndarray:
+        """bool por nó: pai ou mãe conhecidos (nós -1 = fora do pedigree -> False)"""
+        view = self._numpy_view()
+        nodes = np.asarray(nodes, dtype=np.int64)
+        unknown = len(view.d) - 1  # sentinela de pai desconhecido
+        return (nodes >= 0) & ((view.sire[nodes] < unknown) | (view.dam[nodes] < unknown))
+
+    def coancestry_matrix(self, aliases_a: Sequence, aliases_b: Sequence) -> np.ndarray:
+        """
+        (len(a), len(b)) coancestrias; NaN para animais fora do pedigree e para pares de
+        animais distintos sem pais conhecidos (o 0 de dois fundadores não é informação:
+        quem usa cai na heurística). A é simétrica: as colunas (Colleau) são calculadas
+        para o lado com menos animais distintos, só nos nós com algum par informativo.
+        """
+        rows = np.array([self.index(a) for a in aliases_a], dtype=np.int64)
+        cols = np.array([self.index(b) for b in aliases_b], dtype=np.int64)
+        if len(np.unique(rows[rows >= 0])) < len(np.unique(cols[cols >= 0])):
+            return self._coancestry_block(cols, rows).T
+        return self._coancestry_block(rows, cols)
+
+    def _coancestry_block(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """Coancestrias nós `rows` × nós `cols` a partir das colunas de A dos nós `cols`"""
+        result = np.full((len(rows), len(cols)), np.nan)
+        known_rows = rows >= 0
+        if not known_rows.any() or not (cols >= 0).any():
+            return result
+
+        row_parents = self.has_parents(rows)
+        col_parents = self.has_parents(cols)
+        # Coluna necessária: o touro tem pais, ou alguma linha tem pais, ou é o mesmo animal
+        needed = (cols >= 0) & (col_parents | row_parents.any() | np.isin(cols, rows[known_rows]))
+        targets = np.flatnonzero(needed)
+        for c, column in zip(targets, self._relationship_columns(cols[targets])):
+            result[known_rows, c] = column[rows[known_rows]] / 2
+
+        uninformative = ~row_parents[:, None] & ~col_parents[None, :] & (rows[:, None] != cols[None, :])
+        result[uninformative] = np.nan
+        return result
+
+    def lineage_hashes(self, aliases: Sequence) -> List[Optional[str]]:
+        """
+        Hash da ascendência de cada animal (None se fora do pedigree). A coancestria de um
+        par só depende das ascendências dos dois animais; o hash muda apenas quando o animal
+        ou algum ancestro ganha/troca pais e, ao contrário de `revision`, é o mesmo em
+        qualquer processo (pode ser gravado no banco).
+        """
+        with self._lock:
+            if self._lineage is None:
+                self._lineage = self._lineage_digests()
+            lineage = self._lineage
+        return [lineage[node] if node >= 0 else None for node in (self.index(alias) for alias in aliases)]
+
+    def _lineage_digests(self) -> List[str]:
+        """Hash encadeado (menor alias do nó + hashes do pai e da mãe), pais antes dos filhos"""
+        names: List[Optional[str]] = [None] * len(self.sire)
+        for alias, node in self._alias.items():
+            if names[node] is None or alias < names[node]:
+                names[node] = alias
+
+        digests = [''] * len(self.sire)
+        for node in sorted(range(len(self.sire)), key=lambda n: self.generation[n]):
+            sire, dam = self.sire[node], self.dam[node]
+            text = '|'.join((names[node] or '', digests[sire] if sire >= 0 else '', digests[dam] if dam >= 0 else ''))
+            digests[node] = hashlib.md5(text.encode()).hexdigest()
+        return digests
+
+    def _relationship_columns(self, nodes: np.ndarray) -> List[np.ndarray]:
+        """Colunas de A para `nodes` (LRU por nó; as que faltam são calculadas em blocos)"""
+        with self._lock:
+            cached = {int(node): self._columns.get(int(node)) for node in nodes}
+        missing = np.array([node for node, column in cached.items() if column is None], dtype=np.int64)
+
+        if len(missing):
+            view = self._numpy_view()
+            for start in range(0, len(missing), COLUMN_BLOCK):
+                block = missing[start:start + COLUMN_BLOCK]
+                columns = view.relationship_columns(block)
+                for k, node in enumerate(block):
+                    cached[int(node)] = columns[:-1, k].copy()
+
+            with self._lock:
+                for node in missing:
+                    self._columns[int(node)] = cached[int(node)]
+                while len(self._columns) > self._column_cache_size:
+                    self._columns.popitem(last=False)
+
+        return [cached[int(node)] for node in nodes]
+
+    def _numpy_view(self) -> '_PedigreeArrays':
+        arrays = self._arrays
+        if arrays is None:
+            arrays = self._arrays = _PedigreeArrays(self.sire, self.dam, self.d, self.generation)
+        return arrays
+
+
+class _PedigreeArrays:
+    """
+    Pedigree em arrays (posição n = sentinela de pai desconhecido), agrupado por
+    geração, com planos de dispersão pré-ordenados para somas por pai (reduceat)
+    """
+
+    __slots__ = ('sire', 'dam', 'd', 'by_generation', 'scatters')
+
+    def __init__(self, sire: List[int], dam: List[int], d: List[float], generation: List[int]):
+        n = len(sire)
+        self.sire = np.array(sire, dtype=np.int64)
+        self.dam = np.array(dam, dtype=np.int64)
+        self.sire[self.sire < 0] = n
+        self.dam[self.dam < 0] = n
+        self.d = np.append(np.array(d, dtype=float), 0.0)
+
+        generation = np.array(generation, dtype=np.int64)
+        order = np.argsort(generation, kind='stable')
+        bounds = np.searchsorted(generation[order], np.arange(generation.max() + 2 if n else 1))
+        self.by_generation = [order[bounds[g]:bounds[g + 1]] for g in range(len(bounds) - 1)]
+        self.scatters = [[self._scatter_plan(idx, parents, n) for parents in (self.sire, self.dam)]
+                         for idx in self.by_generation]
+
+    @staticmethod
+    def _scatter_plan(idx: np.ndarray, parents: np.ndarray, n: int):
+        rows = idx[parents[idx] < n]
+        rows = rows[np.argsort(parents[rows], kind='stable')]
+        targets = parents[rows]
+        starts = np.flatnonzero(np.r_[True, targets[1:] != targets[:-1]]) if len(rows) else np.empty(0, dtype=np.int64)
+        return rows, targets[starts], starts
+
+    def relationship_columns(self, keys: np.ndarray, upto: Optional[int] = None) -> np.ndarray:
+        """
+        (n + 1, k) colunas de A para `keys` pelo método de Colleau: A e_i = T D T' e_i.
+        Com `upto`, só as gerações < upto são percorridas (suficiente para ancestros).
+        """
+        generations = len(self.by_generation) if upto is None else upto
+        y = np.zeros((len(self.d), len(keys)))
+        y[keys, np.arange(len(keys))] = 1.0
+
+        # y = T' e_i (apenas os animais e seus ancestros ficam não nulos)
+        for g in range(generations - 1, 0, -1):
+            for rows, targets, starts in self.scatters[g]:
+                if len(rows):
+                    y[targets] += 0.5 * np.add.reduceat(y[rows], starts, axis=0)
+        y[-1] = 0.0
+
+        # w = T D y (pais antes dos filhos)
+        w = self.d[:, None] * y
+        for idx in self.by_generation[1:generations]:
+            w[idx] += 0.5 * (w[self.sire[idx]] + w[self.dam[idx]])
+        return w
+
+
+# ============================================================================
+# CACHE POR PROCESSO
+# ============================================================================
+
+_lock = threading.Lock()
+_pedigree: Optional[Pedigree] = None
+_versions: Optional[Tuple[int, int]] = None
+
+
+def _first(data: Dict, keys: Sequence[str]) -> List:
+    return [data.get(key) for key in keys if data.get(key)]
+
+
+def pedigree_entries(session: Session) -> List[Dict]:
+    """Entradas de pedigree de touros (genetic_data) e fêmeas (colunas de pedigree)"""
+    entries = []
+    for code, naab_code, reg_id, genetic_data in session.query(Bull.code, Bull.naab_code, Bull.reg_id, Bull.genetic_data):
+        genetic = genetic_data if isinstance(genetic_data, dict) else {}
+        entries.append({
+            'aliases': [code, naab_code, reg_id],
+            'sire': _first(genetic, PEDIGREE_KEYS['sire']),
+            'dam': _first(genetic, PEDIGREE_KEYS['dam']),
+            'mgs': _first(genetic, PEDIGREE_KEYS['mgs']),
+        })
+
+    columns = (Female.reg_id, Female.internal_id, Female.sire_naab, Female.sire_reg,
+               Female.dam_reg, Female.dam_id, Female.mgs_naab, Female.mgs_reg)
+    for reg_id, internal_id, sire_naab, sire_reg, dam_reg, dam_id, mgs_naab, mgs_reg in session.query(*columns):
+        entries.append({
+            'aliases': [reg_id, internal_id],
+            'sire': [sire_naab, sire_reg], 'dam': [dam_reg, dam_id], 'mgs': [mgs_naab, mgs_reg],
+        })
+    return entries
+
+
+def get_pedigree(session: Session) -> Pedigree:
+    """
+    Pedigree atual; sincronizado (incrementalmente) quando a versão de touros ou fêmeas muda.
+    A sincronização atualiza uma cópia: um pedigree já devolvido nunca muda, então
+    requisições em andamento continuam com o mesmo pedigree (e a mesma revisão) até o fim.
+    """
+    global _pedigree, _versions
+
+    versions = (get_catalog_version(session, 'bulls'), get_catalog_version(session, 'females'))
+    pedigree = _pedigree
+    if pedigree is not None and _versions == versions:
+        return pedigree
+
+    with _lock:
+        if _pedigree is None or _versions != versions:
+            pedigree = Pedigree() if _pedigree is None else _pedigree.copy()
+            # Cache de colunas do tamanho do catálogo (+ um bloco de fêmeas): sem trocas em lotes
+            catalog = session.query(func.count(Bull.id)).scalar() or 0
+            pedigree._column_cache_size = max(COLUMN_CACHE_SIZE, catalog + COLUMN_BLOCK)
+            if pedigree.update(pedigree_entries(session)) or _pedigree is None:
+                _pedigree = pedigree
+            _pedigree._column_cache_size = pedigree._column_cache_size
+            _versions = versions
+        return _pedigree
+
+
+def invalidate_pedigree():
+    """Descarta o pedigree em cache (próxima leitura reconstrói do zero)"""
+    global _pedigree, _versions
+    with _lock:
+        _pedigree = None
+        _versions = None
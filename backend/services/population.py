@@ -0,0 +1,230 @@
+"""
+Estatísticas Populacionais (momentos de Welford)
+
+Média e desvio padrão de cada característica, usados nos z-scores do IEP e na
+variância de Mendelian sampling, calculados a partir dos animais do banco:
+- uma população por tabela: 'bulls' (catálogo) e 'herd' (fêmeas do rebanho)
+- cada população guarda n, média e M2 (soma dos quadrados dos desvios) por
+  característica; importações aplicam só os animais novos/alterados (Welford,
+  com remoção do valor antigo) e gravam uma nova versão na mesma transação
+- a reconstrução completa (na inicialização, se o banco não tem nenhuma versão,
+  ou pelo endpoint de manutenção) é uma passada única em blocos, combinados
+  pela fórmula de Chan; leituras nunca reconstroem
+- o calculador usa as populações de `GeneticParameters.stats_populations`
+  combinadas, com média/desvio arredondados a poucos dígitos significativos:
+  pequenas importações não mudam as estatísticas ativas (nem invalidam caches)
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import threading
+import numpy as np
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend.models.database import PopulationStatistics
+from backend.services.traits import TRAITS
+
+
+POPULATIONS = ('bulls', 'herd')
+
+# Amostras mínimas para a característica usar a estatística do banco (senão, o padrão)
+MIN_SAMPLES = 30
+
+# Dígitos significativos de média/desvio nas estatísticas ativas
+STATS_DIGITS = 3
+
+# Animais por bloco na reconstrução completa
+REBUILD_CHUNK = 500
+
+
+class TraitMoments:
+    """n, média e M2 por característica (arrays alinhados a TRAITS; NaN = ausente)"""
+
+    def __init__(self, n: Optional[np.ndarray] = None, mean: Optional[np.ndarray] = None,
+                 m2: Optional[np.ndarray] = None):
+        size = len(TRAITS)
+        self.n = np.zeros(size) if n is None else np.asarray(n, dtype=float)
+        self.mean = np.zeros(size) if mean is None else np.asarray(mean, dtype=float)
+        self.m2 = np.zeros(size) if m2 is None else np.asarray(m2, dtype=float)
+
+    def add(self, values: Sequence[float]):
+        """Inclui um animal (atualização de Welford)"""
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values)
+        x = values[valid]
+        self.n[valid] += 1
+        delta = x - self.mean[valid]
+        self.mean[valid] += delta / self.n[valid]
+        self.m2[valid] += delta * (x - self.mean[valid])
+
+    def remove(self, values: Sequence[float]):
+        """Retira um animal incluído antes (Welford inverso)"""
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values) & (self.n > 0)
+        x, n, mean = values[valid], self.n[valid] - 1, self.mean[valid]
+        remaining = n > 0
+        new_mean = np.where(remaining, (mean * (n + 1) - x) / np.maximum(n, 1), 0.0)
+        self.m2[valid] = np.where(remaining, np.maximum(self.m2[valid] - (x - mean) * (x - new_mean), 0.0), 0.0)
+        self.mean[valid] = new_mean
+        self.n[valid] = n
+
+    def update(self, old: Optional[Sequence[float]], new: Optional[Sequence[float]]):
+        """Troca os valores de um animal (None = animal novo ou removido)"""
+        if old is not None:
+            self.remove(old)
+        if new is not None:
+            self.add(new)
+
+    @classmethod
+    def from_batch(cls, matrix: np.ndarray) -> 'TraitMoments':
+        """Momentos de um bloco (animais × TRAITS)"""
+        valid = ~np.isnan(matrix)
+        n = valid.sum(axis=0).astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, np.where(valid, matrix, 0.0).sum(axis=0) / np.maximum(n, 1), 0.0)
+        m2 = np.where(valid, (matrix - mean) ** 2, 0.0).sum(axis=0)
+        return cls(n, mean, m2)
+
+    def combine(self, other: 'TraitMoments') -> 'TraitMoments':
+        """Momentos da união de duas amostras (Chan et al.)"""
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        share = np.divide(other.n, n, out=np.zeros_like(n), where=n > 0)
+        mean = self.mean + delta * share
+        m2 = self.m2 + other.m2 + delta ** 2 * self.n * share
+        return TraitMoments(n, mean, m2)
+
+    def std(self) -> np.ndarray:
+        """Desvio padrão amostral (0 com menos de duas observações)"""
+        return np.sqrt(np.divide(self.m2, self.n - 1, out=np.zeros_like(self.m2), where=self.n > 1))
+
+    def stats(self, min_samples: int = MIN_SAMPLES, digits: int = STATS_DIGITS) -> Dict[str, Dict[str, float]]:
+        """{característica: {'mean', 'std'}} das características com amostras suficientes"""
+        std = self.std()
+        return {trait: {'mean': _significant(self.mean[t], digits), 'std': _significant(std[t], digits)}
+                for t, trait in enumerate(TRAITS) if self.n[t] >= min_samples and std[t] > 0}
+
+    def to_json(self) -> Dict[str, List[float]]:
+        return {trait: [int(self.n[t]), float(self.mean[t]), float(self.m2[t])]
+                for t, trait in enumerate(TRAITS) if self.n[t] > 0}
+
+    @classmethod
+    def from_json(cls, data: Optional[Dict]) -> 'TraitMoments':
+        moments = cls()
+        for t, trait in enumerate(TRAITS):
+            if trait in (data or {}):
+                moments.n[t], moments.mean[t], moments.m2[t] = data[trait]
+        return moments
+
+
+def _significant(value: float, digits: int) -> float:
+    return float(f'{float(value):.{digits}g}')
+
+
+# ============================================================================
+# VERSÕES
+# ============================================================================
+
+def active_versions(session: Session) -> Dict[str, int]:
+    """Versão ativa (a mais recente) de cada população"""
+    return dict(session.query(PopulationStatistics.population, func.max(PopulationStatistics.version))
+                .group_by(PopulationStatistics.population).all())
+
+
+def load_moments(session: Session, population: str) -> Tuple[int, Optional[TraitMoments]]:
+    """(versão, momentos) ativos de uma população; (0, None) se nunca calculada"""
+    row = session.query(PopulationStatistics).filter(PopulationStatistics.population == population) \
+        .order_by(PopulationStatistics.version.desc()).first()
+    if row is None:
+        return 0, None
+    return row.version, TraitMoments.from_json(row.moments)
+
+
+def save_moments(session: Session, population: str, moments: TraitMoments, source: str,
+                 version: Optional[int] = None) -> int:
+    """Grava uma nova versão da população na transação corrente"""
+    if version is None:
+        version = load_moments(session, population)[0]
+    session.add(PopulationStatistics(population=population, version=version + 1,
+                                     moments=moments.to_json(), source=source))
+    return version + 1
+
+
+def record_changes(session: Session, population: str,
+                   changes: Iterable[Tuple[Optional[Sequence[float]], Optional[Sequence[float]]]]) -> Optional[int]:
+    """
+    Aplica (valores antigos, valores novos) de animais importados sobre a versão ativa
+    e grava a próxima versão. Sem versão ativa não faz nada: a inicialização do app
+    (MatchingService.ensure_population_stats) reconstrói do banco.
+    """
+    changes = list(changes)
+    version, moments = load_moments(session, population)
+    if moments is None or not changes:
+        return None
+    for old, new in changes:
+        moments.update(old, new)
+    return save_moments(session, population, moments, 'import', version)
+
+
+def record_changes_in(db_url: str, population: str,
+                      changes: Iterable[Tuple[Optional[Sequence[float]], Optional[Sequence[float]]]]) -> Optional[int]:
+    """
+    record_changes numa sessão própria, para scripts que gravam os animais por SQL direto
+    (chamado depois do commit deles, com os valores antigos lidos antes de cada escrita)
+    """
+    engine = create_engine(db_url)
+    PopulationStatistics.__table__.create(engine, checkfirst=True)
+    session = sessionmaker(bind=engine)()
+    try:
+        version = record_changes(session, population, changes)
+        session.commit()
+        return version
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def rebuild_moments(session: Session, population: str, rows: Iterable[Sequence[float]]) -> int:
+    """Reconstrução em passada única (blocos combinados por Chan); grava uma nova versão"""
+    moments = TraitMoments()
+    chunk = []
+    for values in rows:
+        chunk.append(values)
+        if len(chunk) >= REBUILD_CHUNK:
+            moments = moments.combine(TraitMoments.from_batch(np.array(chunk, dtype=float)))
+            chunk = []
+    if chunk:
+        moments = moments.combine(TraitMoments.from_batch(np.array(chunk, dtype=float)))
+    return save_moments(session, population, moments, 'rebuild')
+
+
+# ============================================================================
+# ESTATÍSTICAS ATIVAS (CACHE POR PROCESSO)
+# ============================================================================
+
+_lock = threading.Lock()
+_cached: Optional[Tuple[Tuple, Dict]] = None
+
+
+def get_population_stats(session: Session, populations: Sequence[str] = POPULATIONS) -> Tuple[Dict[str, int], Dict]:
+    """
+    (versões, estatísticas) das populações combinadas. Só relê os momentos quando
+    alguma versão muda; versões vazias = nenhuma população calculada ainda.
+    """
+    global _cached
+    versions = {population: version for population, version in active_versions(session).items()
+                if population in populations}
+    key = (tuple(populations), tuple(sorted(versions.items())))
+    cached = _cached
+    if cached is not None and cached[0] == key:
+        return versions, cached[1]
+
+    with _lock:
+        pooled = TraitMoments()
+        for population in populations:
+            moments = load_moments(session, population)[1]
+            if moments is not None:
+                pooled = pooled.combine(moments)
+        stats = pooled.stats()
+        _cached = (key, stats)
+    return versions, stats
@@ -0,0 +1,319 @@
+"""
+Matriz Materializada de Scores (fêmea × touro)
+
+Guarda no banco, para todo o rebanho contra todo o catálogo, o resultado do
+IEP com os parâmetros padrão:
+- IEP normalizado e consanguinidade esperada em float32, lethal flag em bits
+- cada touro tem uma posição fixa (mating_score_columns); cada fêmea tem uma
+  linha dividida em blocos de BLOCK_SIZE posições (mating_score_blocks)
+
+A atualização é incremental: linhas de fêmeas novas/alteradas (last_updated),
+calculadas com outros parâmetros ou cuja ascendência no pedigree mudou são
+refeitas inteiras; touros novos/alterados (registro ou ascendência) só
+recalculam a sua coluna (e apenas o bloco que a contém) nas demais linhas.
+A ascendência entra porque importar um ancestro muda a coancestria entre
+animais já existentes sem mudar o last_updated deles.
+
+Leituras servem de pré-filtro exato para o lote: os candidatos de cada fêmea
+são recalculados em precisão total antes do ranking final.
+"""
+
+from typing import Callable, Dict, List, Optional, Sequence
+from dataclasses import dataclass
+import numpy as np
+from sqlalchemy.orm import Session
+
+from backend.models.database import Female, Bull, MatingScoreBlock, MatingScoreColumn
+from backend.services.scoring import ScoringEngine, py_round
+from backend.services.panels import get_bull_panel
+from backend.services.pedigree import animal_key
+
+
+# Posições de touros por bloco de linha
+BLOCK_SIZE = 256
+
+# Fêmeas pontuadas por vez na atualização
+REFRESH_CHUNK = 128
+
+# Folga dos candidatos para o erro do float32 (IEP <= 100, consanguinidade em %)
+IEP_TOLERANCE = 1e-4
+INBREEDING_TOLERANCE = 1e-3
+
+
+def _encode(values: np.ndarray) -> bytes:
+    return values.astype(np.float32).tobytes()
+
+
+def _decode(blob: Optional[bytes]) -> np.ndarray:
+    if not blob:
+        return np.full(BLOCK_SIZE, np.nan, dtype=np.float32)
+    return np.frombuffer(blob, dtype=np.float32).copy()
+
+
+def _female_key(reg_id, internal_id) -> Optional[str]:
+    return animal_key({'reg_id': reg_id, 'internal_id': internal_id})
+
+
+def _bull_key(code, naab_code) -> Optional[str]:
+    """Mesmo alias do painel (prepare_bull_data leva code e naab_code)"""
+    return animal_key({'code': code, 'naab_code': naab_code}, is_bull=True)
+
+
+def _decode_bits(blob: Optional[bytes]) -> np.ndarray:
+    if not blob:
+        return np.zeros(BLOCK_SIZE, dtype=bool)
+    return np.unpackbits(np.frombuffer(blob, dtype=np.uint8))[:BLOCK_SIZE].astype(bool)
+
+
+@dataclass
+class MaterializedScores:
+    """Linhas lidas da matriz, alinhadas à lista de touros pedida"""
+
+    female_ids: List[int]
+    bull_ids: np.ndarray  # (B,)
+    iep: np.ndarray  # (F, B) float32
+    inbreeding: np.ndarray  # (F, B) float32
+    lethal: np.ndarray  # (F, B) bool
+
+    def candidates(self, top_n: int, max_inbreeding: float) -> np.ndarray:
+        """
+        (F, B) bool - touros que podem estar no top N exato de cada fêmea.
+
+        O ranking exato ordena por IEP arredondado a 0.1 (desc) e posição do touro (asc).
+        Com o IEP exato entre limites inferior/superior do valor armazenado, um touro é
+        descartado quando o N-ésimo touro seguramente elegível certamente o precede.
+        """
+        maybe = (self.inbreeding <= max_inbreeding + INBREEDING_TOLERANCE) & ~self.lethal
+        n_bulls = self.iep.shape[1]
+        if top_n <= 0 or n_bulls == 0:
+            return np.zeros_like(maybe)
+
+        iep = self.iep.astype(float)
+        lower = py_round(iep - IEP_TOLERANCE, 1)
+        upper = py_round(iep + IEP_TOLERANCE, 1)
+        sure = (self.inbreeding <= max_inbreeding - INBREEDING_TOLERANCE) & ~self.lethal
+        cols = np.broadcast_to(np.arange(n_bulls), iep.shape)
+
+        key = np.where(sure, lower, -np.inf)
+        order = np.lexsort((cols, -key), axis=-1)
+        nth = order[:, min(top_n, n_bulls) - 1]
+        nth_key = key[np.arange(len(key)), nth][:, None]
+        precedes = (nth_key > upper) | ((nth_key >= upper) & (nth[:, None] < cols))
+        return maybe & ~precedes
+
+
+class ScoreMatrixStore:
+    """Leitura e atualização incremental da matriz materializada"""
+
+    def __init__(self, session: Session, engine: ScoringEngine, prepare_female: Callable[[Female], Dict]):
+        self.session = session
+        self.engine = engine
+        self.calculator = engine.calculator
+        self.prepare_female = prepare_female
+
+    # ========================================================================
+    # ATUALIZAÇÃO
+    # ========================================================================
+
+    def refresh(self) -> Dict:
+        """Recalcula apenas linhas/colunas desatualizadas; retorna o que foi refeito"""
+        params_hash = self.calculator.params_fingerprint()
+        panel = get_bull_panel(self.session, self.engine)
+        panel_rows = {int(bull_id): row for row, bull_id in enumerate(panel.ids)}
+        bull_lineage = dict(zip(panel.ids.tolist(), self.lineage(panel.matrix.pedigree_id)))
+
+        # Colunas: touros novos ganham posição; alterados são recalculados; removidos saem
+        columns = {c.bull_id: c for c in self.session.query(MatingScoreColumn).all()}
+        bulls = dict(self.session.query(Bull.id, Bull.last_updated).all())
+        # Posições nunca são reaproveitadas (a linha de um touro removido só fica sem uso)
+        next_position = max((c.position for c in columns.values()), default=-1) + 1
+        removed_bulls = [bull_id for bull_id in columns if bull_id not in bulls or bull_id not in panel_rows]
+        for bull_id in removed_bulls:
+            self.session.delete(columns.pop(bull_id))
+
+        stale_bulls = []
+        for bull_id in sorted(bulls):
+            if bull_id not in panel_rows:
+                continue
+            column = columns.get(bull_id)
+            if column is None:
+                column = columns[bull_id] = MatingScoreColumn(bull_id=bull_id, position=next_position)
+                self.session.add(column)
+                next_position += 1
+            elif (column.bull_stamp, column.lineage_hash) == (bulls[bull_id], bull_lineage[bull_id]):
+                continue
+            stale_bulls.append(bull_id)
+
+        # Linhas: fêmeas sem linha, alteradas, calculadas com outros parâmetros ou outra ascendência
+        herd = self.session.query(Female.id, Female.last_updated, Female.reg_id, Female.internal_id).all()
+        lineage = self.lineage([_female_key(reg_id, internal_id) for _, _, reg_id, internal_id in herd])
+        females = {female_id: (stamp, params_hash, female_lineage)
+                   for (female_id, stamp, _, _), female_lineage in zip(herd, lineage)}
+        stored = {female_id: (stamp, stored_hash, stored_lineage)
+                  for female_id, stamp, stored_hash, stored_lineage in
+                  self.session.query(MatingScoreBlock.female_id, MatingScoreBlock.female_stamp,
+                                     MatingScoreBlock.params_hash, MatingScoreBlock.lineage_hash)
+                  .filter(MatingScoreBlock.block == 0)}
+        removed_females = [female_id for female_id in stored if female_id not in females]
+        stale_rows = [female_id for female_id, expected in females.items() if stored.get(female_id) != expected]
+        fresh_rows = [female_id for female_id, expected in females.items() if stored.get(female_id) == expected]
+
+        if removed_females or stale_rows:
+            self.session.query(MatingScoreBlock).filter(
+                MatingScoreBlock.female_id.in_(removed_females + stale_rows)
+            ).delete(synchronize_session=False)
+
+        positions = np.array([columns[int(bull_id)].position if int(bull_id) in columns else -1
+                              for bull_id in panel.ids], dtype=np.int64)
+        n_blocks = max(1, -(-next_position // BLOCK_SIZE))
+
+        for chunk in self._female_chunks(stale_rows):
+            self._write_rows(chunk, panel, positions, n_blocks, params_hash, females)
+
+        if stale_bulls and fresh_rows:
+            rows = np.array([panel_rows[bull_id] for bull_id in stale_bulls], dtype=np.int64)
+            for chunk in self._female_chunks(fresh_rows):
+                self._patch_columns(chunk, panel, rows, positions[rows], params_hash, females)
+
+        for bull_id in stale_bulls:
+            columns[bull_id].bull_stamp = bulls[bull_id]
+            columns[bull_id].lineage_hash = bull_lineage[bull_id]
+
+        self.session.commit()
+        return {
+            'rows_refreshed': len(stale_rows), 'columns_refreshed': len(stale_bulls),
+            'rows_removed': len(removed_females), 'columns_removed': len(removed_bulls),
+            'total_females': len(females), 'total_bulls': len(columns)
+        }
+
+    def lineage(self, keys: Sequence) -> List[Optional[str]]:
+        """Hash da ascendência de cada animal no pedigree do calculador (None sem pedigree)"""
+        pedigree = self.calculator.pedigree
+        if pedigree is None:
+            return [None] * len(keys)
+        return pedigree.lineage_hashes(keys)
+
+    def _female_chunks(self, female_ids: Sequence[int]):
+        for start in range(0, len(female_ids), REFRESH_CHUNK):
+            ids = female_ids[start:start + REFRESH_CHUNK]
+            females = self.session.query(Female).filter(Female.id.in_(ids)).order_by(Female.id).all()
+            yield females, [self.calculator.cached_record(female, self.prepare_female) for female in females]
+
+    def _score(self, records, bull_matrix):
+        scores = self.engine.score(self.engine.build_matrix(records), bull_matrix)
+        return scores.iep_normalized, scores.expected_inbreeding, scores.critical_haplotypes
+
+    def _write_rows(self, chunk, panel, positions: np.ndarray, n_blocks: int, params_hash: str,
+                    expected: Dict[int, tuple]):
+        """Linhas completas (todas as posições) das fêmeas do bloco"""
+        females, records = chunk
+        iep, inbreeding, lethal = self._score(records, panel.matrix)
+        width = n_blocks * BLOCK_SIZE
+        placed = positions >= 0
+
+        blocks = []
+        for i, female in enumerate(females):
+            row_iep = np.full(width, np.nan)
+            row_inb = np.full(width, np.nan)
+            row_lethal = np.zeros(width, dtype=bool)
+            row_iep[positions[placed]] = iep[i, placed]
+            row_inb[positions[placed]] = inbreeding[i, placed]
+            row_lethal[positions[placed]] = lethal[i, placed]
+            for block in range(n_blocks):
+                window = slice(block * BLOCK_SIZE, (block + 1) * BLOCK_SIZE)
+                blocks.append({
+                    'female_id': female.id, 'block': block, 'female_stamp': female.last_updated,
+                    'params_hash': params_hash, 'lineage_hash': expected[female.id][2],
+                    'iep': _encode(row_iep[window]),
+                    'inbreeding': _encode(row_inb[window]), 'lethal': np.packbits(row_lethal[window]).tobytes()
+                })
+        if blocks:
+            self.session.bulk_insert_mappings(MatingScoreBlock, blocks)
+
+    def _patch_columns(self, chunk, panel, rows: np.ndarray, positions: np.ndarray, params_hash: str,
+                       expected: Dict[int, tuple]):
+        """Recalcula só as colunas `rows` do painel nas linhas já existentes"""
+        females, records = chunk
+        iep, inbreeding, lethal = self._score(records, panel.matrix.take(rows))
+        touched = sorted(set((positions // BLOCK_SIZE).tolist()))
+
+        existing = {(b.female_id, b.block): b for b in self.session.query(MatingScoreBlock).filter(
+            MatingScoreBlock.female_id.in_([female.id for female in females]),
+            MatingScoreBlock.block.in_(touched)
+        )}
+        for i, female in enumerate(females):
+            for block in touched:
+                in_block = np.flatnonzero(positions // BLOCK_SIZE == block)
+                offsets = positions[in_block] % BLOCK_SIZE
+                entry = existing.get((female.id, block))
+                if entry is None:
+                    entry = MatingScoreBlock(female_id=female.id, block=block, female_stamp=female.last_updated,
+                                             params_hash=params_hash, lineage_hash=expected[female.id][2])
+                    self.session.add(entry)
+                block_iep, block_inb, block_lethal = _decode(entry.iep), _decode(entry.inbreeding), _decode_bits(entry.lethal)
+                block_iep[offsets] = iep[i, in_block]
+                block_inb[offsets] = inbreeding[i, in_block]
+                block_lethal[offsets] = lethal[i, in_block]
+                entry.iep, entry.inbreeding = _encode(block_iep), _encode(block_inb)
+                entry.lethal = np.packbits(block_lethal).tobytes()
+        self.session.flush()
+
+    # ========================================================================
+    # LEITURA
+    # ========================================================================
+
+    def read(self, females: Sequence[Female], bull_ids: Sequence[int]) -> Optional[MaterializedScores]:
+        """
+        Linhas das fêmeas para os touros pedidos, ou None se alguma linha/coluna
+        estiver ausente ou desatualizada - registro, parâmetros ou ascendência
+        (o chamador recalcula do zero)
+        """
+        params_hash = self.calculator.params_fingerprint()
+        bull_ids = np.asarray(bull_ids, dtype=np.int64)
+        columns = {bull_id: (position, stamp, lineage) for bull_id, position, stamp, lineage in self.session.query(
+            MatingScoreColumn.bull_id, MatingScoreColumn.position, MatingScoreColumn.bull_stamp,
+            MatingScoreColumn.lineage_hash)}
+        bulls = self.session.query(Bull.id, Bull.last_updated, Bull.code, Bull.naab_code) \
+            .filter(Bull.id.in_(bull_ids.tolist())).all()
+        lineage = self.lineage([_bull_key(code, naab_code) for _, _, code, naab_code in bulls])
+        current = {bull_id: (stamp, bull_lineage) for (bull_id, stamp, _, _), bull_lineage in zip(bulls, lineage)}
+
+        positions = np.empty(len(bull_ids), dtype=np.int64)
+        for j, bull_id in enumerate(bull_ids.tolist()):
+            column = columns.get(bull_id)
+            if column is None or column[1:] != current.get(bull_id):
+                return None
+            positions[j] = column[0]
+
+        blocks_needed = sorted(set((positions // BLOCK_SIZE).tolist()))
+        lineage = self.lineage([_female_key(female.reg_id, female.internal_id) for female in females])
+        expected = {female.id: (female.last_updated, params_hash, female_lineage)
+                    for female, female_lineage in zip(females, lineage)}
+        entries = {}
+        query = self.session.query(MatingScoreBlock).filter(MatingScoreBlock.female_id.in_(list(expected)))
+        if blocks_needed:
+            query = query.filter(MatingScoreBlock.block.in_(blocks_needed))
+        for entry in query:
+            if (entry.female_stamp, entry.params_hash, entry.lineage_hash) != expected[entry.female_id]:
+                return None
+            entries[(entry.female_id, entry.block)] = entry
+
+        n = len(females)
+        iep = np.empty((n, len(bull_ids)), dtype=np.float32)
+        inbreeding = np.empty((n, len(bull_ids)), dtype=np.float32)
+        lethal = np.empty((n, len(bull_ids)), dtype=bool)
+        for i, female in enumerate(females):
+            for block in blocks_needed:
+                entry = entries.get((female.id, block))
+                if entry is None:
+                    return None
+                in_block = np.flatnonzero(positions // BLOCK_SIZE == block)
+                offsets = positions[in_block] % BLOCK_SIZE
+                iep[i, in_block] = _decode(entry.iep)[offsets]
+                inbreeding[i, in_block] = _decode(entry.inbreeding)[offsets]
+                lethal[i, in_block] = _decode_bits(entry.lethal)[offsets]
+
+        if np.isnan(iep).any():
+            return None
+        return MaterializedScores(female_ids=[female.id for female in females], bull_ids=bull_ids,
+                                  iep=iep, inbreeding=inbreeding, lethal=lethal)
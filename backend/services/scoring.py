@@ -0,0 +1,450 @@
+"""
+Motor de Scoring Vetorizado (NumPy)
+
+Calcula, para todos os pares fêmea × touro de uma só vez:
+- PPPV ponderado por reliability
+- z-scores (com sinal invertido para índices negativos)
+- Scores por categoria e score base
+- Consanguinidade esperada e penalidade
+- IEP normalizado (0-100)
+
+Replica as regras de GeneticCalculator.calculate_economic_index, mas opera
+sobre matrizes (animais × características) em vez de dicts por par.
+"""
+
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+from dataclasses import dataclass, replace
+import numpy as np
+
+from backend.services.traits import TRAITS, TRAIT_POSITIONS
+from backend.services.pedigree import animal_key
+
+
+INBREEDING_METHODS = ('genomic', 'partial_genomic', 'pedigree', 'estimated')
+
+INBREEDING_RISKS = ('Baixo', 'Moderado', 'Alto', 'Crítico')
+
+
+def py_round(values: np.ndarray, ndigits: int) -> np.ndarray:
+    """np.round com o mesmo resultado do round() do Python (inclusive em empates)"""
+    scale = 10.0 ** ndigits
+    scaled = values * scale
+    rounded = np.round(scaled) / scale
+    # Empates aparentes (x.5 após a escala) são decididos pelo round() nativo
+    ties = np.isfinite(scaled) & (np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6)
+    if ties.any():
+        rounded[ties] = [round(float(v), ndigits) for v in values[ties]]
+    return rounded
+
+
+@dataclass
+class TraitMatrix:
+    """Características de um conjunto de animais em formato matricial"""
+
+    traits: Tuple[str, ...]
+    values: np.ndarray  # (N, T) - NaN = ausente
+    reliabilities: np.ndarray  # (N, T)
+    genomic_inbreeding: np.ndarray  # (N,) gINB (fêmeas) ou GFI (touros), NaN = ausente
+    carriers: np.ndarray  # (N,) int64 - bitmask de portador (bits de LETHAL_HAPLOTYPES)
+    own_code: np.ndarray  # (N,) object - código NAAB do próprio animal
+    sire_code: np.ndarray  # (N,) object
+    mgs_code: np.ndarray  # (N,) object
+    pedigree_id: np.ndarray  # (N,) object - alias do animal no pedigree (Pedigree)
+
+    def __len__(self) -> int:
+        return self.values.shape[0]
+
+    def take(self, rows) -> 'TraitMatrix':
+        """Subconjunto de linhas (índices ou máscara booleana)"""
+        return TraitMatrix(
+            traits=self.traits, values=self.values[rows],
+            reliabilities=self.reliabilities[rows],
+            genomic_inbreeding=self.genomic_inbreeding[rows],
+            carriers=self.carriers[rows], own_code=self.own_code[rows],
+            sire_code=self.sire_code[rows], mgs_code=self.mgs_code[rows],
+            pedigree_id=self.pedigree_id[rows]
+        )
+
+    def select_traits(self, traits: Sequence[str]) -> 'TraitMatrix':
+        """Subconjunto de colunas (características), na ordem pedida"""
+        positions = [self.traits.index(trait) for trait in traits]
+        return replace(self, traits=tuple(traits), values=self.values[:, positions],
+                       reliabilities=self.reliabilities[:, positions])
+
+
+def build_trait_matrix(calculator, animals: Sequence, traits: Sequence[str], is_bull: bool = False) -> TraitMatrix:
+    """Monta a matriz a partir dos registros canônicos (um TraitRecord por animal)"""
+    records = [calculator.as_record(data, is_bull=is_bull) for data in animals]
+    n = len(records)
+
+    all_values = np.array([record.values for record in records], dtype=float).reshape(n, len(TRAITS))
+    positions = [TRAIT_POSITIONS[trait] for trait in traits]
+    values = all_values[:, positions]
+    genomic = all_values[:, TRAIT_POSITIONS['gfi' if is_bull else 'genomic_inbreeding']]
+
+    # Reliabilities já resolvidas no registro (NaN = sem fonte -> padrão do calculador)
+    all_rel = np.array([record.reliabilities for record in records], dtype=float).reshape(n, len(TRAITS))
+    default_rel = calculator.params.default_bull_reliability if is_bull else calculator.params.default_cow_reliability
+    reliabilities = np.where(np.isnan(all_rel[:, positions]), default_rel, all_rel[:, positions])
+
+    carriers = np.array([record.carriers for record in records], dtype=np.int64).reshape(n)
+    own_code = np.empty(n, dtype=object)
+    sire_code = np.empty(n, dtype=object)
+    mgs_code = np.empty(n, dtype=object)
+    pedigree_id = np.empty(n, dtype=object)
+
+    for i, record in enumerate(records):
+        own_code[i] = record.get('naab_code') or None
+        sire_code[i] = record.get('sire_naab') or record.get('sire_reg') or None
+        mgs_code[i] = record.get('mgs_naab') or record.get('mgs_reg') or None
+        pedigree_id[i] = animal_key(record, is_bull=is_bull)
+
+    return TraitMatrix(
+        traits=tuple(traits), values=values, reliabilities=reliabilities,
+        genomic_inbreeding=genomic, carriers=carriers,
+        own_code=own_code, sire_code=sire_code, mgs_code=mgs_code, pedigree_id=pedigree_id
+    )
+
+
+def pair_pppv(females: TraitMatrix, bulls: TraitMatrix) -> Tuple[np.ndarray, np.ndarray]:
+    """(PPPV (F, B, T) ponderado por reliability e arredondado, presença (F, B, T) dos dois valores)"""
+    cow_value = females.values[:, None, :]
+    bull_value = bulls.values[None, :, :]
+    cow_rel = females.reliabilities[:, None, :]
+    bull_rel = bulls.reliabilities[None, :, :]
+    rel_sum = cow_rel + bull_rel
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pppv = np.where(rel_sum > 0, (bull_rel * bull_value + cow_rel * cow_value) / rel_sum, (bull_value + cow_value) / 2)
+    return py_round(pppv, 2), ~(np.isnan(cow_value) | np.isnan(bull_value))
+
+
+def expected_inbreeding(females: TraitMatrix, bulls: TraitMatrix, pedigree=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Consanguinidade esperada (%, sem arredondamento) e método usado para cada par.
+    Sem dados genômicos, usa a coancestria do pedigree (inclusive 0) para pares em que algum
+    dos animais tem pais conhecidos; a heurística pai/avô materno fica para os demais
+    (animais fora do pedigree ou dois animais sem pais conhecidos).
+    """
+    cow_ginb = females.genomic_inbreeding[:, None]
+    bull_gfi = bulls.genomic_inbreeding[None, :]
+    has_cow = ~np.isnan(cow_ginb)
+    has_bull = ~np.isnan(bull_gfi)
+    both = has_cow & has_bull
+    neither = ~(has_cow | has_bull)
+
+    pedigree_inb = 0.0
+    if neither.any():
+        pedigree_inb = _pedigree_inbreeding(females, bulls)
+        if pedigree is not None:
+            rows = np.flatnonzero(neither.any(axis=1))
+            cols = np.flatnonzero(neither.any(axis=0))
+            coancestry = pedigree.coancestry_matrix(females.pedigree_id[rows], bulls.pedigree_id[cols]) * 100
+            block = np.ix_(rows, cols)
+            pedigree_inb[block] = np.where(np.isnan(coancestry), pedigree_inb[block], coancestry)
+
+    expected = np.select(
+        [both, has_cow & ~has_bull, has_bull & ~has_cow],
+        [cow_ginb / 4 + bull_gfi / 2, cow_ginb / 4 + 4.0, bull_gfi / 2 + 3.0],
+        default=pedigree_inb
+    )
+    method = np.select([both, has_cow | has_bull], [0, 1], default=2)
+    return expected, method
+
+
+def _pedigree_inbreeding(females: TraitMatrix, bulls: TraitMatrix) -> np.ndarray:
+    """Versão vetorizada de GeneticCalculator._calculate_pedigree_inbreeding"""
+    codes = {}
+
+    def encode(column: np.ndarray) -> np.ndarray:
+        return np.array([codes.setdefault(code, len(codes)) if code else -1 for code in column], dtype=np.int64)
+
+    cow_sire = encode(females.sire_code)[:, None]
+    cow_mgs = encode(females.mgs_code)[:, None]
+    bull_own = encode(bulls.own_code)[None, :]
+    bull_sire = encode(bulls.sire_code)[None, :]
+    bull_mgs = encode(bulls.mgs_code)[None, :]
+
+    return np.select(
+        [
+            (cow_sire >= 0) & (cow_sire == bull_own),
+            (cow_mgs >= 0) & (cow_mgs == bull_own),
+            (cow_sire >= 0) & (cow_sire == bull_sire),
+            (cow_mgs >= 0) & (cow_mgs == bull_mgs),
+        ],
+        [25.0, 12.5, 12.5, 6.25],
+        default=4.0
+    )
+
+
+def bull_coancestry(bulls: TraitMatrix, pedigree=None) -> np.ndarray:
+    """
+    (B, B) coancestria touro × touro (fração): pedigree para pares com ascendência conhecida
+    (inclusive 0), senão pai/avô materno em comum como em _pedigree_inbreeding (sem o valor
+    de fundo, que só desloca a coancestria média). Diagonal = (1 + F) / 2, com F do GFI ou do pedigree.
+    """
+    codes = {}
+
+    def encode(column: np.ndarray) -> np.ndarray:
+        return np.array([codes.setdefault(code, len(codes)) if code else -1 for code in column], dtype=np.int64)
+
+    def same(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        return (a[:, None] >= 0) & (a[:, None] == b[None, :])
+
+    own, sire, mgs = encode(bulls.own_code), encode(bulls.sire_code), encode(bulls.mgs_code)
+    parent = same(own, sire) | same(sire, own)
+    grandparent = same(own, mgs) | same(mgs, own)
+    coancestry = np.select(
+        [parent, grandparent | same(sire, sire), same(mgs, mgs)],
+        [0.25, 0.125, 0.0625], default=0.0
+    )
+
+    inbreeding = bulls.genomic_inbreeding / 100
+    if pedigree is not None and len(bulls):
+        related = pedigree.coancestry_matrix(bulls.pedigree_id, bulls.pedigree_id)
+        coancestry = np.where(np.isnan(related), coancestry, related)
+        own_inbreeding = np.array([pedigree.inbreeding_of(key) if key else None for key in bulls.pedigree_id], dtype=float)
+        inbreeding = np.where(np.isnan(inbreeding), own_inbreeding, inbreeding)
+    np.fill_diagonal(coancestry, (1 + np.nan_to_num(inbreeding)) / 2)
+    return coancestry
+
+
+def eligible_pairs(females: TraitMatrix, bulls: TraitMatrix, max_inbreeding: float, pedigree=None) -> np.ndarray:
+    """
+    (F, B) bool - pares que sobrevivem ao pré-filtro: consanguinidade esperada
+    (arredondada como em calculate_inbreeding) <= max_inbreeding e sem haplótipo letal
+    """
+    expected, _ = expected_inbreeding(females, bulls, pedigree)
+    return (py_round(expected, 2) <= max_inbreeding) & ~lethal_pairs(females, bulls)
+
+
+def lethal_pairs(females: TraitMatrix, bulls: TraitMatrix) -> np.ndarray:
+    """(F, B) bool - pares portador × portador do mesmo haplótipo letal (AND de bitmasks)"""
+    return (females.carriers[:, None] & bulls.carriers[None, :]) != 0
+
+
+@dataclass
+class ScoreMatrices:
+    """Resultado do scoring de F fêmeas × B touros"""
+
+    traits: Tuple[str, ...]
+    categories: Tuple[str, ...]
+    active_categories: Tuple[str, ...]  # categorias com peso, na ordem dos pesos
+    pppv: Optional[np.ndarray]  # (F, B, T) - NaN onde o par não tem o índice (None após compact())
+    z_scores: Optional[np.ndarray]  # (F, B, T) - já com sinal dos índices negativos (None após compact())
+    category_scores: np.ndarray  # (F, B, C)
+    base_score: np.ndarray  # (F, B)
+    expected_inbreeding: np.ndarray  # (F, B)
+    inbreeding_method: np.ndarray  # (F, B) índice em INBREEDING_METHODS
+    inbreeding_risk: np.ndarray  # (F, B) índice em INBREEDING_RISKS
+    inbreeding_penalty: np.ndarray  # (F, B)
+    critical_haplotypes: np.ndarray  # (F, B) bool - portador × portador
+    iep_raw: np.ndarray  # (F, B)
+    iep_normalized: np.ndarray  # (F, B)
+    reliability: np.ndarray  # (F, B)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.iep_normalized.shape
+
+    def rank_row(self, row: int, top_n: int = 10, max_inbreeding: float = 8.0,
+                 values: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Índices dos touros ranqueados para a fêmea `row` (mesma ordem de rank_bulls_for_female).
+        `values` (B,) ordena por outro critério (ex.: índice personalizado); NaN fica de fora.
+        """
+        allowed = (self.expected_inbreeding[row] <= max_inbreeding) & ~self.critical_haplotypes[row]
+        if values is None:
+            values = py_round(self.iep_normalized[row], 1)
+        else:
+            allowed &= ~np.isnan(values)
+        eligible = np.flatnonzero(allowed)
+        order = np.argsort(-values[eligible], kind='stable')
+        return eligible[order[:top_n]]
+
+    def compact(self) -> 'ScoreMatrices':
+        """Só os componentes necessários para re-ponderar e ranquear (sem as matrizes por característica)"""
+        return replace(self, pppv=None, z_scores=None)
+
+    def category_dict(self, row: int, col: int) -> Dict[str, float]:
+        """Scores por categoria de um par, como em rank_bulls_for_female"""
+        positions = {cat: c for c, cat in enumerate(self.categories)}
+        return {cat: round(float(self.category_scores[row, col, positions[cat]]), 3) for cat in self.active_categories}
+
+
+class ScoringEngine:
+    """Motor vetorizado do IEP para lotes fêmea × touro"""
+
+    def __init__(self, calculator):
+        self.calculator = calculator
+        params = calculator.params
+
+        self.traits = tuple(dict.fromkeys(idx for weights in params.index_weights.values() for idx in weights))
+        self.categories = tuple(params.index_weights.keys())
+
+        trait_pos = {trait: t for t, trait in enumerate(self.traits)}
+        self._category_terms = [
+            [(trait_pos[index], weight) for index, weight in params.index_weights[category].items()]
+            for category in self.categories
+        ]
+        self.index_weights = np.zeros((len(self.traits), len(self.categories)))
+        for c, terms in enumerate(self._category_terms):
+            for t, weight in terms:
+                self.index_weights[t, c] = weight
+
+        self.signs = np.array([-1.0 if trait in params.negative_indices else 1.0 for trait in self.traits])
+
+        stats = [calculator.population_stats.get(trait, {'mean': 0, 'std': 1}) for trait in self.traits]
+        self.means = np.array([s['mean'] for s in stats], dtype=float)
+        stds = np.array([s['std'] for s in stats], dtype=float)
+        # std == 0 -> z = 0 (divisão por infinito)
+        self.stds = np.where(stds == 0, np.inf, stds)
+
+    # ========================================================================
+    # CONSTRUÇÃO DE MATRIZES
+    # ========================================================================
+
+    def build_matrix(self, animals: Sequence[Dict], is_bull: bool = False) -> TraitMatrix:
+        return build_trait_matrix(self.calculator, animals, self.traits, is_bull=is_bull)
+
+    def category_weight_vector(self, custom_weights: Optional[Dict] = None) -> Tuple[np.ndarray, Tuple[str, ...]]:
+        """Vetor de pesos alinhado a self.categories + categorias ativas"""
+        weights = custom_weights or self.calculator.params.category_weights
+        vector = np.zeros(len(self.categories))
+        active = []
+        for category, weight in weights.items():
+            if category not in self.categories:
+                continue
+            vector[self.categories.index(category)] = float(weight)
+            active.append(category)
+        return vector, tuple(active)
+
+    # ========================================================================
+    # SCORING
+    # ========================================================================
+
+    def score(self, females: TraitMatrix, bulls: TraitMatrix, custom_weights: Optional[Dict] = None) -> ScoreMatrices:
+        """Calcula todas as métricas do IEP para todos os pares em uma única passada"""
+        params = self.calculator.params
+        cat_weights, active = self.category_weight_vector(custom_weights)
+
+        pppv, present = pair_pppv(females, bulls)
+        rel_sum = females.reliabilities[:, None, :] + bulls.reliabilities[None, :, :]
+
+        z_scores = np.where(present, (pppv - self.means) / self.stds * self.signs, 0.0)
+
+        # Acumulação na mesma ordem do cálculo escalar (resultados idênticos)
+        category_scores = np.zeros(z_scores.shape[:2] + (len(self.categories),))
+        for c, terms in enumerate(self._category_terms):
+            for t, weight in terms:
+                category_scores[:, :, c] += weight * z_scores[:, :, t]
+
+        base_score = self._base_score(category_scores, cat_weights, active)
+
+        raw_inbreeding, method = expected_inbreeding(females, bulls, self.calculator.pedigree)
+        rounded_inbreeding = py_round(raw_inbreeding, 2)
+        risk = np.select(
+            [raw_inbreeding < params.inbreeding_ideal, raw_inbreeding < params.inbreeding_acceptable,
+             raw_inbreeding < params.inbreeding_warning],
+            [0, 1, 2], default=3
+        )
+        excess = rounded_inbreeding - params.inbreeding_ideal
+        inbreeding_penalty = np.where(excess > 0, params.inbreeding_penalty_lambda * excess, 0.0)
+
+        iep_raw = base_score - inbreeding_penalty
+        iep_normalized = self._normalize(iep_raw)
+
+        combined_rel = np.where(present, py_round(rel_sum / 4 + 25, 1), 0.0)
+        n_present = present.sum(axis=2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            reliability = np.where(n_present > 0, combined_rel.sum(axis=2) / n_present, 50.0)
+
+        critical = lethal_pairs(females, bulls)
+
+        return ScoreMatrices(
+            traits=self.traits, categories=self.categories, active_categories=active,
+            pppv=np.where(present, pppv, np.nan), z_scores=z_scores,
+            category_scores=category_scores, base_score=base_score,
+            expected_inbreeding=rounded_inbreeding, inbreeding_method=method, inbreeding_risk=risk,
+            inbreeding_penalty=inbreeding_penalty, critical_haplotypes=critical,
+            iep_raw=iep_raw, iep_normalized=iep_normalized, reliability=py_round(reliability, 1)
+        )
+
+    def reweight(self, scores: ScoreMatrices, custom_weights: Optional[Dict] = None) -> ScoreMatrices:
+        """
+        IEP com outros pesos de categoria a partir dos componentes de um scoring anterior:
+        produto scores por categoria × pesos, menos a penalidade, com o mesmo clamp
+        (sem reler características nem recalcular PPPV/z-scores)
+        """
+        cat_weights, active = self.category_weight_vector(custom_weights)
+        base_score = self._base_score(scores.category_scores, cat_weights, active)
+        iep_raw = base_score - scores.inbreeding_penalty
+        return replace(scores, active_categories=active, base_score=base_score,
+                       iep_raw=iep_raw, iep_normalized=self._normalize(iep_raw))
+
+    def profile_weights(self, profiles: Sequence[Optional[Dict]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Matriz K × C dos perfis de peso, em ordem de acumulação: (categorias (K, J), pesos (K, J)),
+        J = máximo de categorias ativas; perfis com menos categorias completam com peso 0
+        """
+        columns = []
+        for weights in profiles:
+            vector, active = self.category_weight_vector(weights)
+            columns.append([(self.categories.index(category), vector[self.categories.index(category)]) for category in active])
+        width = max((len(terms) for terms in columns), default=0)
+        order = np.zeros((len(profiles), width), dtype=np.int64)
+        weights = np.zeros((len(profiles), width))
+        for k, terms in enumerate(columns):
+            for j, (c, weight) in enumerate(terms):
+                order[k, j], weights[k, j] = c, weight
+        return order, weights
+
+    def reweight_profiles(self, scores: ScoreMatrices, profiles: Sequence[Optional[Dict]]) -> np.ndarray:
+        """
+        IEP normalizado (K, F, B) de K perfis de peso numa passada sobre os mesmos scores por
+        categoria; cada perfil acumula na ordem de suas categorias (idêntico a reweight)
+        """
+        order, weights = self.profile_weights(profiles)
+        base_score = np.zeros((len(profiles),) + scores.shape)
+        for j in range(order.shape[1]):
+            # (F, B, K) -> (K, F, B): categoria j de cada perfil × seu peso
+            base_score += np.moveaxis(scores.category_scores[:, :, order[:, j]], 2, 0) * weights[:, j, None, None]
+        return self._normalize(base_score - scores.inbreeding_penalty)
+
+    def _base_score(self, category_scores: np.ndarray, cat_weights: np.ndarray, active: Tuple[str, ...]) -> np.ndarray:
+        """(F, B, C) × (C,) - acumulado na ordem das categorias ativas, como no cálculo escalar"""
+        base_score = np.zeros(category_scores.shape[:2])
+        for category in active:
+            c = self.categories.index(category)
+            base_score += category_scores[:, :, c] * cat_weights[c]
+        return base_score
+
+    @staticmethod
+    def _normalize(iep_raw: np.ndarray) -> np.ndarray:
+        return np.clip(50 + iep_raw * 15, 0, 100)
+
+    def iter_scores(self, females: TraitMatrix, bulls: TraitMatrix, custom_weights: Optional[Dict] = None,
+                    chunk_size: int = 64) -> Iterator[Tuple[int, ScoreMatrices]]:
+        """Scoring em blocos de fêmeas para limitar memória em rebanhos grandes"""
+        for start in range(0, len(females), chunk_size):
+            rows = slice(start, start + chunk_size)
+            yield start, self.score(females.take(rows), bulls, custom_weights)
+
+    def iter_eligible_scores(self, females: TraitMatrix, bulls: TraitMatrix, max_inbreeding: float,
+                             custom_weights: Optional[Dict] = None, chunk_size: int = 64,
+                             candidates: Optional[np.ndarray] = None) -> Iterator[Tuple[int, np.ndarray, ScoreMatrices]]:
+        """
+        Scoring em blocos de fêmeas com pré-filtro de consanguinidade/haplótipos:
+        cada bloco só calcula o IEP dos touros elegíveis para alguma de suas fêmeas.
+        `candidates` (F, B) restringe ainda mais os pares (ex.: matriz materializada).
+
+        Gera (início do bloco, colunas de `bulls` pontuadas, ScoreMatrices dessas colunas).
+        """
+        for start in range(0, len(females), chunk_size):
+            rows = slice(start, start + chunk_size)
+            chunk = females.take(rows)
+            eligible = eligible_pairs(chunk, bulls, max_inbreeding, self.calculator.pedigree)
+            if candidates is not None:
+                eligible &= candidates[rows]
+            cols = np.flatnonzero(eligible.any(axis=0))
+            yield start, cols, self.score(chunk, bulls.take(cols), custom_weights)
@@ -0,0 +1,133 @@
+"""
+Busca por Similaridade de Touros ("touros parecidos com este")
+
+Índice k-NN sobre os vetores de características padronizados dos touros:
+- vetor = z-score de cada característica (colunas de Bull + genetic_data, já
+  resolvidas no TraitRecord) pelas estatísticas populacionais do calculador;
+  ausente = 0 (média da população)
+- as estatísticas populacionais são arredondadas e estáveis entre importações
+  (population.py): cada linha só depende do próprio touro, então o índice é
+  atualizado de forma incremental — ao mudar a versão do catálogo só as linhas
+  de touros novos/alterados (last_updated) são recalculadas
+- consulta por força bruta com BLAS: d² = |x|² - 2 x·q + |q|², restrita às
+  características presentes no touro de referência e aos touros que passam nos
+  filtros (beta-caseína, central, teto de GFI, disponibilidade, estoque)
+"""
+
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass
+import threading
+import numpy as np
+
+from backend.services.cache import fingerprint
+
+
+# Características fora do vetor de similaridade (consanguinidade é filtro, não perfil)
+EXCLUDED_TRAITS = ('genomic_inbreeding', 'gfi')
+
+# Maiores diferenças (em desvios padrão) listadas por vizinho
+TOP_DIFFERENCES = 3
+
+
+@dataclass
+class SimilarityIndex:
+    """Matriz (B, D) de z-scores alinhada às linhas do painel de touros"""
+
+    panel_version: int
+    stats_key: str  # fingerprint das estatísticas usadas (mudou = reconstrução completa)
+    traits: Tuple[str, ...]
+    ids: np.ndarray  # (B,) int
+    stamps: np.ndarray  # (B,) object - last_updated de cada touro
+    vectors: np.ndarray  # (B, D) z-scores (0 = ausente)
+    present: np.ndarray  # (B, D) bool
+    rebuilt_rows: int = 0  # linhas recalculadas na última sincronização
+
+    @classmethod
+    def build(cls, panel, stats: Dict, previous: Optional['SimilarityIndex'] = None) -> 'SimilarityIndex':
+        """
+        Índice do painel atual. Com `previous` (mesmas estatísticas), reaproveita as linhas dos
+        touros cujo last_updated não mudou e recalcula só as demais.
+        """
+        stats_key = fingerprint(stats)
+        if previous is not None and previous.stats_key == stats_key:
+            traits = previous.traits
+        else:
+            previous = None
+            traits = tuple(trait for trait in panel.catalog.traits
+                           if trait in stats and trait not in EXCLUDED_TRAITS and stats[trait].get('std'))
+
+        n, d = len(panel), len(traits)
+        vectors = np.zeros((n, d))
+        present = np.zeros((n, d), dtype=bool)
+        stale = np.ones(n, dtype=bool)
+
+        if previous is not None and len(previous.ids):
+            old_row = {int(bull_id): row for row, bull_id in enumerate(previous.ids)}
+            reuse = [(row, old_row.get(int(bull_id))) for row, bull_id in enumerate(panel.ids)]
+            reuse = [(row, old) for row, old in reuse
+                     if old is not None and previous.stamps[old] == panel.stamps[row]]
+            if reuse:
+                rows, olds = map(np.array, zip(*reuse))
+                vectors[rows] = previous.vectors[olds]
+                present[rows] = previous.present[olds]
+                stale[rows] = False
+
+        rows = np.flatnonzero(stale)
+        if len(rows) and d:
+            values = panel.catalog.select_traits(traits).values[rows]
+            means = np.array([stats[trait]['mean'] for trait in traits], dtype=float)
+            stds = np.array([stats[trait]['std'] for trait in traits], dtype=float)
+            present[rows] = ~np.isnan(values)
+            vectors[rows] = np.where(present[rows], (values - means) / stds, 0.0)
+
+        return cls(panel_version=panel.version, stats_key=stats_key, traits=traits,
+                   ids=panel.ids.copy(), stamps=panel.stamps.copy(), vectors=vectors,
+                   present=present, rebuilt_rows=len(rows))
+
+    def neighbors(self, row: int, k: int, candidates: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (linhas, distância RMS em desvios padrão, características comparadas) dos k touros de
+        `candidates` mais próximos da linha `row`, nas características presentes nela
+        """
+        dims = np.flatnonzero(self.present[row])
+        candidates = candidates[candidates != row]
+        if not len(dims) or not len(candidates) or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0), dims
+
+        query = self.vectors[row, dims]
+        block = self.vectors[np.ix_(candidates, dims)]
+        squared = np.einsum('ij,ij->i', block, block) - 2 * (block @ query) + query @ query
+        distance = np.sqrt(np.maximum(squared, 0.0) / len(dims))
+
+        k = min(k, len(candidates))
+        nearest = np.argpartition(distance, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+        nearest = nearest[np.lexsort((candidates[nearest], distance[nearest]))]
+        return candidates[nearest], distance[nearest], dims
+
+    def differences(self, row: int, other: int, dims: np.ndarray, top: int = TOP_DIFFERENCES) -> List[Dict]:
+        """Características em que `other` mais difere de `row` (em desvios padrão)"""
+        delta = self.vectors[other, dims] - self.vectors[row, dims]
+        order = np.argsort(-np.abs(delta), kind='stable')[:top]
+        return [{'trait': self.traits[dims[i]], 'z_difference': round(float(delta[i]), 2)} for i in order]
+
+
+# ============================================================================
+# CACHE POR PROCESSO
+# ============================================================================
+
+_lock = threading.Lock()
+_index: Optional[SimilarityIndex] = None
+
+
+def get_similarity_index(panel, stats: Dict) -> SimilarityIndex:
+    """Índice do painel atual; sincronizado (incrementalmente) quando o painel ou as estatísticas mudam"""
+    global _index
+
+    index = _index
+    if index is not None and index.panel_version == panel.version and index.stats_key == fingerprint(stats):
+        return index
+
+    with _lock:
+        if _index is None or _index.panel_version != panel.version or _index.stats_key != fingerprint(stats):
+            _index = SimilarityIndex.build(panel, stats, _index)
+        return _index
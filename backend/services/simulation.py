@@ -0,0 +1,212 @@
+"""
+Simulação Monte Carlo de Progênie
+
+Sorteia vetores de características correlacionados para a progênie de muitos
+acasalamentos de uma vez:
+- média = PPPV ponderado por reliability (como em calculate_pppv)
+- desvio = Mendelian sampling (mesma variância de calculate_pppv, herdabilidades
+  e variâncias de population_stats)
+- correlação entre características = correlações genéticas dos parâmetros
+
+Os sorteios normais (draws × características) são gerados uma vez por semente e
+compartilhados por todos os pares (números aleatórios comuns): o resultado de um
+par não depende dos demais nem do tamanho do bloco, e os quantis saem exatos da
+transformação afim. As probabilidades de excedência são avaliadas em blocos de
+pares para limitar a memória.
+"""
+
+from typing import Dict, Optional, Sequence, Tuple
+from dataclasses import dataclass
+import numpy as np
+
+from backend.services.scoring import TraitMatrix
+
+
+# Elementos (pares × sorteios) avaliados por bloco nas probabilidades
+CHUNK_ELEMENTS = 4_000_000
+
+MAX_DRAWS = 100_000
+
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+CONDITION_OPERATORS = {
+    '>': np.greater, '>=': np.greater_equal,
+    '<': np.less, '<=': np.less_equal,
+}
+
+
+def correlation_matrix(traits: Sequence[str], correlations: Dict[Tuple[str, str], float]) -> np.ndarray:
+    """Matriz de correlação (T, T) das características, ajustada para ser positiva definida"""
+    positions = {trait: t for t, trait in enumerate(traits)}
+    matrix = np.eye(len(traits))
+    for (a, b), r in correlations.items():
+        if a in positions and b in positions and a != b:
+            matrix[positions[a], positions[b]] = matrix[positions[b], positions[a]] = r
+
+    # Correlações da literatura combinadas nem sempre são consistentes: corta autovalores negativos
+    eigenvalues, eigenvectors = np.linalg.eigh(matrix)
+    if eigenvalues.min() < 1e-6:
+        matrix = eigenvectors @ np.diag(np.maximum(eigenvalues, 1e-6)) @ eigenvectors.T
+        scale = np.sqrt(np.diag(matrix))
+        matrix = matrix / np.outer(scale, scale)
+    return matrix
+
+
+@dataclass
+class Condition:
+    """Condição de excedência sobre uma característica (ex.: net_merit > 800)"""
+
+    trait: str
+    op: str
+    value: float
+
+    @property
+    def label(self) -> str:
+        return f'{self.trait} {self.op} {self.value:g}'
+
+    @classmethod
+    def parse(cls, data: Dict) -> 'Condition':
+        if not isinstance(data, dict):
+            raise ValueError(f"Condição inválida: {data!r} (use {{'trait', 'op', 'value'}})")
+        trait, op = data.get('trait'), data.get('op', '>')
+        if op not in CONDITION_OPERATORS:
+            raise ValueError(f"Operador inválido: {op}")
+        try:
+            value = float(data.get('value'))
+        except (TypeError, ValueError):
+            raise ValueError(f"Valor inválido para {trait}: {data.get('value')}")
+        return cls(trait=trait, op=op, value=value)
+
+
+@dataclass
+class SimulationResult:
+    """Resultado da simulação de F fêmeas × B touros"""
+
+    traits: Tuple[str, ...]
+    conditions: Tuple[Condition, ...]
+    quantile_levels: Tuple[float, ...]
+    draws: int
+    seed: Optional[int]
+    mean: np.ndarray  # (F, B, T) - NaN onde o par não tem a característica
+    std: np.ndarray  # (F, B, T) - desvio do Mendelian sampling
+    quantiles: np.ndarray  # (F, B, Q, T)
+    probabilities: np.ndarray  # (F, B, K) - uma coluna por condição
+    joint_probability: np.ndarray  # (F, B) - todas as condições ao mesmo tempo
+
+    def pair_dict(self, row: int, col: int) -> Dict:
+        """Resumo de um par (valores ausentes = None)"""
+        def value(x, ndigits):
+            return None if np.isnan(x) else round(float(x), ndigits)
+
+        traits = {}
+        for t, trait in enumerate(self.traits):
+            traits[trait] = {
+                'mean': value(self.mean[row, col, t], 2), 'std': value(self.std[row, col, t], 2),
+                'quantiles': {f'p{round(q * 100):02d}': value(self.quantiles[row, col, k, t], 2)
+                              for k, q in enumerate(self.quantile_levels)}
+            }
+
+        joint = self.joint_probability[row, col]
+        return {
+            'traits': traits,
+            'probabilities': {cond.label: value(self.probabilities[row, col, k], 4) for k, cond in enumerate(self.conditions)},
+            'joint_probability': value(joint, 4),
+            'std_error': None if np.isnan(joint) else round(float(np.sqrt(joint * (1 - joint) / self.draws)), 4)
+        }
+
+
+class OffspringSimulator:
+    """Simulação vetorizada e com semente da progênie de acasalamentos"""
+
+    def __init__(self, calculator, chunk_elements: int = CHUNK_ELEMENTS):
+        self.calculator = calculator
+        self.chunk_elements = chunk_elements
+
+    def offspring_distribution(self, females: TraitMatrix, bulls: TraitMatrix) -> Tuple[np.ndarray, np.ndarray]:
+        """(média, desvio) (F, B, T) da progênie, com as mesmas fórmulas de calculate_pppv"""
+        params = self.calculator.params
+        cow_value, bull_value = females.values[:, None, :], bulls.values[None, :, :]
+        cow_rel, bull_rel = females.reliabilities[:, None, :], bulls.reliabilities[None, :, :]
+        rel_sum = cow_rel + bull_rel
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(rel_sum > 0, (bull_rel * bull_value + cow_rel * cow_value) / rel_sum, (bull_value + cow_value) / 2)
+
+        h2 = np.array([params.heritabilities.get(trait, 0.25) for trait in females.traits])
+        variance = np.array([self.calculator._get_variance(trait) for trait in females.traits])
+        msv = 0.5 * (1 - 0.5 * rel_sum / 200) * h2 * variance
+        std = np.sqrt(np.maximum(msv, 0.0))
+        return mean, np.where(np.isnan(mean), np.nan, std)
+
+    def sample(self, traits: Sequence[str], draws: int, seed: Optional[int] = None) -> np.ndarray:
+        """(draws, T) sorteios normais padrão correlacionados (compartilhados por todos os pares)"""
+        correlation = correlation_matrix(traits, self.calculator.params.genetic_correlations)
+        rng = np.random.default_rng(seed)
+        return rng.standard_normal((draws, len(traits))) @ np.linalg.cholesky(correlation).T
+
+    @staticmethod
+    def _z_threshold(mean: np.ndarray, std: np.ndarray, cond: Condition) -> np.ndarray:
+        """Limiar da condição na escala de z (desvio zero: ±inf conforme a média atende ou não)"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            threshold = (cond.value - mean) / std
+        holds = CONDITION_OPERATORS[cond.op](mean, cond.value)
+        upper = cond.op in ('>', '>=')
+        return np.where(std > 0, threshold, np.where(holds == upper, -np.inf, np.inf))
+
+    def simulate(self, females: TraitMatrix, bulls: TraitMatrix, conditions: Sequence[Condition] = (),
+                 quantiles: Sequence[float] = DEFAULT_QUANTILES, draws: int = 10000,
+                 seed: Optional[int] = None) -> SimulationResult:
+        """Simula a progênie de todos os pares fêmea × touro (matrizes com as mesmas características)"""
+        traits = females.traits
+        positions = {trait: t for t, trait in enumerate(traits)}
+        for cond in conditions:
+            if cond.trait not in positions:
+                raise ValueError(f"Característica da condição não simulada: {cond.trait}")
+        if not 0 < draws <= MAX_DRAWS:
+            raise ValueError(f"draws deve estar entre 1 e {MAX_DRAWS}")
+        if seed is not None and (isinstance(seed, bool) or not isinstance(seed, (int, np.integer)) or seed < 0):
+            raise ValueError(f"seed deve ser um inteiro não negativo: {seed!r}")
+
+        mean, std = self.offspring_distribution(females, bulls)
+        z = self.sample(traits, draws, seed)
+        n_females, n_bulls = mean.shape[:2]
+
+        # Quantis: x = média + desvio * z é afim e crescente em z
+        levels = np.asarray(quantiles, dtype=float)
+        z_quantiles = np.quantile(z, levels, axis=0) if len(levels) else np.empty((0, len(traits)))
+        pair_quantiles = mean[:, :, None, :] + std[:, :, None, :] * z_quantiles
+
+        # Probabilidades de excedência em blocos de pares (memória ~ bloco × draws). Cada
+        # condição vira um limiar em z: x > c  <=>  z > (c - média) / desvio
+        flat_mean = mean.reshape(-1, len(traits))
+        flat_std = std.reshape(-1, len(traits))
+        n_pairs = flat_mean.shape[0]
+        probabilities = np.full((n_pairs, len(conditions)), np.nan)
+        joint = np.full(n_pairs, np.nan)
+        thresholds = [self._z_threshold(flat_mean[:, positions[cond.trait]], flat_std[:, positions[cond.trait]], cond)
+                      for cond in conditions]
+        columns = [np.ascontiguousarray(z[:, positions[cond.trait]]) for cond in conditions]
+        block = max(1, self.chunk_elements // draws)
+
+        for start in range(0, n_pairs if conditions else 0, block):
+            rows = slice(start, start + block)
+            hits_all = None
+            for k, cond in enumerate(conditions):
+                hits = CONDITION_OPERATORS[cond.op](columns[k][None, :], thresholds[k][rows, None])
+                probabilities[rows, k] = np.count_nonzero(hits, axis=1) / draws
+                hits_all = hits if hits_all is None else np.logical_and(hits_all, hits, out=hits_all)
+            joint[rows] = np.count_nonzero(hits_all, axis=1) / draws
+
+        # Pares sem alguma característica das condições não têm probabilidade
+        if conditions:
+            condition_traits = [positions[cond.trait] for cond in conditions]
+            missing = np.isnan(flat_mean[:, condition_traits])
+            probabilities[missing] = np.nan
+            joint[missing.any(axis=1)] = np.nan
+
+        return SimulationResult(
+            traits=tuple(traits), conditions=tuple(conditions), quantile_levels=tuple(levels.tolist()),
+            draws=draws, seed=seed, mean=mean, std=std, quantiles=pair_quantiles,
+            probabilities=probabilities.reshape(n_females, n_bulls, len(conditions)),
+            joint_probability=joint.reshape(n_females, n_bulls)
+        )
@@ -0,0 +1,47 @@
+"""
+Fronteira de Pareto (skyline) de Touros
+
+Um touro domina outro se é pelo menos tão bom em todos os objetivos e melhor
+em algum. A fronteira são os touros não dominados.
+
+Sort-filter-skyline (SFS): os pontos são pré-ordenados por uma função monótona
+(soma dos postos de cada objetivo); nessa ordem, nenhum ponto pode dominar um
+anterior, então cada ponto só é comparado (vetorizado) com a janela da fronteira
+já aceita e a janela nunca encolhe.
+"""
+
+from typing import Tuple
+import numpy as np
+
+
+def _dense_ranks(column: np.ndarray) -> np.ndarray:
+    """Posto denso (valores iguais, mesmo posto; -inf = pior)"""
+    return np.unique(column, return_inverse=True)[1].reshape(-1)
+
+
+def pareto_front(values: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    (índices não dominados na ordem da pré-ordenação, comparações feitas) de `values` (N, M),
+    todos os objetivos a maximizar; NaN = pior valor possível no objetivo
+    """
+    n = len(values)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), 0
+    values = np.where(np.isnan(values), -np.inf, values)
+
+    # Soma dos postos: se p domina q, soma(p) > soma(q) (função estritamente monótona)
+    score = sum(_dense_ranks(values[:, m]) for m in range(values.shape[1]))
+    order = np.lexsort((np.arange(n), -score))
+
+    window = np.empty_like(values)
+    front = []
+    comparisons = 0
+    for i in order:
+        point = values[i]
+        accepted = window[:len(front)]
+        comparisons += len(front)
+        if len(front) and np.any(np.all(accepted >= point, axis=1) & np.any(accepted > point, axis=1)):
+            continue
+        window[len(front)] = point
+        front.append(i)
+    return np.array(front, dtype=np.int64), comparisons
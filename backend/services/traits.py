@@ -0,0 +1,299 @@
+"""
+Registros Canônicos de Características
+
+Normaliza um animal (dict de fêmea/touro) UMA vez em um TraitRecord:
+- posições fixas para cada característica (TRAITS)
+- valores já convertidos para float (NaN = ausente)
+- reliabilities resolvidas uma única vez (JSON decodificado uma vez por animal)
+- haplótipos letais codificados como bitmask inteiro (portador / livre)
+- sem busca por aliases nem try/except no caminho quente do calculador
+"""
+
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+from array import array
+import threading
+import json
+import math
+
+
+# Ordem canônica das características (posição fixa em TraitRecord.values)
+TRAITS = (
+    'milk', 'protein', 'fat', 'fat_percent', 'protein_percent',
+    'net_merit', 'cheese_merit', 'fluid_merit', 'grazing_merit', 'tpi',
+    'ptat', 'udc', 'flc', 'bwc',
+    'productive_life', 'scs', 'cow_livability', 'heifer_livability',
+    'dpr', 'hcr', 'ccr', 'fertility_index', 'early_first_calving',
+    'mastitis', 'metritis', 'retained_placenta', 'displaced_abomasum', 'ketosis', 'milk_fever',
+    'sire_calving_ease', 'daughter_calving_ease', 'sire_stillbirth', 'daughter_stillbirth', 'gestation_length',
+    'feed_saved', 'rfi', 'milking_speed',
+    'genomic_inbreeding', 'gfi',
+)
+
+TRAIT_POSITIONS = {trait: pos for pos, trait in enumerate(TRAITS)}
+
+# Haplótipos letais (bit i de TraitRecord.carriers / TraitRecord.free)
+LETHAL_HAPLOTYPES = ('hh1', 'hh2', 'hh3', 'hh4', 'hh5', 'hh6', 'ah1', 'ah2', 'jh1', 'jh2', 'bh1', 'bh2')
+
+HAPLOTYPE_BITS = {hap: 1 << bit for bit, hap in enumerate(LETHAL_HAPLOTYPES)}
+
+# Nomes alternativos usados em planilhas/PDFs
+TRAIT_ALIASES = {
+    'genomic_inbreeding': ['genomic_inbreeding', 'gINB', 'ginb', 'gInb'],
+    'gfi': ['gfi', 'GFI', 'genomic_future_inbreeding'],
+    'productive_life': ['productive_life', 'PRODUCTIVE LIFE', 'PL'],
+    'fertility_index': ['fertility_index', 'FERTILITY INDEX', 'FI'],
+    'scs': ['scs', 'SCS', 'SOMATIC CELL SCORE'],
+    'dpr': ['dpr', 'DPR', 'DAUGHTER PREGNANCY RATE'],
+    'hcr': ['hcr', 'HCR', 'HEIFER CONCEPTION RATE'],
+    'ccr': ['ccr', 'CCR', 'COW CONCEPTION RATE'],
+}
+
+
+def resolve_trait_value(data: Dict, index: str) -> Optional[float]:
+    """Busca um índice no dict (topo, main_indices, genetic_data) testando aliases"""
+    keys_to_try = TRAIT_ALIASES.get(index, [index, index.upper(), index.lower()])
+
+    for key in keys_to_try:
+        value = data.get(key)
+        if value is not None:
+            try:
+                return float(value)
+            except (ValueError, TypeError):
+                pass
+
+    for source in ['main_indices', 'genetic_data']:
+        source_data = data.get(source, {})
+        if isinstance(source_data, dict):
+            for key in keys_to_try:
+                value = source_data.get(key)
+                if value is not None:
+                    try:
+                        return float(value)
+                    except (ValueError, TypeError):
+                        pass
+
+    return None
+
+
+def _valid_reliability(value) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        val = float(value)
+    except (ValueError, TypeError):
+        return None
+    return val if 0 <= val <= 100 else None
+
+
+def _daughters_reliability(data: Dict) -> Optional[float]:
+    """Reliability inferida pelo número de filhas (apenas touros)"""
+    daughters = data.get('daughters') or data.get('num_daughters')
+    if daughters:
+        try:
+            d = int(daughters)
+            if d >= 1000: return 99.0
+            elif d >= 500: return 95.0
+            elif d >= 100: return 85.0
+            elif d >= 50: return 80.0
+            elif d > 0: return 75.0
+        except (ValueError, TypeError):
+            pass
+    return None
+
+
+def _reliability_sources(data: Dict, is_bull: bool) -> Tuple[Dict, Dict, Optional[float]]:
+    """(reliabilities decodificado, genetic_data, reliability por filhas)"""
+    reliabilities = data.get('reliabilities', {})
+    if isinstance(reliabilities, str):
+        try:
+            reliabilities = json.loads(reliabilities)
+        except (ValueError, TypeError):
+            reliabilities = {}
+    if not isinstance(reliabilities, dict):
+        reliabilities = {}
+
+    genetic = data.get('genetic_data', {})
+    if not isinstance(genetic, dict):
+        genetic = {}
+
+    return reliabilities, genetic, _daughters_reliability(data) if is_bull else None
+
+
+def resolve_reliability(data: Dict, index: str, is_bull: bool = False, sources=None) -> Optional[float]:
+    """
+    Reliability de um índice (None se nenhuma fonte tiver valor):
+    1. campo `<index>_rel`  2. JSON reliabilities  3. genetic_data  4. filhas (touros)
+    """
+    rel_key = f'{index}_rel'
+
+    val = _valid_reliability(data.get(rel_key))
+    if val is not None:
+        return val
+
+    reliabilities, genetic, inferred = sources or _reliability_sources(data, is_bull)
+
+    val = _valid_reliability(reliabilities.get(rel_key) or reliabilities.get(index))
+    if val is not None:
+        return val
+
+    for key in (rel_key, f'{index.upper()}_REL', f'{index} REL'):
+        val = _valid_reliability(genetic.get(key))
+        if val is not None:
+            return val
+
+    return inferred
+
+
+def resolve_reliabilities(data: Dict, is_bull: bool = False) -> array:
+    """Vetor denso de reliabilities alinhado a TRAITS (NaN = usar o padrão)"""
+    sources = _reliability_sources(data, is_bull)
+    return array('d', (_nan_if_none(resolve_reliability(data, trait, is_bull, sources)) for trait in TRAITS))
+
+
+def _decode_haplotypes(data: Dict) -> Dict:
+    haplotypes = data.get('haplotypes', {})
+    if isinstance(haplotypes, str):
+        try:
+            haplotypes = json.loads(haplotypes)
+        except (ValueError, TypeError):
+            haplotypes = {}
+    return haplotypes if isinstance(haplotypes, dict) else {}
+
+
+def resolve_haplotype_status(data: Dict, haplotype: str, haplotypes: Optional[Dict] = None) -> str:
+    """
+    'Carrier', 'Free' ou 'Unknown' para um haplótipo, procurando no topo do dict,
+    em genetic_data e no campo haplotypes (JSON)
+    """
+    for key in [haplotype, haplotype.upper(), haplotype.lower()]:
+        value = data.get(key)
+        if value is not None:
+            if isinstance(value, str):
+                if value.upper() in ['T', 'F', 'FREE', 'TESTED FREE']:
+                    return 'Free'
+                elif value.upper() in ['C', 'CARRIER']:
+                    return 'Carrier'
+            elif isinstance(value, (int, float)):
+                return 'Free' if value == 0 else 'Carrier'
+
+    genetic = data.get('genetic_data', {})
+    if isinstance(genetic, dict):
+        for key in [haplotype, haplotype.upper()]:
+            value = genetic.get(key)
+            if value is not None:
+                if str(value).upper() in ['T', 'F', 'FREE']:
+                    return 'Free'
+                elif str(value).upper() in ['C', 'CARRIER']:
+                    return 'Carrier'
+
+    if haplotypes is None:
+        haplotypes = _decode_haplotypes(data)
+    value = haplotypes.get(haplotype) or haplotypes.get(haplotype.upper())
+    if value:
+        if str(value).upper() in ['T', 'F', 'FREE', 'TESTED FREE']:
+            return 'Free'
+        elif str(value).upper() in ['C', 'CARRIER']:
+            return 'Carrier'
+
+    return 'Unknown'
+
+
+def resolve_haplotype_masks(data: Dict) -> Tuple[int, int]:
+    """(bitmask de portador, bitmask de livre) sobre LETHAL_HAPLOTYPES"""
+    haplotypes = _decode_haplotypes(data)
+    carriers = free = 0
+    for hap, bit in HAPLOTYPE_BITS.items():
+        status = resolve_haplotype_status(data, hap, haplotypes)
+        if status == 'Carrier':
+            carriers |= bit
+        elif status == 'Free':
+            free |= bit
+    return carriers, free
+
+
+class TraitRecord:
+    """Animal normalizado: valores e reliabilities por posição fixa + dict original para metadados"""
+
+    __slots__ = ('data', 'values', 'reliabilities', 'carriers', 'free', 'is_bull')
+
+    def __init__(self, data: Dict, is_bull: bool = False):
+        self.data = data
+        self.is_bull = is_bull
+        self.values = array('d', (_nan_if_none(resolve_trait_value(data, trait)) for trait in TRAITS))
+        self.reliabilities = resolve_reliabilities(data, is_bull)
+        self.carriers, self.free = resolve_haplotype_masks(data)
+
+    def value(self, pos: int) -> Optional[float]:
+        """Valor na posição `pos` (None se ausente)"""
+        value = self.values[pos]
+        return None if value != value else value
+
+    def reliability(self, pos: int) -> Optional[float]:
+        """Reliability na posição `pos` (None se nenhuma fonte informou)"""
+        value = self.reliabilities[pos]
+        return None if value != value else value
+
+    def haplotype_status(self, haplotype: str) -> str:
+        """Status de um haplótipo letal a partir dos bitmasks"""
+        bit = HAPLOTYPE_BITS[haplotype.lower()]
+        if self.carriers & bit:
+            return 'Carrier'
+        return 'Free' if self.free & bit else 'Unknown'
+
+    def get(self, key: str, default=None):
+        """Acesso aos demais campos (id, código, pedigree, haplótipos...)"""
+        return self.data.get(key, default)
+
+    def __repr__(self):
+        return f"<TraitRecord {self.data.get('code') or self.data.get('reg_id') or self.data.get('id')}>"
+
+
+def _nan_if_none(value: Optional[float]) -> float:
+    return math.nan if value is None else value
+
+
+def as_record(data, is_bull: bool = False) -> TraitRecord:
+    """Normaliza um dict em TraitRecord (registros já normalizados são reaproveitados)"""
+    if isinstance(data, TraitRecord):
+        return data
+    return TraitRecord(data, is_bull=is_bull)
+
+
+class RecordCache:
+    """
+    Cache LRU de TraitRecords por animal.
+
+    A chave é (tipo, id) e o registro só é reaproveitado enquanto o carimbo
+    (last_updated) for o mesmo; qualquer alteração no animal gera um novo registro.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._entries: 'OrderedDict[Tuple, Tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple, stamp, build) -> TraitRecord:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        record = build()
+        with self._lock:
+            self._entries[key] = (stamp, record)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return record
+
+    def invalidate(self, key: Optional[Tuple] = None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -6,9 +6,13 @@ Importa TODAS as 165 colunas do Excel para o banco de dados
 import pandas as pd
 import sqlite3
 from datetime import datetime
+from types import SimpleNamespace
 import json
 import sys
 
+from backend.services.matching import MatchingService
+from backend.services.population import record_changes_in
+
 # Configurações
 EXCEL_PATH = 'uploads/Females All List - 2025-11-03.xlsx'
 DB_PATH = 'database/cattle_breeding.db'
@@ -217,8 +221,16 @@ def process_genotypes(row):
     return genotypes
 
 
-def import_female(row, cursor):
-    """Importa uma fêmea"""
+def trait_values(cursor, female_id):
+    """Valores das características da fêmea gravada (mesma extração da API)"""
+    cursor.execute("SELECT * FROM females WHERE id = ?", (female_id,))
+    female = SimpleNamespace(**dict(zip([column[0] for column in cursor.description], cursor.fetchone())))
+    female.genetic_data = json.loads(female.genetic_data) if female.genetic_data else {}
+    return MatchingService(None).trait_values(female, is_bull=False)
+
+
+def import_female(row, cursor, population_changes):
+    """Importa uma fêmea; (valores antigos, novos) vão para `population_changes`"""
     reg_id = safe_str(row.get('REG ID'))
 
     if not reg_id:
@@ -276,8 +288,10 @@ def import_female(row, cursor):
         set_clause = ', '.join([f"{k} = ?" for k in data.keys()])
         values = list(data.values()) + [female_id]
 
+        old_values = trait_values(cursor, female_id)
         sql = f"UPDATE females SET {set_clause} WHERE id = ?"
         cursor.execute(sql, values)
+        population_changes.append((old_values, trait_values(cursor, female_id)))
 
         return True, f"Atualizada: {reg_id}"
     else:
@@ -291,10 +305,24 @@ def import_female(row, cursor):
 
         sql = f"INSERT INTO females ({columns}) VALUES ({placeholders})"
         cursor.execute(sql, values)
+        population_changes.append((None, trait_values(cursor, cursor.lastrowid)))
 
         return True, f"Inserida: {reg_id}"
 
 
+def bump_catalog_version(cursor, name):
+    """Incrementa a versão de um catálogo (invalida caches da API, ex.: pedigree)"""
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS catalog_versions "
+        "(name VARCHAR(50) PRIMARY KEY, version INTEGER NOT NULL, updated_at DATETIME)"
+    )
+    cursor.execute("INSERT OR IGNORE INTO catalog_versions (name, version) VALUES (?, 0)", (name,))
+    cursor.execute(
+        "UPDATE catalog_versions SET version = version + 1, updated_at = ? WHERE name = ?",
+        (datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f'), name)
+    )
+
+
 def run_import():
     """Executa importação completa"""
     print("=" * 70)
@@ -331,10 +359,11 @@ def run_import():
     }
 
     errors = []
+    population_changes = []
 
     for idx, row in df.iterrows():
         try:
-            success, message = import_female(row, cursor)
+            success, message = import_female(row, cursor, population_changes)
 
             if success:
                 if 'Inserida' in message:
@@ -356,10 +385,13 @@ def run_import():
             if len(errors) < 10:
                 errors.append(f"Linha {idx + 1}: {str(e)}")
 
-    # Commit
+    # Commit (incrementa a versão de fêmeas para a API sincronizar o pedigree em cache)
     try:
+        bump_catalog_version(cursor, 'females')
         conn.commit()
         print(f"\n[OK] Dados salvos com sucesso!")
+        # Momentos do rebanho atualizados só com as fêmeas gravadas (sem reconstrução)
+        record_changes_in(f'sqlite:///{DB_PATH}', 'herd', population_changes)
     except Exception as e:
         conn.rollback()
         print(f"\n[ERRO] Falha ao salvar: {e}")
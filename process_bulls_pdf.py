@@ -23,8 +23,12 @@ import sys
 import sqlite3
 from pathlib import Path
 from datetime import datetime
+from types import SimpleNamespace
 from typing import Dict, List, Optional, Any, Tuple
 
+from backend.services.matching import MatchingService
+from backend.services.population import record_changes_in
+
 
 class UniversalBullParser:
     """Parser universal para PDFs de touros - captura qualquer formato"""
@@ -473,6 +477,7 @@ class BullDatabaseManager:
     
     def __init__(self, db_path: str):
         self.db_path = db_path
+        self.population_changes = []  # (valores antigos, novos) para as estatísticas do catálogo
         self._ensure_columns()
     
     def _ensure_columns(self):
@@ -527,6 +532,7 @@ class BullDatabaseManager:
         
         cursor.execute("SELECT id FROM bulls WHERE code = ?", (code,))
         existing = cursor.fetchone()
+        old_values = self._trait_values(cursor, code) if existing else None
         
         bull_copy = bull.copy()
         
@@ -557,21 +563,48 @@ class BullDatabaseManager:
             cursor.execute(f"INSERT INTO bulls ({col_names}) VALUES ({placeholders})", values)
             result = True
         
+        self.population_changes.append((old_values, self._trait_values(cursor, code)))
+        self._bump_catalog_version(cursor)
         conn.commit()
         conn.close()
         return result
     
+    def _trait_values(self, cursor, code: str):
+        """Valores das características do touro gravado (mesma extração da API)"""
+        cursor.execute("SELECT * FROM bulls WHERE code = ?", (code,))
+        bull = SimpleNamespace(**dict(zip([column[0] for column in cursor.description], cursor.fetchone())))
+        for column in ('genetic_data', 'haplotypes'):
+            value = getattr(bull, column, None)
+            if isinstance(value, str):
+                setattr(bull, column, json.loads(value) if value else None)
+        return MatchingService(None).trait_values(bull, is_bull=True)
+    
+    def _bump_catalog_version(self, cursor):
+        """Incrementa a versão do catálogo de touros (invalida o painel em cache da API)"""
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS catalog_versions "
+            "(name VARCHAR(50) PRIMARY KEY, version INTEGER NOT NULL, updated_at DATETIME)"
+        )
+        cursor.execute("INSERT OR IGNORE INTO catalog_versions (name, version) VALUES ('bulls', 0)")
+        cursor.execute(
+            "UPDATE catalog_versions SET version = version + 1, updated_at = ? WHERE name = 'bulls'",
+            (datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f'),)
+        )
+    
     def upsert_bulls(self, bulls: List[Dict[str, Any]]) -> Dict[str, int]:
         """Insere ou atualiza múltiplos touros"""
         inserted = 0
         updated = 0
         
+        self.population_changes = []
         for bull in bulls:
             if self.upsert_bull(bull):
                 inserted += 1
             else:
                 updated += 1
         
+        # Momentos do catálogo atualizados só com os touros gravados (sem reconstrução)
+        record_changes_in(f'sqlite:///{self.db_path}', 'bulls', self.population_changes)
         return {'inserted': inserted, 'updated': updated}
     
     def get_bull_count(self) -> int:
@@ -0,0 +1,75 @@
+"""
+Fixtures: banco SQLite temporário por teste e caches por processo zerados
+"""
+
+import pytest
+from flask import Flask
+from sqlalchemy.orm import sessionmaker
+
+from backend.api import routes
+from backend.models.database import Bull, Female, init_database, get_session
+from backend.services import matching, panels, population, similarity
+from backend.services.genetics import genetic_calculator
+from backend.services.pedigree import invalidate_pedigree
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    """As versões de catálogo recomeçam em cada banco: nenhum cache pode sobreviver entre testes"""
+    def reset():
+        panels._panel = panels._herd = None
+        matching._context = None
+        population._cached = None
+        similarity._index = None
+        invalidate_pedigree()
+        genetic_calculator.invalidate_animals('bull')
+        genetic_calculator.invalidate_animals('female')
+    reset()
+    yield
+    reset()
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    return f"sqlite:///{tmp_path / 'test.db'}"
+
+
+@pytest.fixture
+def engine(db_url):
+    return init_database(db_url)
+
+
+@pytest.fixture
+def session(engine):
+    db = get_session(engine)
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def client(engine, monkeypatch):
+    """Cliente HTTP das rotas /api ligado ao banco temporário"""
+    monkeypatch.setattr(routes, '_engine', engine)
+    monkeypatch.setattr(routes, '_SessionLocal', sessionmaker(bind=engine))
+    app = Flask(__name__)
+    app.register_blueprint(routes.api)
+    return app.test_client()
+
+
+def add_bull(session, code, **values):
+    """Touro do catálogo (disponível) com os índices informados"""
+    values.setdefault('naab_code', code)
+    values.setdefault('is_available', True)
+    bull = Bull(code=code, name=f'Touro {code}', **values)
+    session.add(bull)
+    session.commit()
+    return bull
+
+
+def add_female(session, reg_id, **values):
+    """Fêmea ativa do rebanho com os índices informados"""
+    values.setdefault('is_active', True)
+    female = Female(reg_id=reg_id, name=f'Vaca {reg_id}', **values)
+    session.add(female)
+    session.commit()
+    return female
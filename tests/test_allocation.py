@@ -0,0 +1,60 @@
+"""
+Alocação de touros: ótimo do fluxo de custo mínimo igual à força bruta em casos pequenos
+"""
+
+import itertools
+
+import numpy as np
+import pytest
+
+from backend.services.allocation import solve_allocation
+
+
+def brute_force(values, capacities):
+    """Maior valor total testando toda atribuição (touro ou nenhum) de cada fêmea"""
+    n_females, n_bulls = values.shape
+    best = 0.0
+    for choice in itertools.product(range(-1, n_bulls), repeat=n_females):
+        usage = np.bincount([b for b in choice if b >= 0], minlength=n_bulls)
+        if (usage > capacities).any():
+            continue
+        pairs = [values[f, b] for f, b in enumerate(choice) if b >= 0]
+        if any(np.isnan(pairs)):
+            continue
+        best = max(best, sum(pairs))
+    return best
+
+
+def total_value(values, capacities, assignment):
+    assigned = np.flatnonzero(assignment >= 0)
+    usage = np.bincount(assignment[assigned], minlength=values.shape[1])
+    assert (usage <= capacities).all()
+    pairs = values[assigned, assignment[assigned]]
+    assert not np.isnan(pairs).any()
+    return pairs.sum()
+
+
+@pytest.mark.parametrize('seed', range(25))
+def test_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    n_females, n_bulls = rng.integers(1, 7), rng.integers(1, 4)
+    values = np.round(rng.normal(5, 10, size=(n_females, n_bulls)))  # inteiros, inclusive negativos
+    values[rng.random(values.shape) < 0.2] = np.nan  # pares proibidos
+    capacities = rng.integers(0, 3, size=n_bulls)
+
+    assignment, _ = solve_allocation(values, capacities)
+    assert total_value(values, capacities, assignment) == brute_force(values, capacities)
+
+
+def test_negative_pairs_stay_unassigned():
+    values = np.array([[-1.0, -5.0], [3.0, np.nan]])
+    assignment, _ = solve_allocation(values, np.array([1, 1]))
+    assert assignment.tolist() == [-1, 0]
+
+
+def test_full_bull_displaces_along_path():
+    # Fêmea 1 só aceita o touro 0; a fêmea 0 precisa ser deslocada para o touro 1
+    values = np.array([[10.0, 9.0], [8.0, np.nan]])
+    assignment, paths = solve_allocation(values, np.array([1, 1]))
+    assert assignment.tolist() == [1, 0]
+    assert paths > 0
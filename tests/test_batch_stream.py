@@ -0,0 +1,40 @@
+"""
+Lote em NDJSON: uma linha por fêmea e a linha final de resumo igual ao lote comum
+"""
+
+import json
+
+from tests.conftest import add_bull, add_female
+
+
+def build_herd(session):
+    females = [add_female(session, f'COW{k}', milk=250.0 * k, net_merit=90.0 * k, productive_life=0.4 * k)
+               for k in range(1, 6)]
+    for k in range(1, 5):
+        add_bull(session, f'7HO0000{k}', milk=400.0 * k, net_merit=150.0 * k, productive_life=0.8 * k, gfi=5.0 + k)
+    return [female.id for female in females]
+
+
+def test_stream_has_one_line_per_female_then_summary(session, client):
+    female_ids = build_herd(session)
+    body = {'female_ids': female_ids[::-1], 'top_n': 3, 'max_inbreeding': 20.0}
+
+    response = client.post('/api/matings/batch', json={**body, 'stream': True})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert len(lines) == len(female_ids) + 1
+    assert sorted(line['female']['id'] for line in lines[:-1]) == female_ids
+    assert all(len(line['top_bulls']) == 3 for line in lines[:-1])
+    assert list(lines[-1]) == ['summary']
+
+    batch = client.post('/api/matings/batch', json=body).get_json()
+    assert lines[:-1] == batch['results']
+    assert lines[-1]['summary'] == batch['summary']
+
+
+def test_stream_rejects_save(session, client):
+    female_ids = build_herd(session)
+    response = client.post('/api/matings/batch', json={'female_ids': female_ids, 'stream': True, 'save': True})
+    assert response.status_code == 400
@@ -0,0 +1,79 @@
+"""
+Ranking reverso: melhores fêmeas para um touro na mesma ordem do cálculo escalar, paginado,
+só com fêmeas ativas e acompanhando o rebanho
+"""
+
+import pytest
+
+from backend.services.matching import MatchingService
+from tests.conftest import add_bull, add_female
+
+
+@pytest.fixture
+def herd(session):
+    females = [add_female(session, f'COW{k}', milk=120.0 * ((k * 7) % 11), net_merit=60.0 * ((k * 5) % 9),
+                          productive_life=0.3 * (k % 4), genomic_inbreeding=3.0 + (k % 6))
+               for k in range(1, 13)]
+    females[3].is_active = False
+    session.commit()
+    bull = add_bull(session, '7HO00001', milk=600.0, net_merit=300.0, productive_life=2.0, gfi=5.0)
+    add_bull(session, '7HO00002', milk=200.0, net_merit=100.0)
+    return females, bull
+
+
+def scalar_ranking(service, females, bull, max_inbreeding):
+    """Fêmeas ativas pontuadas uma a uma, ordenadas como rank_row (score arredondado, empate pela ordem)"""
+    bull_data = service._prepare_bull_data(bull)
+    scored = []
+    for female in females:
+        if not female.is_active:
+            continue
+        result = service.calculator.calculate_economic_index(service._prepare_female_data(female), bull_data)
+        if result['inbreeding']['expected_inbreeding'] <= max_inbreeding:
+            scored.append((female.id, result['iep_normalized']))
+    return sorted(scored, key=lambda item: -item[1])
+
+
+def test_order_matches_scalar_ranking(session, herd):
+    females, bull = herd
+    service = MatchingService(session)
+    result = service.best_females_for_bull(bull.code, per_page=50, max_inbreeding=4.0)
+
+    expected = scalar_ranking(service, females, bull, 4.0)
+    assert 0 < len(expected) < len(females) - 1  # o limite de consanguinidade excluiu alguém
+    assert [(item['female']['id'], item['score']) for item in result['females']] == expected
+    assert [item['rank'] for item in result['females']] == list(range(1, len(expected) + 1))
+    assert result['total_females'] == len(females) - 1
+    assert result['eligible_females'] == len(expected)
+
+
+def test_pages_split_the_top_n(session, herd):
+    _, bull = herd
+    service = MatchingService(session)
+    full = service.best_females_for_bull(bull.code, per_page=50, top_n=8, max_inbreeding=10.0)['females']
+    pages = [service.best_females_for_bull(bull.code, page=page, per_page=3, top_n=8, max_inbreeding=10.0)
+             for page in (1, 2, 3)]
+
+    assert len(full) == 8
+    assert pages[0]['total_pages'] == 3
+    assert [item for page in pages for item in page['females']] == full
+
+
+def test_herd_changes_are_picked_up(session, herd):
+    _, bull = herd
+    service = MatchingService(session)
+    before = service.best_females_for_bull(bull.code, per_page=50, max_inbreeding=10.0)
+    best = add_female(session, 'COW99', milk=2000.0, net_merit=900.0, productive_life=4.0, genomic_inbreeding=2.0)
+
+    after = service.best_females_for_bull(bull.code, per_page=50, max_inbreeding=10.0)
+    assert after['total_females'] == before['total_females'] + 1
+    assert after['females'][0]['female']['id'] == best.id
+
+
+def test_unknown_bull_and_bad_page(session, herd):
+    _, bull = herd
+    service = MatchingService(session)
+    with pytest.raises(ValueError):
+        service.best_females_for_bull('7HO99999')
+    with pytest.raises(ValueError):
+        service.best_females_for_bull(bull.code, page=0)
@@ -0,0 +1,70 @@
+"""
+Memoização por par: chave por versão dos animais/parâmetros e invalidação por animal
+"""
+
+from backend.services.cache import PairCache, fingerprint
+from backend.services.matching import MatchingService
+from tests.conftest import add_bull, add_female
+
+
+def test_invalidate_drops_only_entries_of_that_animal():
+    cache = PairCache()
+    cache.store('a', [('female', 1), ('bull', 10)], {'iep': 1})
+    cache.store('b', [('female', 2), ('bull', 10)], {'iep': 2})
+    cache.store('c', [('female', 1), ('bull', None)], {'iep': 3})  # depende de todos os touros
+
+    cache.invalidate('female', [1])
+    assert cache.lookup('a') is None and cache.lookup('c') is None
+    assert cache.lookup('b') == {'iep': 2}
+
+    cache.invalidate('bull', [99])  # entradas com ('bull', None) também caem
+    assert cache.lookup('b') == {'iep': 2}
+    cache.invalidate('bull', [10])
+    assert len(cache) == 0
+
+
+def test_lookup_returns_independent_copies_and_lru_evicts():
+    cache = PairCache(maxsize=2)
+    cache.store('a', [], {'values': [1]})
+    cache.lookup('a')['values'].append(2)
+    assert cache.lookup('a') == {'values': [1]}
+
+    cache.store('b', [], 2)
+    cache.lookup('a')  # 'a' fica mais recente que 'b'
+    cache.store('c', [], 3)
+    assert cache.lookup('b') is None
+    assert cache.lookup('a') == {'values': [1]} and cache.lookup('c') == 3
+
+
+def test_fingerprint_is_order_independent():
+    assert fingerprint({'a': 1, 'b': [1, 2]}) == fingerprint({'b': [1, 2], 'a': 1})
+    assert fingerprint({'a': 1}) != fingerprint({'a': 2})
+    assert fingerprint(None) == fingerprint({}) == ''
+
+
+def test_match_single_recomputes_only_after_animal_changes(session):
+    female = add_female(session, 'COW1', milk=500.0, net_merit=300.0, genomic_inbreeding=6.0)
+    other = add_female(session, 'COW2', milk=900.0, net_merit=500.0, genomic_inbreeding=5.0)
+    bull = add_bull(session, '7HO00001', milk=1200.0, net_merit=700.0, gfi=8.0)
+    service = MatchingService(session)
+    pairs = service.calculator.pairs
+
+    first = service.match_single(female.id, bull.id)
+    service.match_single(other.id, bull.id)
+    hits = pairs.hits
+    assert service.match_single(female.id, bull.id) == first
+    assert pairs.hits == hits + 1
+
+    # Só a fêmea alterada é recalculada (last_updated muda a chave); a outra continua em cache
+    female.milk = 2500.0
+    session.commit()
+    changed = service.match_single(female.id, bull.id)
+    assert changed['analysis'] != first['analysis']
+    hits = pairs.hits
+    service.match_single(other.id, bull.id)
+    assert pairs.hits == hits + 1
+
+    service.calculator.invalidate_animals('female', [other.id])
+    hits = pairs.hits
+    service.match_single(other.id, bull.id)
+    assert pairs.hits == hits
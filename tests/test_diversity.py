@@ -0,0 +1,108 @@
+"""
+Top N com diversidade: limites por pai/MGS respeitados (com e sem penalidade de coancestria),
+pool da penalidade ampliado quando os limites o esgotam e paridade escalar × vetorizado
+"""
+
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from backend.services.diversity import (PENALTY_POOL, DiversityRule, LineageIndex, diverse_top, penalty_pool,
+                                        pool_coancestry)
+from backend.services.genetics import GeneticCalculator
+from backend.services.matching import MatchingService
+from backend.services.scoring import ScoringEngine
+from tests.conftest import add_bull, add_female
+from tests.test_scoring import make_animals
+
+SIRES = ('7HO00101', '7HO00102', '7HO00103', '7HO00104')
+MGS = ('7HO00201', '7HO00202', '7HO00203')
+
+
+def lineage_of(sires, mgs):
+    codes = np.array(list(sires), dtype=object), np.array(list(mgs), dtype=object)
+    encode = lambda column: np.array([{code: k for k, code in enumerate(dict.fromkeys(column))}[code] for code in column])
+    return LineageIndex(sire=encode(codes[0]), mgs=encode(codes[1]), sire_code=codes[0], mgs_code=codes[1])
+
+
+def assert_caps(items, max_per_sire, max_per_mgs):
+    sires = Counter(item['lineage']['sire'] for item in items if item['lineage']['sire'])
+    mgs = Counter(item['lineage']['mgs'] for item in items if item['lineage']['mgs'])
+    assert max(sires.values(), default=0) <= max_per_sire
+    assert max(mgs.values(), default=0) <= max_per_mgs
+
+
+@pytest.mark.parametrize('penalty', [0.0, 2.0])
+def test_penalty_pool_is_refilled_when_caps_exhaust_it(penalty):
+    top_n = 3
+    # Os PENALTY_POOL × N melhores são todos filhos do mesmo pai; os demais, de pais diferentes
+    n_same = top_n * PENALTY_POOL
+    sires = ['7HO00101'] * n_same + [f'7HO009{k:02d}' for k in range(6)]
+    lineage = lineage_of(sires, [f'7HO008{k:02d}' for k in range(len(sires))])
+    order = np.arange(len(sires))
+    values = np.linspace(90, 60, len(sires))
+    requested = []
+
+    def coancestry(cols):
+        requested.append(len(cols))
+        return np.full((len(cols), len(cols)), 0.05)
+
+    rule = DiversityRule(max_per_sire=1, coancestry_penalty=penalty)
+    chosen = diverse_top(order, values, lineage, rule, top_n, coancestry)
+
+    assert chosen.tolist() == [0, n_same, n_same + 1]
+    if penalty:
+        assert requested[0] == n_same and requested[-1] > n_same
+
+
+def test_penalty_stops_when_order_runs_out():
+    lineage = lineage_of(['7HO00101'] * 5, ['7HO00201'] * 5)
+    rule = DiversityRule(max_per_sire=2, coancestry_penalty=1.0)
+    chosen = diverse_top(np.arange(5), np.arange(5.0)[::-1], lineage, rule, 4,
+                         lambda cols: np.zeros((len(cols), len(cols))))
+    assert chosen.tolist() == [0, 1]
+
+
+@pytest.mark.parametrize('penalty', [0.0, 3.0])
+def test_batch_caps_hold(session, penalty):
+    rng = np.random.default_rng(9)
+    females = [add_female(session, f'COW{k}', milk=float(rng.normal(300, 200)), net_merit=float(rng.normal(200, 100)),
+                          genomic_inbreeding=4.0) for k in range(1, 5)]
+    for k in range(1, 31):
+        add_bull(session, f'7HO{k:05d}', milk=float(rng.normal(500, 300)), net_merit=float(rng.normal(300, 150)),
+                 gfi=5.0, genetic_data={'sire_naab': SIRES[k % 2 if k <= 20 else k % 4],
+                                        'mgs_naab': MGS[k % 3]})
+    service = MatchingService(session)
+    diversity = {'max_per_sire': 2, 'max_per_mgs': 3, 'coancestry_penalty': penalty}
+
+    result = service.match_batch([female.id for female in females], max_inbreeding=10.0, top_n=8,
+                                 detail='summary', diversity=diversity)
+    for item in result['results']:
+        assert len(item['top_bulls']) == 8
+        assert_caps(item['top_bulls'], 2, 3)
+
+
+@pytest.mark.parametrize('penalty', [0.0, 1.5])
+def test_diverse_top_matches_scalar_ranking(penalty):
+    calculator = GeneticCalculator()
+    rng = np.random.default_rng(21)
+    females = make_animals(rng, 4, False, calculator.iep_indices)
+    bulls = make_animals(rng, 40, True, calculator.iep_indices)
+    for k, bull in enumerate(bulls):
+        bull['sire_naab'] = SIRES[k % len(SIRES)] if k < 30 else SIRES[0]
+        bull['mgs_naab'] = MGS[k % len(MGS)]
+    rule = {'max_per_sire': 1, 'max_per_mgs': 2, 'coancestry_penalty': penalty}
+
+    engine = ScoringEngine(calculator)
+    bull_matrix = engine.build_matrix(bulls, is_bull=True)
+    scores = engine.score(engine.build_matrix(females), bull_matrix)
+    lineage = LineageIndex.build(bull_matrix)
+    parsed = DiversityRule.parse(rule)
+    for i, female in enumerate(females):
+        scalar = calculator.rank_bulls_for_female(female, bulls, top_n=6, max_inbreeding=8.0,
+                                                  include_analysis=False, diversity=rule)
+        order = scores.rank_row(i, len(bulls), 8.0)
+        coancestry = pool_coancestry(bull_matrix, [penalty_pool(order, 6)])
+        vector = diverse_top(order, np.round(scores.iep_normalized[i], 1), lineage, parsed, 6, coancestry)
+        assert [item['bull']['id'] for item in scalar] == [bulls[col]['id'] for col in vector]
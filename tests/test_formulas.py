@@ -0,0 +1,79 @@
+"""
+Índices personalizados: validação da AST e avaliação vetorizada
+"""
+
+import numpy as np
+import pytest
+
+from backend.services.formulas import compile_formula
+
+
+@pytest.mark.parametrize('expression', [
+    "__import__('os').system('true')",
+    "net_merit.__class__",
+    "[net_merit for net_merit in ()]",
+    "lambda: 1",
+    "net_merit if tpi else 0",
+    "net_merit and tpi",
+    "tpi[0]",
+    "'texto'",
+    "True",
+    "net_merit // 2",
+    "net_merit % 2",
+    "net_merit == 1",
+    "1 < tpi < 3",
+    "max(tpi=1, net_merit=2)",
+    "sqrt(tpi, 2)",
+    "eval('1')",
+    "unknown_trait * 2",
+    "tpi +",
+])
+def test_rejects_disallowed_constructs(expression):
+    with pytest.raises(ValueError):
+        compile_formula(expression)
+
+
+@pytest.mark.parametrize('expression', ['', '   ', None, 'tpi + ' * 100 + 'tpi'])
+def test_rejects_empty_or_long(expression):
+    with pytest.raises(ValueError):
+        compile_formula(expression)
+
+
+def test_evaluates_over_arrays():
+    formula = compile_formula('0.5*net_merit + (tpi > 2800) * 10 - 2*max(0, inbreeding - 6)')
+    assert formula.traits == ('net_merit', 'tpi')
+    values = {'net_merit': np.array([100.0, 200.0, 300.0]), 'tpi': np.array([2700.0, 2900.0, 3000.0])}
+    result = formula.evaluate(values, {}, (3,), inbreeding=np.array([5.0, 7.0, 8.0]))
+    np.testing.assert_allclose(result, [50.0, 108.0, 156.0])
+
+
+def test_z_scores_use_population_stats():
+    formula = compile_formula('net_merit_z')
+    values = {'net_merit': np.array([100.0, np.nan])}
+    result = formula.evaluate(values, {'net_merit': {'mean': 50.0, 'std': 25.0}}, (2,))
+    np.testing.assert_allclose(result, [2.0, 0.0])
+
+
+def test_mating_variables_require_pairs():
+    formula = compile_formula('iep + tpi')
+    with pytest.raises(ValueError):
+        formula.evaluate({'tpi': np.array([1.0])}, {}, (1,))
+
+
+def test_cache_normalizes_whitespace():
+    assert compile_formula('tpi  +   1') is compile_formula(' tpi + 1 ')
+
+
+@pytest.mark.parametrize('expression', ['(-8) ** 0.5', '(0 - 8) ** (1 / 3) * tpi', 'tpi ** 0.5'])
+def test_negative_fractional_power_is_nan_not_complex(expression):
+    formula = compile_formula(expression)
+    result = formula.evaluate({'tpi': np.array([-4.0, 9.0])}, {}, (2,))
+    assert result.dtype == float
+    assert np.isnan(result[0])
+
+
+def test_constants_follow_array_arithmetic():
+    formula = compile_formula('tpi / 0 + 1 / 0')
+    result = formula.evaluate({'tpi': np.array([1.0, 2.0])}, {}, (2,))
+    np.testing.assert_array_equal(result, [np.inf, np.inf])
+    np.testing.assert_allclose(compile_formula('2 ** 3 - 1').evaluate({}, {}, (2,)), [7.0, 7.0])
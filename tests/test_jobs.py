@@ -0,0 +1,90 @@
+"""
+Jobs de lote: retomada de jobs abandonados (heartbeat antigo) do ponto em que pararam
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.models.database import BatchJob, BatchJobResult, BatchMating, get_session
+from backend.services import jobs
+from backend.services.jobs import BatchJobManager, STALE_AFTER, job_status
+from tests.conftest import add_bull, add_female
+
+
+@pytest.fixture
+def herd(session, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_CHUNK', 2)
+    females = [add_female(session, f'COW{k}', milk=200.0 * k, net_merit=50.0 * k, genomic_inbreeding=4.0)
+               for k in range(1, 6)]
+    for k in range(1, 4):
+        add_bull(session, f'7HO0000{k}', milk=400.0 * k, net_merit=150.0 * k, gfi=4.0 + k)
+    return [female.id for female in females]
+
+
+def abandoned_job(session, female_ids, heartbeat_age):
+    """Job que outro processo começou: 2 fêmeas com resultado gravado e heartbeat de `heartbeat_age` s atrás"""
+    started = datetime.now() - timedelta(seconds=heartbeat_age + 60)
+    job = BatchJob(status='running', female_ids=female_ids, params={'top_n': 2, 'max_inbreeding': 8.0},
+                   total=len(female_ids), completed=2, worker='dead-host:1', started_at=started,
+                   resumed_at=started, heartbeat_at=datetime.now() - timedelta(seconds=heartbeat_age))
+    session.add(job)
+    session.flush()
+    for position, female_id in enumerate(female_ids[:2]):
+        session.add(BatchJobResult(job_id=job.id, position=position, female_id=female_id,
+                                   result={'female': {'id': female_id}, 'top_bulls': []}))
+    session.commit()
+    return job.id
+
+
+def run_pending(engine):
+    manager = BatchJobManager(lambda: get_session(engine))
+    resumed = manager.resume_pending()
+    manager._pool.shutdown(wait=True)
+    return manager, resumed
+
+
+def test_stale_job_resumes_from_first_missing_female(engine, session, herd):
+    job_id = abandoned_job(session, herd, STALE_AFTER + 30)
+    manager, resumed = run_pending(engine)
+    assert resumed == [job_id]
+
+    session.expire_all()
+    job = session.get(BatchJob, job_id)
+    assert (job.status, job.completed, job.resumed_from, job.worker) == ('completed', 5, 2, manager.worker_id)
+    results = session.query(BatchJobResult).filter(BatchJobResult.job_id == job_id) \
+        .order_by(BatchJobResult.position).all()
+    assert [row.position for row in results] == list(range(5))
+    assert [row.female_id for row in results] == herd
+    assert results[0].result['top_bulls'] == []  # resultados já gravados não são refeitos
+    assert all(row.result['top_bulls'] for row in results[2:])
+
+    batch = session.get(BatchMating, job.batch_mating_id)
+    assert [result['female']['id'] for result in batch.recommendations['results']] == herd
+    assert job_status(job)['progress']['percent'] == 100.0
+
+
+def test_job_with_recent_heartbeat_is_left_alone(engine, session, herd):
+    job_id = abandoned_job(session, herd, 5)
+    _, resumed = run_pending(engine)
+    assert resumed == []
+
+    session.expire_all()
+    job = session.get(BatchJob, job_id)
+    assert (job.status, job.completed, job.worker) == ('running', 2, 'dead-host:1')
+
+
+def test_monitor_picks_up_jobs_abandoned_later(engine, session, herd):
+    manager = BatchJobManager(lambda: get_session(engine))
+    assert manager.resume_pending() == []
+    job_id = abandoned_job(session, herd, STALE_AFTER + 30)  # abandonado depois da criação do gerenciador
+
+    manager.start_monitor(interval=0.05)
+    deadline = datetime.now() + timedelta(seconds=10)
+    while datetime.now() < deadline:
+        session.expire_all()
+        if session.get(BatchJob, job_id).status == 'completed':
+            break
+    manager.stop_monitor()
+    manager._pool.shutdown(wait=True)
+    assert session.get(BatchJob, job_id).status == 'completed'
@@ -0,0 +1,66 @@
+"""
+Plano de acasalamento: ganhos incrementais da busca local iguais à diferença do objetivo
+"""
+
+import numpy as np
+import pytest
+
+from backend.services.mating_plan import PlanProblem, PlanSearch, optimize_plan
+
+
+def make_problem(seed, n_females=8, n_bulls=4, weight=2.0):
+    rng = np.random.default_rng(seed)
+    merit = rng.uniform(40, 90, size=(n_females, n_bulls))
+    merit[rng.random(merit.shape) < 0.15] = -np.inf
+    coancestry = rng.uniform(0, 0.25, size=(n_bulls, n_bulls))
+    coancestry = (coancestry + coancestry.T) / 2
+    np.fill_diagonal(coancestry, 0.5 + rng.uniform(0, 0.1, n_bulls))
+    return PlanProblem(merit=merit, coancestry=coancestry,
+                       dam_coancestry=rng.uniform(0, 0.1, n_bulls) * n_females,
+                       capacity=rng.integers(1, 4, size=n_bulls), weight=weight)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_gain_equals_objective_difference(seed):
+    problem = make_problem(seed)
+    rng = np.random.default_rng(100 + seed)
+    search = PlanSearch(problem)
+    search.construct(rng.permutation(len(problem.merit)))
+
+    for female in range(len(problem.merit)):
+        gain = search._gain(female)
+        before = problem.objective(search.assignment)
+        for bull in range(len(problem.capacity)):
+            if not np.isfinite(gain[bull]):
+                continue
+            moved = search.assignment.copy()
+            moved[female] = bull
+            assert gain[bull] == pytest.approx(problem.objective(moved) - before, abs=1e-9)
+
+
+def test_gain_blocks_full_bulls_and_current_bull():
+    problem = make_problem(0)
+    search = PlanSearch(problem)
+    search.construct(np.arange(len(problem.merit)))
+    usage = np.bincount(search.assignment[search.assignment >= 0], minlength=len(problem.capacity))
+    for female in range(len(problem.merit)):
+        gain = search._gain(female)
+        current = search.assignment[female]
+        blocked = usage >= problem.capacity
+        if current >= 0:
+            blocked[current] = True
+        assert np.isneginf(gain[blocked]).all()
+
+
+def test_search_respects_capacity_and_never_worsens_start():
+    problem = make_problem(3, n_females=10)
+    start = PlanSearch(problem)
+    start.construct(np.arange(len(problem.merit)))
+    start_objective = problem.objective(start.assignment)
+
+    plan, runs = optimize_plan(problem, start=start.assignment, restarts=3)
+    usage = np.bincount(plan[plan >= 0], minlength=len(problem.capacity))
+    assert (usage <= problem.capacity).all()
+    assert np.isfinite(problem.merit[np.flatnonzero(plan >= 0), plan[plan >= 0]]).all()
+    assert runs[0][0] >= start_objective - 1e-9
+    assert problem.objective(plan) == pytest.approx(max(objective for objective, _, _ in runs))
@@ -0,0 +1,61 @@
+"""
+Scoring em pool de processos: junção das fatias idêntica à execução serial
+"""
+
+import numpy as np
+import pytest
+
+from backend.services import parallel
+from backend.services.genetics import GeneticCalculator
+from backend.services.parallel import score_components, shutdown_pool
+from backend.services.scoring import ScoringEngine
+from tests.test_scoring import make_animals
+
+
+@pytest.fixture
+def batch():
+    calculator = GeneticCalculator()
+    engine = ScoringEngine(calculator)
+    rng = np.random.default_rng(11)
+    females = engine.build_matrix(make_animals(rng, 300, False, calculator.iep_indices))
+    bulls = engine.build_matrix(make_animals(rng, 25, True, calculator.iep_indices), is_bull=True)
+    yield engine, females, bulls
+    shutdown_pool()
+
+
+def assert_same_components(actual, expected):
+    assert len(actual) == len(expected)
+    for (start, cols, scores), (start_e, cols_e, scores_e) in zip(actual, expected):
+        assert start == start_e
+        np.testing.assert_array_equal(cols, cols_e)
+        np.testing.assert_array_equal(scores.category_scores, scores_e.category_scores)
+        np.testing.assert_array_equal(scores.iep_normalized, scores_e.iep_normalized)
+        np.testing.assert_array_equal(scores.expected_inbreeding, scores_e.expected_inbreeding)
+
+
+def test_pool_merge_matches_serial(batch):
+    engine, females, bulls = batch
+    serial = score_components(engine, females, bulls, 8.0)
+    assert_same_components(score_components(engine, females, bulls, 8.0, workers=2, key='panel-1'), serial)
+
+    candidates = np.random.default_rng(1).random((len(females), len(bulls))) < 0.5
+    assert_same_components(score_components(engine, females, bulls, 8.0, candidates=candidates, workers=2, key='panel-1'),
+                           score_components(engine, females, bulls, 8.0, candidates=candidates))
+
+
+def test_pool_is_reused_until_key_changes(batch):
+    engine, females, bulls = batch
+    score_components(engine, females, bulls, 8.0, workers=2, key='panel-1')
+    pool = parallel._pool[2]
+    score_components(engine, females, bulls, 6.0, workers=2, key='panel-1')
+    assert parallel._pool[2] is pool
+
+    score_components(engine, females, bulls, 8.0, workers=2, key='panel-2')
+    assert parallel._pool[2] is not pool
+
+
+def test_small_or_unkeyed_batches_stay_in_process(batch):
+    engine, females, bulls = batch
+    score_components(engine, females.take(slice(0, 10)), bulls, 8.0, workers=2, key='panel-1')
+    score_components(engine, females, bulls, 8.0, workers=2)
+    assert parallel._pool is None
@@ -0,0 +1,92 @@
+"""
+Consanguinidade (Meuwissen & Luo) e coancestria (Colleau) num pedigree conhecido
+"""
+
+import numpy as np
+import pytest
+
+from backend.services.pedigree import Pedigree
+
+
+def family_pedigree():
+    """
+    Fundadores S1, D1, D2. F1 e F2: irmãos completos (S1 × D1); M1: meio-irmão (S1 × D2).
+    P1 = F1 × F2 (irmãos completos, F = 0.25); P2 = F1 × M1 (meio-irmãos, F = 0.125);
+    P3 = P1 × F2 (F = 0.375)
+    """
+    pedigree = Pedigree()
+    pedigree.update([
+        {'aliases': ['S1']}, {'aliases': ['D1']}, {'aliases': ['D2']},
+        {'aliases': ['F1'], 'sire': ['S1'], 'dam': ['D1']},
+        {'aliases': ['F2'], 'sire': ['S1'], 'dam': ['D1']},
+        {'aliases': ['M1'], 'sire': ['S1'], 'dam': ['D2']},
+        {'aliases': ['P1'], 'sire': ['F1'], 'dam': ['F2']},
+        {'aliases': ['P2'], 'sire': ['F1'], 'dam': ['M1']},
+        {'aliases': ['P3'], 'sire': ['P1'], 'dam': ['F2']},
+    ])
+    return pedigree
+
+
+@pytest.mark.parametrize('alias, expected', [
+    ('S1', 0.0), ('F1', 0.0), ('P1', 0.25), ('P2', 0.125), ('P3', 0.375),
+])
+def test_inbreeding_on_known_pedigree(alias, expected):
+    assert family_pedigree().inbreeding_of(alias) == pytest.approx(expected)
+
+
+def test_coancestry_is_inbreeding_of_progeny():
+    pedigree = family_pedigree()
+    assert pedigree.coancestry('F1', 'F2') == pytest.approx(0.25)
+    assert pedigree.coancestry('F1', 'M1') == pytest.approx(0.125)
+    assert pedigree.coancestry('P1', 'F2') == pytest.approx(0.375)
+    assert pedigree.coancestry('S1', 'S1') == pytest.approx(0.5)
+    assert pedigree.coancestry('F1', 'D2') == 0.0
+    assert pedigree.coancestry('D1', 'D2') is None  # dois fundadores: sem informação
+    assert pedigree.coancestry('F1', 'UNKNOWN') is None
+
+
+def test_coancestry_matrix_matches_pairwise():
+    pedigree = family_pedigree()
+    aliases = ['S1', 'D1', 'F1', 'F2', 'M1', 'P1', 'P2', 'P3', 'UNKNOWN']
+    matrix = pedigree.coancestry_matrix(aliases, aliases)
+    np.testing.assert_allclose(matrix, matrix.T)
+    for a, alias_a in enumerate(aliases):
+        for b, alias_b in enumerate(aliases):
+            value = pedigree.coancestry(alias_a, alias_b)
+            assert (np.isnan(matrix[a, b]) if value is None else matrix[a, b] == pytest.approx(value))
+
+
+def test_incremental_update_matches_full_build():
+    incremental = Pedigree()
+    incremental.update([{'aliases': ['F1']}, {'aliases': ['F2']}, {'aliases': ['P1'], 'sire': ['F1'], 'dam': ['F2']}])
+    revision = incremental.revision
+    # Pais de F1/F2 chegam depois: F do descendente precisa ser recalculado
+    incremental.update([
+        {'aliases': ['F1'], 'sire': ['S1'], 'dam': ['D1']},
+        {'aliases': ['F2'], 'sire': ['S1'], 'dam': ['D1']},
+    ])
+    assert incremental.revision != revision
+    assert incremental.inbreeding_of('P1') == pytest.approx(0.25)
+    assert incremental.update([{'aliases': ['P1'], 'sire': ['F1'], 'dam': ['F2']}]) == 0
+
+
+def test_lineage_hash_changes_only_with_ancestry():
+    pedigree = family_pedigree()
+    before = dict(zip(['P1', 'P2', 'D2'], pedigree.lineage_hashes(['P1', 'P2', 'D2'])))
+    pedigree.update([{'aliases': ['D2'], 'sire': ['X1'], 'dam': ['X2']}])
+    after = dict(zip(['P1', 'P2', 'D2'], pedigree.lineage_hashes(['P1', 'P2', 'D2'])))
+    assert after['P1'] == before['P1']
+    assert after['P2'] != before['P2']
+    assert after['D2'] != before['D2']
+    assert pedigree.lineage_hashes(['UNKNOWN']) == [None]
+
+
+def test_columns_computed_for_smaller_side():
+    pedigree = family_pedigree()
+    small, large = ['P1', 'P2'], ['S1', 'D1', 'D2', 'F1', 'F2', 'M1', 'P3']
+    matrix = pedigree.coancestry_matrix(small, large)
+    assert sorted(pedigree._columns) == sorted(pedigree.index(alias) for alias in small)
+    np.testing.assert_allclose(matrix, pedigree.coancestry_matrix(large, small).T)
+    for a, alias_a in enumerate(small):
+        for b, alias_b in enumerate(large):
+            assert matrix[a, b] == pytest.approx(pedigree.coancestry(alias_b, alias_a))
@@ -0,0 +1,65 @@
+"""
+Momentos de Welford: atualização incremental igual ao recálculo completo
+"""
+
+import numpy as np
+
+from backend.services.population import TraitMoments
+from backend.services.traits import TRAITS
+
+
+def sample(rng, n, missing=0.2):
+    matrix = rng.normal(10, 4, size=(n, len(TRAITS)))
+    matrix[rng.random(matrix.shape) < missing] = np.nan
+    return matrix
+
+
+def assert_same_moments(actual: TraitMoments, expected: TraitMoments):
+    np.testing.assert_array_equal(actual.n, expected.n)
+    np.testing.assert_allclose(actual.mean, expected.mean, atol=1e-9)
+    np.testing.assert_allclose(actual.m2, expected.m2, rtol=1e-9, atol=1e-9)
+
+
+def test_add_matches_batch():
+    matrix = sample(np.random.default_rng(1), 200)
+    moments = TraitMoments()
+    for row in matrix:
+        moments.add(row)
+    assert_same_moments(moments, TraitMoments.from_batch(matrix))
+
+
+def test_remove_and_update_match_recompute():
+    rng = np.random.default_rng(2)
+    matrix = sample(rng, 120)
+    moments = TraitMoments.from_batch(matrix)
+
+    for row in matrix[:30]:  # animais removidos
+        moments.remove(row)
+    changed = sample(rng, 20)
+    for old, new in zip(matrix[30:50], changed):  # animais alterados
+        moments.update(old, new)
+
+    assert_same_moments(moments, TraitMoments.from_batch(np.vstack([changed, matrix[50:]])))
+
+
+def test_remove_everything_resets():
+    matrix = sample(np.random.default_rng(3), 5, missing=0.0)
+    moments = TraitMoments.from_batch(matrix)
+    for row in matrix:
+        moments.remove(row)
+    assert_same_moments(moments, TraitMoments())
+
+
+def test_combine_matches_batch():
+    matrix = sample(np.random.default_rng(4), 300)
+    combined = TraitMoments()
+    for start in range(0, len(matrix), 70):
+        combined = combined.combine(TraitMoments.from_batch(matrix[start:start + 70]))
+    assert_same_moments(combined, TraitMoments.from_batch(matrix))
+    np.testing.assert_allclose(combined.std()[~np.isnan(matrix).all(axis=0)],
+                               np.nanstd(matrix, axis=0, ddof=1), rtol=1e-9)
+
+
+def test_json_round_trip():
+    moments = TraitMoments.from_batch(sample(np.random.default_rng(5), 50))
+    assert_same_moments(TraitMoments.from_json(moments.to_json()), moments)
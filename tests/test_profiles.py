@@ -0,0 +1,64 @@
+"""
+Vários perfis de pesos numa passada: idêntico a um scoring separado por perfil
+"""
+
+import numpy as np
+import pytest
+
+from backend.services.genetics import GeneticCalculator
+from backend.services.matching import MatchingService
+from backend.services.scoring import ScoringEngine
+from tests.conftest import add_bull, add_female
+from tests.test_scoring import make_animals
+
+PROFILES = {
+    'padrao': None,
+    'producao': {'production': 0.7, 'health': 0.2, 'type': 0.1},
+    'saude': {'health': 0.5, 'fertility': 0.3, 'production': 0.2},
+    'tipo': {'type': 1.0},
+}
+
+
+def test_reweight_profiles_equals_separate_scores():
+    calculator = GeneticCalculator()
+    rng = np.random.default_rng(11)
+    engine = ScoringEngine(calculator)
+    females = engine.build_matrix(make_animals(rng, 7, False, calculator.iep_indices))
+    bulls = engine.build_matrix(make_animals(rng, 12, True, calculator.iep_indices), is_bull=True)
+    scores = engine.score(females, bulls)
+
+    iep = engine.reweight_profiles(scores, list(PROFILES.values()))
+    assert iep.shape == (len(PROFILES),) + scores.shape
+    for k, weights in enumerate(PROFILES.values()):
+        np.testing.assert_array_equal(iep[k], engine.score(females, bulls, weights).iep_normalized)
+
+
+def test_match_profiles_equals_one_batch_per_profile(session):
+    females = [add_female(session, f'COW{k}', milk=200.0 * k, net_merit=80.0 * k, productive_life=0.6 * k,
+                          dpr=0.3 * k, udc=0.2 * (5 - k))
+               for k in range(1, 5)]
+    for k in range(1, 8):
+        add_bull(session, f'7HO0000{k}', milk=150.0 * (k % 4), net_merit=120.0 * k, productive_life=0.4 * (8 - k),
+                 dpr=0.5 * (k % 3), udc=0.3 * k, gfi=4.0 + 0.5 * k)
+    female_ids = [female.id for female in females]
+    service = MatchingService(session)
+
+    result = service.match_profiles(female_ids, PROFILES, max_inbreeding=8.0, top_n=4)
+    assert not all(item['overlap']['top1_agreement'] for item in result['results'])
+    for name, weights in PROFILES.items():
+        batch = service.match_batch(female_ids, weights, max_inbreeding=8.0, top_n=4, detail='summary')
+        expected = {item['female']['id']: [(bull['bull']['code'], bull['score']) for bull in item['top_bulls']]
+                    for item in batch['results']}
+        for item in result['results']:
+            ranked = [(bull['bull']['code'], bull['score']) for bull in item['profiles'][name]]
+            assert ranked == expected[item['female']['id']]
+
+
+def test_match_profiles_validates_profiles(session):
+    female = add_female(session, 'COW1', milk=300.0)
+    add_bull(session, '7HO00001', milk=500.0)
+    service = MatchingService(session)
+    with pytest.raises(ValueError):
+        service.match_profiles([female.id], {})
+    with pytest.raises(ValueError):
+        service.match_profiles([female.id], {'ruim': [0.5, 0.5]})
@@ -0,0 +1,80 @@
+"""
+Projeção das respostas: `detail` corta as partes pesadas sem mudar a ordem nem os scores,
+`fields` mantém só as chaves pedidas e o PPPV só é calculado quando pedido
+"""
+
+from backend.services.genetics import GeneticCalculator
+from tests.conftest import add_bull, add_female
+
+
+def build_herd(session):
+    females = [add_female(session, f'COW{k}', milk=250.0 * k, net_merit=90.0 * k, productive_life=0.4 * k)
+               for k in range(1, 4)]
+    bulls = [add_bull(session, f'7HO0000{k}', milk=400.0 * k, net_merit=150.0 * k, productive_life=0.8 * k, gfi=3.0 + k)
+             for k in range(1, 5)]
+    return females, bulls
+
+
+def batch(client, female_ids, **body):
+    response = client.post('/api/matings/batch', json={'female_ids': female_ids, 'top_n': 3, **body})
+    assert response.status_code == 200
+    return response.get_json()['results']
+
+
+def ranking(results):
+    return [[(bull['bull']['code'], bull['score']) for bull in item['top_bulls']] for item in results]
+
+
+def test_detail_levels_only_drop_sections(session, client):
+    females, _ = build_herd(session)
+    female_ids = [female.id for female in females]
+    summary = batch(client, female_ids, detail='summary')
+    categories = batch(client, female_ids)
+    full = batch(client, female_ids, detail='full')
+
+    assert ranking(summary) == ranking(categories) == ranking(full)
+    for item in summary:
+        assert 'main_indices' not in item['female']
+        assert all('categories' not in bull and 'full_analysis' not in bull for bull in item['top_bulls'])
+    for item in categories:
+        assert all('categories' in bull and 'full_analysis' not in bull for bull in item['top_bulls'])
+    for item in full:
+        assert all('categories' in bull and 'full_analysis' in bull for bull in item['top_bulls'])
+
+
+def test_fields_keep_only_requested_keys(session, client):
+    females, _ = build_herd(session)
+    results = batch(client, [female.id for female in females], fields='bull, score')
+    assert all(set(bull) == {'bull', 'score'} for item in results for bull in item['top_bulls'])
+
+    results = batch(client, [female.id for female in females], fields=['rank'])
+    assert [[bull['rank'] for bull in item['top_bulls']] for item in results] == [[1, 2, 3]] * len(females)
+
+
+def test_invalid_detail_is_rejected(session, client):
+    females, _ = build_herd(session)
+    response = client.post('/api/matings/batch', json={'female_ids': [females[0].id], 'detail': 'everything'})
+    assert response.status_code == 400
+
+
+def test_pppv_is_computed_only_when_requested(session, client, monkeypatch):
+    females, bulls = build_herd(session)
+    calls = []
+    original = GeneticCalculator.calculate_pppv
+
+    def calculate_pppv(self, female_data, bull_data, indices=None, **kwargs):
+        if indices is None:  # PPPV por índice da análise (a compatibilidade usa só os índices do IEP)
+            calls.append(bull_data)
+        return original(self, female_data, bull_data, indices, **kwargs)
+
+    monkeypatch.setattr(GeneticCalculator, 'calculate_pppv', calculate_pppv)
+    body = {'female_id': females[0].id, 'bull_id': bulls[0].id, 'save': False}
+
+    lean = client.post('/api/matings/manual', json={**body, 'fields': 'inbreeding'}).get_json()
+    assert list(lean['analysis']) == ['inbreeding']
+    assert calls == []
+
+    complete = client.post('/api/matings/manual', json=body).get_json()
+    assert {'pppv', 'inbreeding', 'compatibility'} <= set(complete['analysis'])
+    assert len(calls) == 1
+    assert complete['analysis']['inbreeding'] == lean['analysis']['inbreeding']
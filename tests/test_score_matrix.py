@@ -0,0 +1,112 @@
+"""
+Matriz materializada: linhas desatualizadas por registro, parâmetros ou ascendência,
+e atualização que refaz só o necessário
+"""
+
+import numpy as np
+
+from backend.models.database import get_session
+from backend.services.jobs import BatchJobManager
+from backend.services.matching import MatchingService
+from backend.services.panels import get_bull_panel
+from backend.services.score_matrix import ScoreMatrixStore
+from backend.services.scoring import ScoringEngine
+from tests.conftest import add_bull, add_female
+
+
+def build_herd(session):
+    females = [add_female(session, f'COW{k}', milk=300.0 * k, net_merit=100.0 * k, productive_life=0.5 * k,
+                          sire_naab='7HO09999' if k == 1 else None)
+               for k in range(1, 5)]
+    bulls = [add_bull(session, f'7HO0000{k}', milk=500.0 * k, net_merit=200.0 * k, productive_life=1.0 * k, gfi=6.0 + k)
+             for k in range(1, 4)]
+    return females, bulls
+
+
+def read_all(service, females, bulls):
+    return service.score_matrix().read(females, [bull.id for bull in bulls])
+
+
+def test_refresh_then_read_matches_scoring(session):
+    females, bulls = build_herd(session)
+    service = MatchingService(session)
+    assert read_all(service, females, bulls) is None
+
+    stats = service.score_matrix().refresh()
+    assert (stats['rows_refreshed'], stats['columns_refreshed']) == (4, 3)
+    assert service.score_matrix().refresh()['rows_refreshed'] == 0
+
+    stored = read_all(service, females, bulls)
+    engine = service.engine
+    records = [service.calculator.cached_record(female, service._prepare_female_data) for female in females]
+    scores = engine.score(engine.build_matrix(records), get_bull_panel(session, engine).matrix)
+    np.testing.assert_allclose(stored.iep, scores.iep_normalized, atol=1e-4)
+    np.testing.assert_allclose(stored.inbreeding, scores.expected_inbreeding, atol=1e-4)
+
+
+def test_changed_female_refreshes_only_her_row(session):
+    females, bulls = build_herd(session)
+    service = MatchingService(session)
+    service.score_matrix().refresh()
+
+    females[2].milk = 5000.0
+    session.commit()
+    assert read_all(service, females, bulls) is None
+    assert read_all(service, [females[0]], bulls) is not None
+
+    stats = service.score_matrix().refresh()
+    assert (stats['rows_refreshed'], stats['columns_refreshed']) == (1, 0)
+    assert read_all(service, females, bulls) is not None
+
+
+def test_changed_bull_patches_only_its_column(session):
+    females, bulls = build_herd(session)
+    service = MatchingService(session)
+    service.score_matrix().refresh()
+
+    bulls[1].net_merit = 900.0
+    session.commit()
+    service = MatchingService(session)
+    stats = service.score_matrix().refresh()
+    assert (stats['rows_refreshed'], stats['columns_refreshed']) == (0, 1)
+    assert read_all(service, females, bulls) is not None
+
+
+def test_params_hash_change_marks_every_row_stale(session):
+    females, bulls = build_herd(session)
+    service = MatchingService(session)
+    service.score_matrix().refresh()
+
+    # Outras estatísticas populacionais = outro params_hash
+    calculator = service.calculator.snapshot(service.calculator.pedigree, {'milk': {'mean': 100.0, 'std': 50.0}},
+                                             {'bulls': 99})
+    store = ScoreMatrixStore(session, ScoringEngine(calculator), service._prepare_female_data)
+    assert store.read(females, [bull.id for bull in bulls]) is None
+    assert store.refresh()['rows_refreshed'] == len(females)
+
+
+def test_ancestry_change_marks_descendants_stale(session):
+    females, bulls = build_herd(session)
+    service = MatchingService(session)
+    service.score_matrix().refresh()
+
+    # O pai da COW1 entra no catálogo com pais conhecidos: a ascendência dela muda, o registro não
+    add_bull(session, '7HO09999', milk=100.0, genetic_data={'sire_naab': '7HO08888', 'mgs_naab': '7HO07777'})
+    service = MatchingService(session)
+    assert read_all(service, females[1:], bulls) is not None
+    assert read_all(service, females[:1], bulls) is None
+
+    stats = service.score_matrix().refresh()
+    assert (stats['rows_refreshed'], stats['columns_refreshed']) == (1, 1)
+
+
+def test_job_manager_refreshes_in_background(engine, session):
+    females, bulls = build_herd(session)
+    manager = BatchJobManager(lambda: get_session(engine))
+    manager.refresh_score_matrix()
+    manager.refresh_score_matrix()  # pedido durante a execução: uma passada extra, não duas simultâneas
+    manager._pool.shutdown(wait=True)
+
+    session.expire_all()
+    assert read_all(MatchingService(session), females, bulls) is not None
+    assert not manager._matrix_running
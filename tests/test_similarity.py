@@ -0,0 +1,87 @@
+"""
+Touros parecidos: vizinhos iguais à força bruta sobre os z-scores, filtros do painel e
+índice sincronizado só nas linhas de touros novos/alterados
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+from backend.services.matching import MatchingService
+from backend.services.panels import get_bull_panel
+from backend.services.similarity import SimilarityIndex, get_similarity_index
+from tests.conftest import add_bull
+
+TRAITS = ('milk', 'protein', 'net_merit', 'productive_life', 'scs', 'udc')
+
+
+@pytest.fixture
+def catalog(session):
+    rng = np.random.default_rng(5)
+    bulls = []
+    for k in range(1, 25):
+        values = {trait: round(float(rng.normal(0, 2)) * 100 if trait in ('milk', 'net_merit') else float(rng.normal(0, 2)), 2)
+                  for trait in TRAITS if rng.random() < 0.85}
+        bulls.append(add_bull(session, f'7HO{k:05d}', gfi=round(float(rng.uniform(4, 12)), 1),
+                              source='SelectSires' if k % 3 else 'Semex', beta_casein='A2A2' if k % 2 else 'A1A2',
+                              doses_available=int(k % 5), is_available=k % 7 != 0, **values))
+    return bulls
+
+
+def brute_force(service, reference, candidates, k):
+    """Distância RMS em desvios padrão, nas características presentes no touro de referência"""
+    stats = service.calculator.population_stats
+    traits = [trait for trait in TRAITS if getattr(reference, trait) is not None]
+
+    def z(bull, trait):
+        value = getattr(bull, trait)
+        return 0.0 if value is None else (value - stats[trait]['mean']) / stats[trait]['std']
+
+    distances = [(math.sqrt(sum((z(bull, t) - z(reference, t)) ** 2 for t in traits) / len(traits)), bull.id, bull.code)
+                 for bull in candidates if bull.id != reference.id]
+    return [(code, round(distance, 3)) for distance, _, code in sorted(distances)[:k]]
+
+
+@pytest.mark.parametrize('filters, in_stock', [
+    (None, False),
+    ({'source': 'SelectSires', 'max_gfi': 9}, False),
+    ({'beta_casein': 'A2A2'}, True),
+])
+def test_neighbors_match_brute_force(session, catalog, filters, in_stock):
+    service = MatchingService(session)
+    reference = catalog[4]
+    result = service.similar_bulls(reference.code, k=6, filters=filters, in_stock=in_stock)
+
+    filters = filters or {}
+    candidates = [bull for bull in catalog if bull.is_available
+                  and bull.source == filters.get('source', bull.source)
+                  and bull.beta_casein == filters.get('beta_casein', bull.beta_casein)
+                  and bull.gfi <= filters.get('max_gfi', bull.gfi)
+                  and not (in_stock and bull.doses_available <= 0)]
+    assert [(item['bull']['code'], item['distance']) for item in result['similar']] == \
+           brute_force(service, reference, candidates, 6)
+    assert result['candidates'] == len([bull for bull in candidates if bull.id != reference.id])
+
+
+def test_changed_bulls_are_the_only_rows_rebuilt(session, catalog):
+    service = MatchingService(session)
+    stats = service.calculator.population_stats
+    first = get_similarity_index(get_bull_panel(session, service.engine), stats)
+    assert first.rebuilt_rows == len(catalog)
+
+    catalog[2].milk = 1500.0
+    session.commit()
+    add_bull(session, '7HO99999', milk=-300.0, net_merit=250.0)
+    panel = get_bull_panel(session, service.engine)
+    synced = get_similarity_index(panel, stats)
+
+    assert synced.rebuilt_rows == 2
+    full = SimilarityIndex.build(panel, stats)
+    np.testing.assert_array_equal(synced.vectors, full.vectors)
+    np.testing.assert_array_equal(synced.present, full.present)
+
+
+def test_unknown_bull(session, catalog):
+    with pytest.raises(ValueError):
+        MatchingService(session).similar_bulls('7HO00000')
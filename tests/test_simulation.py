@@ -0,0 +1,44 @@
+"""
+Simulação da progênie: reprodutível pela semente e entradas inválidas recusadas com 400
+"""
+
+import pytest
+
+from tests.conftest import add_bull, add_female
+
+
+@pytest.fixture
+def body(session):
+    female = add_female(session, 'COW1', milk=400.0, net_merit=300.0, productive_life=1.5)
+    bull = add_bull(session, '7HO00001', milk=900.0, net_merit=700.0, productive_life=3.0)
+    return {'female_ids': [female.id], 'bull_codes': [bull.code], 'draws': 2000,
+            'conditions': [{'trait': 'net_merit', 'op': '>', 'value': 500}]}
+
+
+def test_same_seed_same_result(client, body):
+    first = client.post('/api/matings/simulate', json={**body, 'seed': 42})
+    second = client.post('/api/matings/simulate', json={**body, 'seed': 42})
+    assert first.status_code == 200
+    assert first.get_json() == second.get_json()
+    probability = first.get_json()['results'][0]['probabilities']['net_merit > 500']
+    assert 0 < probability < 1
+
+
+@pytest.mark.parametrize('changes', [
+    {'seed': 'abc'},
+    {'seed': 1.5},
+    {'seed': True},
+    {'seed': -1},
+    {'seed': [1, 2]},
+    {'draws': 'muitos'},
+    {'draws': None},
+    {'draws': 0},
+    {'conditions': ['net_merit > 500']},
+    {'conditions': [{'trait': 'net_merit', 'op': '~', 'value': 500}]},
+    {'conditions': [{'trait': 'net_merit', 'value': 'alto'}]},
+    {'traits': ['inexistente']},
+])
+def test_invalid_input_is_rejected(client, body, changes):
+    response = client.post('/api/matings/simulate', json={**body, **changes})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
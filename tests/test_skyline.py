@@ -0,0 +1,59 @@
+"""
+Fronteira de Pareto: SFS igual à comparação de todos os pares, inclusive com empates e NaN
+"""
+
+import numpy as np
+import pytest
+
+from backend.services.matching import MatchingService
+from backend.services.skyline import pareto_front
+from tests.conftest import add_bull, add_female
+
+
+def brute_force(values):
+    values = np.where(np.isnan(values), -np.inf, values)
+    return {i for i in range(len(values))
+            if not any(np.all(values[j] >= values[i]) and np.any(values[j] > values[i])
+                       for j in range(len(values)) if j != i)}
+
+
+@pytest.mark.parametrize('seed', range(12))
+def test_front_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    n, m = int(rng.integers(1, 60)), int(rng.integers(1, 5))
+    # Valores inteiros pequenos: muitos empates e pontos repetidos
+    values = rng.integers(0, 6, size=(n, m)).astype(float)
+    values[rng.random(values.shape) < 0.1] = np.nan
+
+    front, comparisons = pareto_front(values)
+    assert len(set(front.tolist())) == len(front)
+    assert set(front.tolist()) == brute_force(values)
+    assert comparisons <= n * (n - 1) // 2
+
+
+def test_empty_and_single_objective():
+    front, comparisons = pareto_front(np.empty((0, 2)))
+    assert len(front) == 0 and comparisons == 0
+
+    values = np.array([[3.0], [5.0], [5.0], [1.0]])
+    assert sorted(pareto_front(values)[0].tolist()) == [1, 2]
+
+
+def test_pareto_bulls_frontier_is_non_dominated(session):
+    female = add_female(session, 'COW1', milk=300.0, productive_life=1.0, genomic_inbreeding=6.0)
+    rng = np.random.default_rng(3)
+    for k in range(1, 16):
+        add_bull(session, f'7HO{k:05d}', milk=round(float(rng.normal(500, 400)), 0),
+                 productive_life=round(float(rng.normal(1, 2)), 1), gfi=round(float(rng.uniform(4, 10)), 1))
+
+    result = MatchingService(session).pareto_bulls([female.id], ['milk', 'productive_life', 'inbreeding'],
+                                                   max_inbreeding=8.0)
+    item = result['results'][0]
+    points = {bull['bull']['code']: (bull['objectives']['milk'], bull['objectives']['productive_life'],
+                                     -bull['objectives']['inbreeding']) for bull in item['frontier']}
+    assert 0 < item['frontier_size'] < item['eligible_bulls']
+    for code, point in points.items():
+        for other, rival in points.items():
+            if other != code:
+                assert not (np.all(np.array(rival) >= point) and np.any(np.array(rival) > point))
+    assert sum(bull['dominates'] for bull in item['frontier']) >= item['eligible_bulls'] - item['frontier_size']